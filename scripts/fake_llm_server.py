@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""OpenAI 兼容的本地模拟 LLM 服务
+
+用于压测与延迟测试：把 DEEPSEEK_BASE_URL 指向本服务，即可在不消耗真实配额的情况下
+跑完整的图。支持流式与非流式 chat completions，可配置首 token 延迟分布与输出速率，
+按规则返回固定回复（检查类提示返回 YES、评估提示返回 SATISFIED 等），并可按比例
+注入 429 与超时。限流头 x-ratelimit-* 与 retry-after 的格式与服务商一致，
+可用于验证速率调度与对冲。
+
+用法:
+    uv run python -m scripts.fake_llm_server --port 9000 --latency lognormal:0.8,0.5 \\
+        --tokens-per-second 40 --error-rate 0.02 --timeout-rate 0.01
+    DEEPSEEK_BASE_URL=http://127.0.0.1:9000/v1 make dev
+
+规则文件为 JSON 数组，每项 {"pattern": 正则, "response": 回复}，按顺序匹配全部消息
+拼接后的文本，先于内置规则生效。
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from collections import Counter, deque
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from src.app.core.tokens import estimate_tokens, truncate_to_tokens
+
+# 流式输出的切分：拉丁单词（连同其后的空白）、连续空白或单个字符
+_CHUNK_RE = re.compile(r"[A-Za-z0-9_]+\s*|\s+|.", re.DOTALL)
+
+DEFAULT_ANSWER = "这是模拟服务生成的回答，用于压测与延迟测试，内容本身没有实际意义。"
+
+
+@dataclass
+class Rule:
+    """按正则匹配提示内容返回固定回复"""
+
+    name: str
+    pattern: re.Pattern[str]
+    response: str
+
+
+# 内置规则，对应 prompts/ 中各类提示的输出格式
+DEFAULT_RULES = [
+    Rule("select", re.compile(r"BEST: <候选编号>"), "候选 1 更完整、准确。\nBEST: 1"),
+    Rule("revise", re.compile(r'"op": "append"'), '[{"op": "append", "text": "补充说明。"}]'),
+    Rule("reflect", re.compile(r"请回复：SATISFIED"), "SATISFIED"),
+    Rule("gap_query", re.compile(r"只输出 NONE"), "NONE"),
+    Rule("check", re.compile(r"回答 YES 或 NO"), "YES"),
+    Rule("refine", re.compile(r"只输出查询词"), "模拟搜索查询"),
+    Rule("summarize", re.compile(r"只输出更新后的摘要"), "用户在进行压测，暂无需要保留的事实。"),
+]
+
+
+def parse_latency(spec: str) -> tuple[str, tuple[float, ...]]:
+    """解析延迟分布：fixed:秒 / uniform:下限,上限 / normal:均值,标准差 /
+    lognormal:中位数,sigma，纯数字等同于 fixed"""
+    kind, _, raw = spec.partition(":")
+    if not raw:
+        kind, raw = "fixed", kind
+    try:
+        params = tuple(float(value) for value in raw.split(","))
+    except ValueError:
+        raise ValueError(f"无效的延迟分布: {spec}") from None
+    arity = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+    if arity.get(kind) != len(params):
+        raise ValueError(f"无效的延迟分布: {spec}")
+    return kind, params
+
+
+def load_rules(path: str) -> list[Rule]:
+    """读取规则文件"""
+    items = json.loads(Path(path).read_text(encoding="utf-8"))
+    return [
+        Rule(item.get("name", f"custom_{i}"), re.compile(item["pattern"]), item["response"])
+        for i, item in enumerate(items)
+    ]
+
+
+@dataclass
+class FakeLLMConfig:
+    """模拟服务的行为配置"""
+
+    latency: str = "fixed:0"  # 首 token 延迟分布
+    tokens_per_second: float = 0.0  # 输出速率，0 表示不限速
+    error_rate: float = 0.0  # 返回 429 的比例
+    timeout_rate: float = 0.0  # 挂起不响应的比例
+    timeout_seconds: float = 600.0  # 挂起时长，应大于客户端超时
+    retry_after: int = 1  # 429 的 retry-after 秒数
+    rpm: int = 0  # 每分钟请求上限（超出返回 429），0 表示不限制
+    tpm: int = 0  # 每分钟 token 上限（超出返回 429），0 表示不限制
+    answer_tokens: int = 200  # 未匹配规则时默认回答的 token 数
+    rules: list[Rule] = field(default_factory=list)
+    seed: int | None = None
+
+
+class FakeLLM:
+    """模拟服务的状态：随机数、限流窗口与统计"""
+
+    def __init__(self, config: FakeLLMConfig) -> None:
+        self.config = config
+        self.latency = parse_latency(config.latency)
+        self.rules = [*config.rules, *DEFAULT_RULES]
+        self.random = random.Random(config.seed)
+        self.stats: Counter[str] = Counter()
+        self._window: deque[tuple[float, int]] = deque()  # 最近一分钟的 (时间, token 数)
+
+    def sample_latency(self) -> float:
+        kind, params = self.latency
+        if kind == "uniform":
+            value = self.random.uniform(*params)
+        elif kind == "normal":
+            value = self.random.gauss(*params)
+        elif kind == "lognormal":
+            median, sigma = params
+            value = median * self.random.lognormvariate(0, sigma) if median > 0 else 0.0
+        else:
+            value = params[0]
+        return max(value, 0.0)
+
+    def reply(self, messages: list[dict[str, Any]]) -> tuple[str, str]:
+        """按规则生成回复，返回 (回复, 规则名)"""
+        prompt = "\n".join(_content_text(message.get("content")) for message in messages)
+        for rule in self.rules:
+            if rule.pattern.search(prompt):
+                return rule.response, rule.name
+        repeat = self.config.answer_tokens // max(estimate_tokens(DEFAULT_ANSWER), 1) + 1
+        return truncate_to_tokens(DEFAULT_ANSWER * repeat, self.config.answer_tokens), "default"
+
+    def rate_limit(self, tokens: int) -> tuple[bool, dict[str, str]]:
+        """记录一次请求，返回 (是否超限, 限流响应头)"""
+        now = time.monotonic()
+        while self._window and self._window[0][0] <= now - 60:
+            self._window.popleft()
+        used_requests = len(self._window)
+        used_tokens = sum(count for _, count in self._window)
+        limited = (self.config.rpm and used_requests >= self.config.rpm) or (
+            self.config.tpm and used_tokens + tokens > self.config.tpm
+        )
+        if not limited:
+            self._window.append((now, tokens))
+            used_requests += 1
+            used_tokens += tokens
+        headers: dict[str, str] = {}
+        if self.config.rpm:
+            headers["x-ratelimit-limit-requests"] = str(self.config.rpm)
+            headers["x-ratelimit-remaining-requests"] = str(max(self.config.rpm - used_requests, 0))
+        if self.config.tpm:
+            headers["x-ratelimit-limit-tokens"] = str(self.config.tpm)
+            headers["x-ratelimit-remaining-tokens"] = str(max(self.config.tpm - used_tokens, 0))
+        return bool(limited), headers
+
+
+def _content_text(content: Any) -> str:
+    """消息内容可能是字符串或多段内容的列表"""
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return str(content or "")
+
+
+def _error(status: int, message: str, kind: str, headers: dict[str, str]) -> JSONResponse:
+    body = {"error": {"message": message, "type": kind, "code": kind}}
+    return JSONResponse(body, status_code=status, headers=headers)
+
+
+def _usage(prompt_tokens: int, completion_tokens: int) -> dict[str, Any]:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": 0},
+    }
+
+
+def create_app(config: FakeLLMConfig | None = None) -> FastAPI:
+    """创建模拟服务应用"""
+    fake = FakeLLM(config or FakeLLMConfig())
+    app = FastAPI(title="Fake LLM")
+    app.state.fake = fake
+
+    @app.get("/v1/models")
+    @app.get("/models")
+    async def models() -> dict[str, Any]:
+        return {"object": "list", "data": [{"id": "fake-llm", "object": "model"}]}
+
+    @app.get("/stats")
+    async def stats() -> dict[str, int]:
+        """请求、限流、超时与各规则命中次数"""
+        return dict(fake.stats)
+
+    @app.post("/v1/chat/completions", response_model=None)
+    @app.post("/chat/completions", response_model=None)
+    async def chat_completions(request: Request) -> JSONResponse | StreamingResponse:
+        body = await request.json()
+        messages = body.get("messages", [])
+        model = body.get("model", "fake-llm")
+        prompt_tokens = sum(estimate_tokens(_content_text(m.get("content"))) for m in messages)
+        text, rule = fake.reply(messages)
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens")
+        finish_reason = "stop"
+        if max_tokens and estimate_tokens(text) > max_tokens:
+            text, finish_reason = truncate_to_tokens(text, max_tokens), "length"
+        completion_tokens = estimate_tokens(text)
+        fake.stats["requests"] += 1
+
+        limited, headers = fake.rate_limit(prompt_tokens + completion_tokens)
+        if limited or fake.random.random() < fake.config.error_rate:
+            fake.stats["rate_limited"] += 1
+            headers["retry-after"] = str(fake.config.retry_after)
+            return _error(429, "Rate limit reached (fake)", "rate_limit_exceeded", headers)
+        if fake.random.random() < fake.config.timeout_rate:
+            fake.stats["timeouts"] += 1
+            await asyncio.sleep(fake.config.timeout_seconds)
+            return _error(504, "Upstream timeout (fake)", "timeout", headers)
+        fake.stats[f"rule_{rule}"] += 1
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        ttft = fake.sample_latency()
+        rate = fake.config.tokens_per_second
+
+        if not body.get("stream"):
+            fake.stats["completions"] += 1
+            await asyncio.sleep(ttft + (completion_tokens / rate if rate else 0.0))
+            return JSONResponse(
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": text},
+                            "finish_reason": finish_reason,
+                        }
+                    ],
+                    "usage": _usage(prompt_tokens, completion_tokens),
+                },
+                headers=headers,
+            )
+
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        def chunk(choices: list[dict[str, Any]], **extra: Any) -> str:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": choices,
+                **extra,
+            }
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        def delta(content: dict[str, Any], finish: str | None = None) -> str:
+            return chunk([{"index": 0, "delta": content, "finish_reason": finish}])
+
+        async def stream() -> AsyncIterator[str]:
+            fake.stats["streams"] += 1
+            await asyncio.sleep(ttft)
+            yield delta({"role": "assistant", "content": ""})
+            for piece in _CHUNK_RE.findall(text):
+                if rate:
+                    await asyncio.sleep(estimate_tokens(piece) / rate)
+                yield delta({"content": piece})
+            yield delta({}, finish_reason)
+            if include_usage:
+                # 用量块的 choices 为空数组，与服务商一致
+                yield chunk([], usage=_usage(prompt_tokens, completion_tokens))
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream", headers=headers)
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的模拟 LLM 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument(
+        "--latency",
+        default="fixed:0",
+        help="首 token 延迟分布，如 fixed:0.5 / uniform:0.2,1 / normal:0.8,0.2 / lognormal:0.8,0.5",
+    )
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="输出速率，0 不限速")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="挂起不响应的比例")
+    parser.add_argument("--timeout-seconds", type=float, default=600.0, help="挂起时长")
+    parser.add_argument("--retry-after", type=int, default=1, help="429 的 retry-after 秒数")
+    parser.add_argument("--rpm", type=int, default=0, help="每分钟请求上限，0 不限制")
+    parser.add_argument("--tpm", type=int, default=0, help="每分钟 token 上限，0 不限制")
+    parser.add_argument("--answer-tokens", type=int, default=200, help="默认回答的 token 数")
+    parser.add_argument("--rules", help="规则文件（JSON 数组，先于内置规则匹配）")
+    parser.add_argument("--seed", type=int, help="随机种子，便于复现")
+    args = parser.parse_args()
+
+    config = FakeLLMConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        timeout_seconds=args.timeout_seconds,
+        retry_after=args.retry_after,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        answer_tokens=args.answer_tokens,
+        rules=load_rules(args.rules) if args.rules else [],
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""知识上下文管理
+
+检索结果以结构化条目（content / source / score）保存在状态的 knowledge_items 中，
+而不是不断拼接的长文本：新结果按 URL 与内容哈希去重后并入，按 Tavily 得分与
+问题的字面重合度重排，再按各节点的 token 预算装箱成提示词上下文。
+反思轮次再多，送入 LLM 的知识上下文也不超过预算。
+
+seen_sources 记录本次运行见过的全部去重键，反思轮次的增量检索据此跳过已有结果。
+"""
+
+import hashlib
+import re
+from collections.abc import Mapping
+from typing import Any
+
+from src.app.core.config import settings
+from src.app.core.metrics import metrics
+from src.app.core.tokens import estimate_tokens, truncate_to_tokens
+from src.app.services.answer_cache import cosine_similarity, ngram_vector
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _url_key(source: str) -> str | None:
+    """规范化 URL 作为去重键；非 URL 来源（如 Tavily AI 摘要）返回 None"""
+    if not source.startswith(("http://", "https://")):
+        return None
+    url = source.split("#", 1)[0].rstrip("/")
+    host, _, path = url.partition("://")[2].partition("/")
+    return f"{host.lower()}/{path}"
+
+
+def _content_hash(content: str) -> str:
+    normalized = _WHITESPACE_RE.sub(" ", content).strip().casefold()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def result_keys(result: dict[str, Any]) -> list[str]:
+    """检索结果的去重键（规范化 URL 与内容哈希）"""
+    keys = [_url_key(result.get("source", "")), _content_hash(result.get("content", ""))]
+    return [key for key in keys if key]
+
+
+def normalize_query(query: str) -> str:
+    """规范化查询用于判重"""
+    return _WHITESPACE_RE.sub(" ", query).strip().casefold()
+
+
+def filter_seen(results: list[dict], seen: list[str]) -> list[dict]:
+    """丢弃本次运行已见过的检索结果（即使已被挤出 knowledge_items 也不再重复并入）"""
+    seen_keys = set(seen)
+    fresh = [result for result in results if not seen_keys.intersection(result_keys(result))]
+    if len(fresh) < len(results):
+        metrics.inc("delta_retrieval_results_skipped_total", len(results) - len(fresh))
+    return fresh
+
+
+def format_item(item: dict[str, Any]) -> str:
+    """格式化单条知识"""
+    return f"[来源: {item.get('source') or '未知'}]\n{item.get('content', '')}"
+
+
+def merge_items(existing: list[dict[str, Any]], results: list[dict]) -> list[dict[str, Any]]:
+    """将新检索结果并入已有条目，按 URL 与内容哈希去重（重复时保留较高得分）"""
+    merged = [dict(item) for item in existing]
+    by_key: dict[str, dict[str, Any]] = {}
+    for item in merged:
+        for key in (_url_key(item.get("source", "")), _content_hash(item.get("content", ""))):
+            if key:
+                by_key[key] = item
+
+    for result in results:
+        content = result.get("content", "")
+        if not content:
+            continue
+        keys = result_keys(result)
+        duplicate = next((by_key[k] for k in keys if k in by_key), None)
+        if duplicate is not None:
+            duplicate["score"] = max(duplicate.get("score", 0.0), result.get("score", 0.0))
+            metrics.inc("knowledge_items_deduplicated_total")
+            continue
+        item = {
+            "content": content,
+            "source": result.get("source", ""),
+            "score": float(result.get("score", 0.0) or 0.0),
+        }
+        merged.append(item)
+        for key in keys:
+            by_key[key] = item
+    return merged
+
+
+def rerank(items: list[dict[str, Any]], question: str) -> list[dict[str, Any]]:
+    """按 Tavily 得分与问题字面重合度的加权和降序排列"""
+    weight = settings.knowledge_rerank_score_weight
+    question_vector = ngram_vector(question)
+
+    def relevance(item: dict[str, Any]) -> float:
+        overlap = cosine_similarity(question_vector, ngram_vector(item.get("content", "")))
+        score = float(item.get("score", 0.0))
+        return weight * min(score, 1.0) + (1 - weight) * overlap
+
+    return sorted(items, key=relevance, reverse=True)
+
+
+def pack_context(items: list[dict[str, Any]], question: str, budget: int) -> str:
+    """按相关度依次装入预算内能容纳的条目；首条即超出预算时截断首条"""
+    blocks: list[str] = []
+    remaining = budget
+    for item in rerank(items, question):
+        block = format_item(item)
+        tokens = estimate_tokens(block) + 2  # 条目间分隔
+        if tokens <= remaining:
+            blocks.append(block)
+            remaining -= tokens
+        elif not blocks and remaining > 0:
+            blocks.append(truncate_to_tokens(block, remaining))
+            remaining = 0
+    return "\n\n".join(blocks)
+
+
+def node_budget(node: str) -> int:
+    """节点的知识上下文 token 预算"""
+    budgets = settings.knowledge_token_budgets
+    return budgets.get(node, budgets.get("writer", 2000))
+
+
+def update_knowledge(
+    state: Mapping[str, Any], results: list[dict], question: str
+) -> dict[str, Any]:
+    """并入新检索结果，返回状态更新（knowledge_items + 按 writer 预算装箱的 knowledge_context
+    + 累计的 seen_sources）"""
+    items = merge_items(state.get("knowledge_items") or [], results)
+    items = rerank(items, question)[: settings.knowledge_max_items]
+    seen = list(state.get("seen_sources") or [])
+    for result in results:
+        seen.extend(key for key in result_keys(result) if key not in seen)
+    return {
+        "knowledge_items": items,
+        "knowledge_context": pack_context(items, question, node_budget("writer")),
+        "seen_sources": seen,
+    }
+
+
+def knowledge_for(state: Mapping[str, Any], node: str, question: str) -> str:
+    """按节点预算取知识上下文（无结构化条目时截断已有文本）"""
+    budget = node_budget(node)
+    items = state.get("knowledge_items")
+    if items:
+        context = pack_context(items, question, budget)
+    else:
+        context = truncate_to_tokens(state.get("knowledge_context", ""), budget)
+    metrics.observe("knowledge_context_tokens", estimate_tokens(context), node=node)
+    return context
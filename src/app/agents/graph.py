@@ -1,15 +1,31 @@
-"""Agent Graph 构建"""
+"""Agent Graph 构建
+
+按请求的 mode 选择不同的图变体，每个变体只编译一次并缓存：
+
+- fast: check → retrieve → generate → finalize，单次检索与生成，不做反思
+- standard: searcher → writer → reviewer，writer 至多运行 2 次（初稿 + 一次重写），
+  max_iterations 小于 2 时以其为准
+- thorough: searcher → writer → reviewer，反思循环直到满意或达到 max_iterations
+- parallel: searcher → candidates → judge，并行生成多个候选后一次比较选优，不做循环
+"""
+
+from functools import lru_cache
 
 from langgraph.graph import END, START, StateGraph
 from langgraph.graph.state import CompiledStateGraph
 
+from src.app.agents.nodes import check_node, finalize_node, generate_node, retrieve_node
 from src.app.agents.specialized_nodes import (
+    candidates_agent,
+    judge_agent,
+    reviewer_agent,
     searcher_agent,
     writer_agent,
-    reviewer_agent,
 )
-from src.app.agents.nodes import finalize_node
 from src.app.agents.state import AgentState
+from src.app.core.config import settings
+
+CHAT_MODES = ("fast", "standard", "thorough", "parallel")
 
 
 def route_after_reviewer(state: AgentState) -> str:
@@ -20,32 +36,83 @@ def route_after_reviewer(state: AgentState) -> str:
     return "finalize"
 
 
-def build_graph() -> CompiledStateGraph:
-    """构建多智能体协同 Graph"""
+def build_graph(max_iterations: int | None = None) -> CompiledStateGraph:
+    """构建多智能体协同 Graph（max_iterations 为反思轮次上限，默认使用配置）"""
     graph = StateGraph(AgentState)
 
+    async def reviewer(state: AgentState) -> dict:
+        return await reviewer_agent(state, max_iterations=max_iterations)
+
     # 添加专家节点
     graph.add_node("searcher", searcher_agent)
     graph.add_node("writer", writer_agent)
-    graph.add_node("reviewer", reviewer_agent)
+    graph.add_node("reviewer", reviewer)
     graph.add_node("finalize", finalize_node)
 
     # 定义流程
     graph.add_edge(START, "searcher")
     graph.add_edge("searcher", "writer")
     graph.add_edge("writer", "reviewer")
-    
+
     # Reviewer 决定是打回重写还是最终交付
     graph.add_conditional_edges(
-        "reviewer", 
-        route_after_reviewer, 
-        {"searcher": "searcher", "finalize": "finalize"}
+        "reviewer", route_after_reviewer, {"searcher": "searcher", "finalize": "finalize"}
     )
-    
+
     graph.add_edge("finalize", END)
 
     return graph.compile()
 
 
+def build_fast_graph() -> CompiledStateGraph:
+    """构建单次检索 + 生成的快速 Graph"""
+    graph = StateGraph(AgentState)
+
+    graph.add_node("check", check_node)
+    graph.add_node("retrieve", retrieve_node)
+    graph.add_node("generate", generate_node)
+    graph.add_node("finalize", finalize_node)
+
+    graph.add_edge(START, "check")
+    graph.add_edge("check", "retrieve")
+    graph.add_edge("retrieve", "generate")
+    graph.add_edge("generate", "finalize")
+    graph.add_edge("finalize", END)
+
+    return graph.compile()
+
+
+def build_parallel_graph() -> CompiledStateGraph:
+    """构建并行候选 + 单次比较评审的 Graph"""
+    graph = StateGraph(AgentState)
+
+    graph.add_node("searcher", searcher_agent)
+    graph.add_node("candidates", candidates_agent)
+    graph.add_node("judge", judge_agent)
+    graph.add_node("finalize", finalize_node)
+
+    graph.add_edge(START, "searcher")
+    graph.add_edge("searcher", "candidates")
+    graph.add_edge("candidates", "judge")
+    graph.add_edge("judge", "finalize")
+    graph.add_edge("finalize", END)
+
+    return graph.compile()
+
+
+@lru_cache
+def get_agent(mode: str = "thorough") -> CompiledStateGraph:
+    """获取模式对应的 Graph（编译一次后缓存）"""
+    if mode == "fast":
+        return build_fast_graph()
+    if mode == "standard":
+        return build_graph(max_iterations=min(2, settings.max_iterations))
+    if mode == "thorough":
+        return build_graph()
+    if mode == "parallel":
+        return build_parallel_graph()
+    raise ValueError(f"未知的运行模式: {mode}")
+
+
 # Agent 单例
-agent = build_graph()
+agent = get_agent("thorough")
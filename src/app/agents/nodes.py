@@ -1,21 +1,22 @@
 from typing import Any, cast
 
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.messages import AIMessage, HumanMessage
 
+from src.app.agents.context import knowledge_for, update_knowledge
 from src.app.agents.state import AgentState
+from src.app.agents.verdict import Verdict, parse_verdict, strip_verdict
 from src.app.core.config import settings
 from src.app.core.logging import logger
 from src.app.core.prompts import (
     CHECK_PROMPT_DEFAULT,
     CHECK_PROMPT_REFLECTION,
-    GENERATE_SYSTEM_PROMPT_BASE,
-    GENERATE_SYSTEM_PROMPT_KNOWLEDGE,
-    GENERATE_SYSTEM_PROMPT_REFLECTION,
     REFINE_PROMPT,
-    REFLECT_PROMPT,
+    build_reviewer_messages,
+    build_writer_messages,
+    record_prompt_cache,
 )
 from src.app.services.knowledge import knowledge_service
-from src.app.services.llm import llm
+from src.app.services.llm import ModelRole, model_registry
 
 
 def get_last_content(messages: list) -> str:
@@ -39,7 +40,7 @@ async def check_node(state: AgentState) -> dict[str, Any]:
     else:
         check_prompt = CHECK_PROMPT_DEFAULT.format(last_message=last_message)
 
-    response = await llm.ainvoke([HumanMessage(content=check_prompt)])
+    response = await model_registry.ainvoke(ModelRole.CHECK, [HumanMessage(content=check_prompt)])
     content = str(response.content)
     need_knowledge = "YES" in content.upper()
 
@@ -59,45 +60,31 @@ async def retrieve_node(state: AgentState) -> dict[str, Any]:
     # 如果有反思，优化查询
     if reflection:
         refine_prompt = REFINE_PROMPT.format(query=query, reflection=reflection)
-        response = await llm.ainvoke([HumanMessage(content=refine_prompt)])
+        response = await model_registry.ainvoke(
+            ModelRole.REFINE, [HumanMessage(content=refine_prompt)]
+        )
         query = str(response.content).strip()
         logger.info(f"优化后的查询: {query}")
 
     results = await knowledge_service.search(query)
 
     if results:
-        old_context = state.get("knowledge_context", "")
-        new_context = "\n\n".join(
-            [f"[来源: {r.get('source', '未知')}]\n{r.get('content', '')}" for r in results]
-        )
-        context = (
-            f"{old_context}\n\n--- 新检索结果 ---\n{new_context}" if old_context else new_context
-        )
-    else:
-        context = state.get("knowledge_context", "")
-
-    return {"knowledge_context": context}
+        return update_knowledge(state, results, get_last_content(messages))
+    return {"knowledge_context": state.get("knowledge_context", "")}
 
 
 async def generate_node(state: AgentState) -> dict[str, Any]:
     """生成回答"""
     messages = state["messages"]
-    knowledge_context = state.get("knowledge_context", "")
+    knowledge_context = knowledge_for(state, "writer", get_last_content(messages))
     reflection = state.get("reflection", "")
     iteration = state.get("iteration", 0)
 
-    system_prompt = GENERATE_SYSTEM_PROMPT_BASE
-
-    if knowledge_context:
-        system_prompt += GENERATE_SYSTEM_PROMPT_KNOWLEDGE.format(
-            knowledge_context=knowledge_context
-        )
-
-    if reflection and iteration > 0:
-        system_prompt += GENERATE_SYSTEM_PROMPT_REFLECTION.format(reflection=reflection)
-
-    all_messages = [SystemMessage(content=system_prompt)] + messages
-    response = await llm.ainvoke(all_messages)
+    all_messages = build_writer_messages(
+        messages, knowledge_context, reflection if iteration > 0 else ""
+    )
+    response = await model_registry.ainvoke(ModelRole.WRITE, all_messages)
+    record_prompt_cache("writer", response)
 
     logger.info(f"生成回答 (第 {iteration + 1} 轮)")
     return {"current_answer": str(response.content), "iteration": iteration + 1}
@@ -108,7 +95,7 @@ async def reflect_node(state: AgentState) -> dict[str, Any]:
     messages = state["messages"]
     question = get_last_content(messages)
     answer = state.get("current_answer", "")
-    knowledge_context = state.get("knowledge_context", "")
+    knowledge_context = knowledge_for(state, "reviewer", question)
     iteration = state.get("iteration", 0)
 
     # 达到最大迭代次数，直接满意
@@ -116,20 +103,17 @@ async def reflect_node(state: AgentState) -> dict[str, Any]:
         logger.info(f"达到最大迭代次数 {settings.max_iterations}，结束反思")
         return {"is_satisfied": True, "reflection": ""}
 
-    reflect_prompt = REFLECT_PROMPT.format(
-        question=question,
-        answer=answer,
-        knowledge_context=knowledge_context[:1000] if knowledge_context else "无外部知识",
+    response = await model_registry.ainvoke(
+        ModelRole.REVIEW, build_reviewer_messages(question, answer, knowledge_context)
     )
-
-    response = await llm.ainvoke([HumanMessage(content=reflect_prompt)])
+    record_prompt_cache("reviewer", response)
     response_text = str(response.content).strip()
 
-    if "SATISFIED" in response_text.upper() and "NEEDS_IMPROVEMENT" not in response_text.upper():
+    if parse_verdict(response_text) is Verdict.SATISFIED:
         logger.info("反思评估: 满意")
         return {"is_satisfied": True, "reflection": ""}
     else:
-        reflection = response_text.replace("NEEDS_IMPROVEMENT", "").strip()
+        reflection = strip_verdict(response_text)
         logger.info(f"反思评估: 需要改进 - {reflection[:50]}...")
         return {"is_satisfied": False, "reflection": reflection}
 
@@ -0,0 +1,101 @@
+"""回答补丁修订
+
+反思轮次中 writer 不再整篇重写：模型基于上一版回答与反思意见输出 JSON 编辑指令，
+在本地应用到上一版回答上。输出 token 只与改动量相关，而不是与整篇回答长度相关。
+
+支持的编辑指令（JSON 数组，或 {"edits": [...]}）：
+- {"op": "replace", "target": 原文片段, "text": 新内容}
+- {"op": "replace_section", "heading": 标题行, "text": 新内容}  替换标题及其下内容直到同级或更高级标题
+- {"op": "insert_after", "target": 原文片段, "text": 新内容}
+- {"op": "delete", "target": 原文片段}
+- {"op": "append", "text": 新内容}
+"""
+
+import json
+import re
+from typing import Any
+
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+_HEADING_RE = re.compile(r"^(#{1,6})\s+\S", re.MULTILINE)
+
+
+class RevisionError(ValueError):
+    """编辑指令无法解析或无法应用（调用方回退为整篇重写）"""
+
+
+def parse_edits(text: str) -> list[dict[str, Any]]:
+    """解析模型输出的编辑指令"""
+    raw = _FENCE_RE.sub("", text.strip())
+    try:
+        data = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise RevisionError(f"编辑指令不是合法 JSON: {e}") from e
+    if isinstance(data, dict):
+        data = data.get("edits")
+    if not isinstance(data, list) or not all(isinstance(edit, dict) for edit in data):
+        raise RevisionError("编辑指令应为对象数组")
+    return data
+
+
+def _require(edit: dict[str, Any], field: str) -> str:
+    value = edit.get(field)
+    if not isinstance(value, str) or (field != "text" and not value):
+        raise RevisionError(f"{edit.get('op')} 缺少字段 {field}")
+    return value
+
+
+def _locate(answer: str, target: str) -> int:
+    index = answer.find(target)
+    if index < 0:
+        raise RevisionError(f"原文中找不到片段: {target[:30]}")
+    return index
+
+
+def _section_span(answer: str, heading: str) -> tuple[int, int]:
+    """标题所在章节的起止位置（到下一个同级或更高级标题为止）"""
+    heading = heading.strip()
+    for match in _HEADING_RE.finditer(answer):
+        line_end = answer.find("\n", match.start())
+        line_end = len(answer) if line_end < 0 else line_end
+        if answer[match.start() : line_end].strip() != heading:
+            continue
+        level = len(match.group(1))
+        for following in _HEADING_RE.finditer(answer, line_end):
+            if len(following.group(1)) <= level:
+                return match.start(), following.start()
+        return match.start(), len(answer)
+    raise RevisionError(f"原文中找不到章节: {heading[:30]}")
+
+
+def apply_edit(answer: str, edit: dict[str, Any]) -> str:
+    """应用单条编辑指令"""
+    op = edit.get("op")
+    if op == "replace":
+        target = _require(edit, "target")
+        index = _locate(answer, target)
+        return answer[:index] + _require(edit, "text") + answer[index + len(target) :]
+    if op == "replace_section":
+        start, end = _section_span(answer, _require(edit, "heading"))
+        text = _require(edit, "text").rstrip("\n")
+        separator = "\n\n" if end < len(answer) else ""
+        return answer[:start] + text + separator + answer[end:]
+    if op == "insert_after":
+        target = _require(edit, "target")
+        end = _locate(answer, target) + len(target)
+        return answer[:end] + "\n\n" + _require(edit, "text").strip("\n") + answer[end:]
+    if op == "delete":
+        target = _require(edit, "target")
+        index = _locate(answer, target)
+        return answer[:index] + answer[index + len(target) :]
+    if op == "append":
+        return answer.rstrip("\n") + "\n\n" + _require(edit, "text").strip("\n")
+    raise RevisionError(f"未知的编辑指令: {op}")
+
+
+def apply_edits(answer: str, edits: list[dict[str, Any]]) -> str:
+    """依次应用编辑指令；任一条失败即整体失败，避免产出半改的回答"""
+    if not edits:
+        raise RevisionError("没有编辑指令")
+    for edit in edits:
+        answer = apply_edit(answer, edit)
+    return answer.strip()
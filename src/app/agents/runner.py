@@ -0,0 +1,399 @@
+"""Agent 运行管理
+
+将一次 Graph 执行封装为 AgentRun：后台任务负责驱动 astream，事件写入缓冲区并广播
+给所有订阅者。AgentRunManager 按请求键合并进行中的相同请求（single-flight），
+使并发的重复问题共享同一次执行，迟到的流式订阅者也能从头回放事件。
+每个事件带有递增序号 seq，缓冲区按条数有界，超出部分可溢写到磁盘，断线重连的
+客户端可凭 Last-Event-ID 重新挂到仍在执行（或刚结束）的运行上，只回放错过的事件。
+当最后一个订阅者/等待者离开且在宽限期内无人重连时，运行被取消（abandon），
+其下所有 LLM 与 HTTP 调用随任务取消一并中止。
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import time
+from collections.abc import AsyncGenerator, Callable
+from contextlib import suppress
+from pathlib import Path
+from typing import Any
+from uuid import uuid4
+
+from src.app.core.config import settings
+from src.app.core.logging import logger
+from src.app.core.metrics import metrics
+from src.app.services.accounting import RunAccounting, bind_accounting
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_message(message: str) -> str:
+    """归一化用户消息：折叠空白并忽略大小写"""
+    return _WHITESPACE_RE.sub(" ", message).strip().casefold()
+
+
+def make_run_key(message: str, context: str = "") -> str:
+    """根据归一化消息与会话上下文生成合并键"""
+    raw = f"{normalize_message(message)}\x00{context}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AgentRun:
+    """一次 Graph 执行及其事件缓冲"""
+
+    def __init__(
+        self,
+        key: str,
+        graph: Any,
+        state: dict[str, Any],
+        max_buffer: int | None = None,
+        spill_dir: str | None = None,
+        origin: str = "",
+    ) -> None:
+        self.key = key
+        self.origin = origin  # 发起请求的身份（模式、会话与消息），重连时用于校验请求一致
+        self.run_id = uuid4().hex
+        self.events: list[dict[str, Any]] = []  # 内存中的事件尾部
+        self.max_buffer = max_buffer or settings.stream_replay_max_events
+        self.spill_path: Path | None = None
+        spill_dir = settings.stream_spill_dir if spill_dir is None else spill_dir
+        if spill_dir:
+            self.spill_path = Path(spill_dir) / f"{self.run_id}.jsonl"
+        self._offset = 0  # 已移出内存（溢写或丢弃）的事件数
+        # 溢写：_unflushed 为已移出内存、尚未写入磁盘的事件，由后台任务批量写入；
+        # 前 _spilled 个事件已落盘，_spill_ends[seq] 为第 seq 个事件在文件中的结束位置
+        self._unflushed: list[dict[str, Any]] = []
+        self._spilled = 0
+        self._spill_ends: list[int] = [0]
+        self._spill_file: Any = None
+        self._spill_task: asyncio.Task | None = None
+        self._spill_discarded = False
+        self._abandon_timer: asyncio.TimerHandle | None = None
+        self.result: dict[str, Any] | None = None
+        self.error: BaseException | None = None
+        self.done = False
+        self.abandoned = False
+        self.started_at = time.perf_counter()
+        self.usage = RunAccounting()  # 本次运行全部 LLM 调用的用量
+        self._attached = 0  # 当前订阅者与等待者数量
+        self._graph = graph
+        self._state = state
+        self._cond = asyncio.Condition()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> "AgentRun":
+        """在后台启动执行"""
+        self._task = asyncio.create_task(self._execute(), name=f"agent-run-{self.run_id}")
+        self._task.add_done_callback(self._log_failure)
+        return self
+
+    def add_done_callback(self, callback: Any) -> None:
+        """注册执行结束回调"""
+        if self._task is None:
+            raise RuntimeError("AgentRun has not been started")
+        self._task.add_done_callback(lambda _: callback(self))
+
+    def _log_failure(self, task: asyncio.Task) -> None:
+        # 读取异常，避免仅有流式订阅者时出现 "exception was never retrieved"
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"[Runner] 运行 {self.run_id} 失败: {task.exception()}")
+
+    @property
+    def event_count(self) -> int:
+        """已产生的事件总数（即最新事件的 seq）"""
+        return self._offset + len(self.events)
+
+    async def _publish(self, event: dict[str, Any]) -> None:
+        async with self._cond:
+            event["seq"] = self.event_count + 1
+            self.events.append(event)
+            overflow = len(self.events) - self.max_buffer
+            if overflow > 0:
+                if self.spill_path is not None:
+                    self._unflushed += self.events[:overflow]
+                    if self._spill_task is None or self._spill_task.done():
+                        self._spill_task = asyncio.create_task(self._spill())
+                del self.events[:overflow]
+                self._offset += overflow
+            self._cond.notify_all()
+
+    async def _spill(self) -> None:
+        """在后台线程中批量溢写积压的事件（未配置溢写目录时移出的事件直接丢弃）"""
+        while self._unflushed and not self._spill_discarded and self.spill_path is not None:
+            batch = list(self._unflushed)
+            try:
+                ends = await asyncio.to_thread(self._write_spill, self.spill_path, batch)
+            except OSError as e:
+                logger.error(f"[Runner] 运行 {self.run_id} 溢写事件失败，停止溢写: {e}")
+                async with self._cond:
+                    self._unflushed.clear()
+                    self._close_spill()
+                    self.spill_path = None  # 此后移出内存的事件按丢弃处理，回放时产出 gap
+                return
+            async with self._cond:
+                del self._unflushed[: len(batch)]
+                self._spill_ends += ends
+                self._spilled += len(batch)
+            metrics.inc("agent_run_events_spilled_total", len(batch))
+        if self._spill_discarded:
+            self._close_spill()
+
+    def _write_spill(self, path: Path, events: list[dict[str, Any]]) -> list[int]:
+        """追加写入事件，返回每个事件在文件中的结束位置（文件句柄在运行期间保持打开）"""
+        if self._spill_file is None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._spill_file = path.open("wb")
+        ends = []
+        for event in events:
+            line = json.dumps(event, ensure_ascii=False, default=str) + "\n"
+            self._spill_file.write(line.encode("utf-8"))
+            ends.append(self._spill_file.tell())
+        self._spill_file.flush()
+        return ends
+
+    @staticmethod
+    def _read_spilled(path: Path, start: int, end: int) -> list[dict[str, Any]]:
+        """按文件位置读取一段已落盘的事件"""
+        with path.open("rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+        return [json.loads(line) for line in data.decode("utf-8").splitlines()]
+
+    def _close_spill(self) -> None:
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        if self._spill_discarded and self.spill_path is not None:
+            self.spill_path.unlink(missing_ok=True)
+
+    def discard_spill(self) -> None:
+        """关闭并删除溢写文件（后台写入进行中时由其结束后删除）"""
+        self._spill_discarded = True
+        if self._spill_task is None or self._spill_task.done():
+            self._close_spill()
+
+    async def _execute(self) -> dict[str, Any]:
+        final_state: dict[str, Any] = dict(self._state)
+        bind_accounting(self.usage)  # 任务拥有独立的上下文，图内的调用都记入本次运行
+        try:
+            async for mode, event in self._graph.astream(
+                self._state, stream_mode=["updates", "messages", "values"]
+            ):
+                if mode == "values":
+                    final_state = event
+                elif mode == "messages":
+                    chunk, metadata = event
+                    node_name = metadata.get("langgraph_node")
+                    content = chunk.content if isinstance(chunk.content, str) else ""
+                    if content and node_name in settings.stream_token_nodes:
+                        await self._publish(
+                            {"type": "token", "node": node_name, "content": content}
+                        )
+                else:
+                    for node_name, node_output in event.items():
+                        await self._publish(
+                            {"type": "step", "node": node_name, "output": node_output}
+                        )
+            self.result = final_state
+            metrics.observe("agent_run_tokens", self.usage.total_tokens)
+            metrics.observe("agent_run_cost", self.usage.summary()["cost"])
+            return final_state
+        except BaseException as e:
+            self.error = e
+            raise
+        finally:
+            if self._spill_task is not None:
+                with suppress(Exception):
+                    await asyncio.shield(self._spill_task)  # 结束时已产生的事件均已落盘
+            async with self._cond:
+                self.done = True
+                self._cond.notify_all()
+            metrics.observe("agent_run_duration_seconds", time.perf_counter() - self.started_at)
+
+    def _attach(self) -> None:
+        self._attached += 1
+        if self._abandon_timer is not None:
+            self._abandon_timer.cancel()
+            self._abandon_timer = None
+
+    def _detach(self) -> None:
+        """订阅者或等待者离开；若已无人关注，宽限期后仍无人重连则取消运行"""
+        self._attached -= 1
+        if self._attached > 0 or self.done or self.abandoned or self._task is None:
+            return
+        grace = settings.stream_resume_grace_seconds
+        if grace > 0:
+            self._abandon_timer = asyncio.get_running_loop().call_later(grace, self._abandon)
+        else:
+            self._abandon()
+
+    def _abandon(self) -> None:
+        """取消无人关注的运行"""
+        self._abandon_timer = None
+        if self._attached > 0 or self.done or self.abandoned or self._task is None:
+            return
+        self.abandoned = True
+        self._task.cancel()
+
+        used = self.usage.total_tokens
+        saved = max(0.0, metrics.mean("agent_run_tokens") - used)
+        metrics.inc("agent_runs_abandoned_total")
+        metrics.inc("agent_run_tokens_saved_total", saved)
+        logger.info(f"[Runner] 客户端已全部断开，取消运行 {self.run_id} (已用 {used} tokens)")
+
+    async def wait(self) -> dict[str, Any]:
+        """等待执行结果；单个等待者被取消不会影响共享执行"""
+        if self._task is None:
+            raise RuntimeError("AgentRun has not been started")
+        self._attach()
+        try:
+            return await asyncio.shield(self._task)
+        finally:
+            self._detach()
+
+    async def settled(self) -> None:
+        """等待后台任务及其结束回调执行完毕（不抛出运行的异常）"""
+        if self._task is not None:
+            await asyncio.wait([self._task])
+
+    async def subscribe(self, after: int = 0) -> AsyncGenerator[dict[str, Any], None]:
+        """订阅事件流：先回放 seq > after 的事件，再实时跟随直到执行结束
+
+        已移出内存的事件从溢写文件回放；未配置溢写时产出一个 gap 事件说明缺失条数。
+        调用方应使用 contextlib.aclosing 包裹，保证提前退出时及时释放订阅。
+        """
+        index = after
+
+        def ready() -> bool:
+            return self.event_count > index or self.done
+
+        self._attach()
+        try:
+            while True:
+                async with self._cond:
+                    await self._cond.wait_for(ready)
+                    batch: list[dict[str, Any]] = []
+                    on_disk: tuple[Path, int, int] | None = None
+                    if index < self._offset and self.spill_path is None:
+                        missed = self._offset - index
+                        batch = [{"type": "gap", "seq": self._offset, "missed": missed}]
+                    elif index < self._offset and self.spill_path is not None:
+                        if index < self._spilled:
+                            on_disk = (
+                                self.spill_path,
+                                self._spill_ends[index],
+                                self._spill_ends[self._spilled],
+                            )
+                        batch = [event for event in self._unflushed if event["seq"] > index]
+                    batch += self.events[max(index - self._offset, 0) :]
+                    finished = self.done
+                if on_disk is not None:
+                    # 已落盘的部分不会再变化，在锁外按位置读取
+                    batch = await asyncio.to_thread(self._read_spilled, *on_disk) + batch
+                if not batch and finished:
+                    return
+                for event in batch:
+                    yield event
+                index = batch[-1]["seq"] if batch else index
+        finally:
+            self._detach()
+
+
+class AgentRunManager:
+    """进行中运行的注册表，负责合并相同请求"""
+
+    def __init__(self) -> None:
+        self._in_flight: dict[str, AgentRun] = {}
+        self._by_id: dict[str, AgentRun] = {}  # 进行中及保留期内已结束的运行
+
+    def get(self, run_id: str) -> AgentRun | None:
+        """按 run_id 查找运行"""
+        return self._by_id.get(run_id)
+
+    def resolve_event_id(self, event_id: str | None) -> tuple[AgentRun, int] | None:
+        """解析 Last-Event-ID（格式 "<run_id>:<seq>"），返回可重连的运行与已收到的序号"""
+        if not event_id or ":" not in event_id:
+            return None
+        run_id, _, seq = event_id.rpartition(":")
+        run = self._by_id.get(run_id)
+        if run is None or run.abandoned or not seq.isdigit():
+            return None
+        return run, int(seq)
+
+    def get_or_start(
+        self,
+        key: str,
+        graph: Any,
+        state: dict[str, Any],
+        on_start: Callable[[AgentRun], None] | None = None,
+        origin: str = "",
+    ) -> AgentRun:
+        """返回同键的进行中运行，不存在则启动新运行
+
+        on_start 仅在新运行被创建时调用，用于注册只应执行一次的收尾逻辑（缓存、持久化等）。
+        """
+        if settings.chat_coalescing_enabled:
+            existing = self._in_flight.get(key)
+            if existing is not None and not existing.done and not existing.abandoned:
+                metrics.inc("agent_runs_coalesced_total")
+                logger.info(f"[Runner] 合并重复请求到运行 {existing.run_id}")
+                return existing
+
+        run = AgentRun(key, graph, state, origin=origin).start()
+        metrics.inc("agent_runs_started_total")
+        self._by_id[run.run_id] = run
+        run.add_done_callback(self._retain)
+        if on_start is not None:
+            on_start(run)
+        if settings.chat_coalescing_enabled:
+            self._in_flight[key] = run
+            run.add_done_callback(self._forget)
+        return run
+
+    def _forget(self, run: AgentRun) -> None:
+        if self._in_flight.get(run.key) is run:
+            del self._in_flight[run.key]
+
+    def _retain(self, run: AgentRun) -> None:
+        """运行结束后在保留期内仍可被重连回放，过期后释放"""
+
+        def expire() -> None:
+            self._by_id.pop(run.run_id, None)
+            run.discard_spill()
+
+        ttl = settings.stream_replay_ttl_seconds
+        if ttl > 0:
+            asyncio.get_running_loop().call_later(ttl, expire)
+        else:
+            expire()
+
+    @property
+    def in_flight_count(self) -> int:
+        return len(self._in_flight)
+
+    @property
+    def active_count(self) -> int:
+        """尚未结束的运行数（与是否开启合并无关）"""
+        return len(self._active_tasks())
+
+    def _active_tasks(self) -> list[asyncio.Task]:
+        return [
+            run._task
+            for run in self._by_id.values()
+            if run._task is not None and not run._task.done()
+        ]
+
+    async def drain(self, timeout: float) -> bool:
+        """等待所有已启动且未结束的运行（用于优雅停机），返回是否全部完成"""
+        tasks = self._active_tasks()
+        if not tasks:
+            return True
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            logger.warning(f"[Runner] 停机时仍有 {len(pending)} 个运行未完成")
+        return not pending
+
+
+# 运行管理单例
+run_manager = AgentRunManager()
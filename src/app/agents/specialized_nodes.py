@@ -1,19 +1,33 @@
+import asyncio
+import re
+import time
+from contextlib import aclosing
 from typing import Any
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.messages import HumanMessage
+from langgraph.constants import TAG_NOSTREAM
+from src.app.agents.context import filter_seen, knowledge_for, normalize_query, update_knowledge
+from src.app.agents.revision import RevisionError, apply_edits, parse_edits
 from src.app.agents.state import AgentState
+from src.app.agents.verdict import Verdict, parse_verdict, strip_verdict
 from src.app.core.config import settings
 from src.app.core.logging import logger
+from src.app.core.metrics import metrics
+from src.app.core.tokens import estimate_tokens
 from src.app.core.prompts import (
+    CANDIDATE_FRAMINGS,
     CHECK_PROMPT_DEFAULT,
     CHECK_PROMPT_REFLECTION,
-    GENERATE_SYSTEM_PROMPT_BASE,
-    GENERATE_SYSTEM_PROMPT_KNOWLEDGE,
-    GENERATE_SYSTEM_PROMPT_REFLECTION,
+    GAP_QUERY_PROMPT,
     REFINE_PROMPT,
-    REFLECT_PROMPT,
+    build_reviewer_messages,
+    build_revision_messages,
+    build_selector_messages,
+    build_writer_messages,
+    record_prompt_cache,
 )
 from src.app.services.knowledge import knowledge_service
-from src.app.services.llm import llm
+from src.app.services.retrieval_classifier import is_style_only, retrieval_classifier
+from src.app.services.llm import ModelRole, model_registry
 
 def get_last_content(messages: list) -> str:
     """获取最后一条消息的内容"""
@@ -22,71 +36,250 @@ def get_last_content(messages: list) -> str:
     content = messages[-1].content
     return str(content) if content is not None else ""
 
+async def timed_search(query: str) -> tuple[list[dict], float]:
+    """执行检索并返回耗时"""
+    started = time.perf_counter()
+    results = await knowledge_service.search(query)
+    return results, time.perf_counter() - started
+
+async def check_need_knowledge(last_message: str, reflection: str) -> bool:
+    """判断是否需要检索
+
+    首轮判断可先经过本地分类器：on 模式下置信的情况直接本地决定，省去一次 LLM 往返；
+    shadow 模式下仍以 LLM 为准，只统计两者的一致率与可节省的延迟。
+    """
+    mode = settings.retrieval_classifier_mode
+    decision = None
+    if mode in ("on", "shadow") and not reflection:
+        decision = retrieval_classifier.classify(last_message)
+        if decision is not None and mode == "on":
+            metrics.inc("retrieval_classifier_decisions_total", source=decision.source)
+            metrics.observe(
+                "retrieval_classifier_saved_seconds", metrics.mean("retrieval_check_llm_seconds")
+            )
+            logger.info(f"[Searcher] 本地判断 ({decision.source}): {decision.need_knowledge}")
+            return decision.need_knowledge
+
+    if reflection:
+        check_prompt = CHECK_PROMPT_REFLECTION.format(
+            reflection=reflection, last_message=last_message
+        )
+    else:
+        check_prompt = CHECK_PROMPT_DEFAULT.format(last_message=last_message)
+
+    started = time.perf_counter()
+    response = await model_registry.ainvoke(
+        ModelRole.CHECK, [HumanMessage(content=check_prompt)]
+    )
+    record_prompt_cache("check", response)
+    elapsed = time.perf_counter() - started
+    need_knowledge = "YES" in str(response.content).upper()
+
+    if not reflection:
+        metrics.observe("retrieval_check_llm_seconds", elapsed)
+        if mode in ("on", "shadow"):
+            retrieval_classifier.record(last_message, need_knowledge)
+            metrics.inc("retrieval_classifier_decisions_total", source="llm")
+    if decision is not None:
+        agree = decision.need_knowledge == need_knowledge
+        metrics.inc("retrieval_classifier_shadow_total", agree=str(agree).lower())
+        agreed = metrics.get_counter("retrieval_classifier_shadow_total", agree="true")
+        total = agreed + metrics.get_counter("retrieval_classifier_shadow_total", agree="false")
+        metrics.set_gauge("retrieval_classifier_agreement", agreed / total)
+        if agree:
+            metrics.observe("retrieval_classifier_saved_seconds", elapsed)
+    return need_knowledge
+
+_QUERY_PREFIX_RE = re.compile(r"^\s*(?:[-*•]|\d+[.、)）])\s*")
+
+
+def parse_gap_queries(text: str, searched: list[str]) -> list[str]:
+    """解析补充查询：每行一个，去掉编号，跳过 NONE 与已执行过的查询"""
+    seen = set(searched)
+    queries: list[str] = []
+    for line in text.splitlines():
+        query = _QUERY_PREFIX_RE.sub("", line).strip().strip("\"'“”")
+        if not query or query.upper() == "NONE":
+            continue
+        key = normalize_query(query)
+        if key in seen:
+            metrics.inc("delta_retrieval_queries_skipped_total")
+            continue
+        seen.add(key)
+        queries.append(query)
+    return queries[: settings.delta_retrieval_max_queries]
+
+
+async def delta_search(state: AgentState, last_message: str, reflection: str) -> dict[str, Any]:
+    """反思轮次的增量检索
+
+    只涉及表达方式的反思不检索；否则一次 LLM 调用把反思意见转换为针对缺失信息的查询
+    （同时取代是否需要检索的判断），跳过本次运行执行过的查询，并行检索后丢弃已见过的来源。
+    """
+    update: dict[str, Any] = {
+        "need_knowledge": False,
+        "knowledge_context": state.get("knowledge_context", ""),
+        "next_agent": "writer",
+    }
+    if is_style_only(reflection):
+        metrics.inc("delta_retrieval_total", outcome="style_only")
+        logger.info("[Searcher] 反思意见只涉及表达方式，跳过检索")
+        return update
+
+    searched = list(state.get("searched_queries") or [])
+    gap_prompt = GAP_QUERY_PROMPT.format(
+        query=last_message,
+        reflection=reflection,
+        used_queries="\n".join(searched) or "（无）",
+        max_queries=settings.delta_retrieval_max_queries,
+    )
+    response = await model_registry.ainvoke(ModelRole.REFINE, [HumanMessage(content=gap_prompt)])
+    queries = parse_gap_queries(str(response.content), searched)
+    if not queries:
+        metrics.inc("delta_retrieval_total", outcome="no_gap")
+        logger.info("[Searcher] 没有新的补充查询，跳过检索")
+        return update
+
+    logger.info(f"[Searcher] 补充查询: {queries}")
+    batches = await asyncio.gather(*(knowledge_service.search(query) for query in queries))
+    results = filter_seen(
+        [result for batch in batches for result in batch], state.get("seen_sources") or []
+    )
+    metrics.inc("delta_retrieval_total", outcome="searched")
+    update["need_knowledge"] = True
+    update["searched_queries"] = searched + [normalize_query(query) for query in queries]
+    if results:
+        update.update(update_knowledge(state, results, last_message))
+    return update
+
+
 async def searcher_agent(state: AgentState) -> dict[str, Any]:
     """
     Searcher Agent: 专门负责判断是否需要检索并执行检索。
+
+    开启 speculative_retrieval 时，首轮（无反思意见、查询即用户原问题）的检索与
+    判断调用并行发起；判断为 NO 时丢弃检索结果。开启 delta_retrieval 时，反思轮次
+    改由 delta_search 增量检索。
     """
     messages = state["messages"]
     last_message = get_last_content(messages)
     reflection = state.get("reflection", "")
-    
+
+    if reflection and settings.delta_retrieval:
+        return await delta_search(state, last_message, reflection)
+
+    speculation = None
+    if settings.speculative_retrieval and not reflection:
+        speculation = asyncio.create_task(timed_search(last_message))
+
     # 1. 判断是否需要检索
-    if reflection:
-        check_prompt = CHECK_PROMPT_REFLECTION.format(
-            reflection=reflection, last_message=last_message
-        )
-    else:
-        check_prompt = CHECK_PROMPT_DEFAULT.format(last_message=last_message)
+    check_started = time.perf_counter()
+    try:
+        need_knowledge = await check_need_knowledge(last_message, reflection)
+    except BaseException:
+        if speculation is not None:
+            speculation.cancel()
+        raise
+    check_elapsed = time.perf_counter() - check_started
+
+    if speculation is not None and not need_knowledge:
+        speculation.cancel()
+        metrics.inc("speculative_search_total", outcome="wasted")
 
-    response = await llm.ainvoke([HumanMessage(content=check_prompt)])
-    content = str(response.content)
-    need_knowledge = "YES" in content.upper()
-    
     # 2. 执行检索（如果需要）
-    context = state.get("knowledge_context", "")
+    update: dict[str, Any] = {}
     if need_knowledge:
         query = last_message
         if reflection:
             refine_prompt = REFINE_PROMPT.format(query=query, reflection=reflection)
-            response = await llm.ainvoke([HumanMessage(content=refine_prompt)])
+            response = await model_registry.ainvoke(
+                ModelRole.REFINE, [HumanMessage(content=refine_prompt)]
+            )
             query = str(response.content).strip()
             logger.info(f"[Searcher] 优化查询: {query}")
-        
-        results = await knowledge_service.search(query)
+
+        if speculation is not None:
+            results, search_elapsed = await speculation
+            # 串行执行时检索需等待判断结束，重叠部分即节省的延迟
+            metrics.inc("speculative_search_total", outcome="used")
+            metrics.observe("speculative_search_saved_seconds", min(check_elapsed, search_elapsed))
+        else:
+            results = await knowledge_service.search(query)
+        searched = list(state.get("searched_queries") or [])
+        update["searched_queries"] = [*searched, normalize_query(query)]
         if results:
-            new_context = "\n\n".join(
-                [f"[来源: {r.get('source', '未知')}]\n{r.get('content', '')}" for r in results]
-            )
-            context = f"{context}\n\n--- 新检索结果 ---\n{new_context}" if context else new_context
+            # 去重、重排并按预算装箱，避免上下文随反思轮次无限增长
+            update.update(update_knowledge(state, results, last_message))
 
     logger.info(f"[Searcher] 检索完成，need_knowledge: {need_knowledge}")
     return {
-        "need_knowledge": need_knowledge, 
-        "knowledge_context": context,
+        "need_knowledge": need_knowledge,
+        "knowledge_context": state.get("knowledge_context", ""),
+        **update,
         "next_agent": "writer"
     }
 
+def output_tokens(response: Any) -> int:
+    """响应的输出 token 数（无用量信息时按文本估算）"""
+    usage = getattr(response, "usage_metadata", None)
+    if isinstance(usage, dict) and usage.get("output_tokens"):
+        return int(usage["output_tokens"])
+    return estimate_tokens(str(response.content))
+
+
+async def revise_answer(
+    question: str, answer: str, reflection: str, knowledge_context: str
+) -> str | None:
+    """以编辑指令修订上一版回答；指令无法解析或应用时返回 None"""
+    response = await model_registry.ainvoke(
+        ModelRole.REVISE,
+        build_revision_messages(question, answer, reflection, knowledge_context),
+        config={"tags": [TAG_NOSTREAM]},  # 编辑指令不是回答正文，不逐 token 推送
+    )
+    record_prompt_cache("revise", response)
+    try:
+        revised = apply_edits(answer, parse_edits(str(response.content)))
+    except RevisionError as e:
+        metrics.inc("writer_revision_total", outcome="fallback")
+        logger.warning(f"[Writer] 补丁修订失败，改为整篇重写: {e}")
+        return None
+
+    tokens = output_tokens(response)
+    metrics.inc("writer_revision_total", outcome="applied")
+    metrics.observe("writer_output_tokens", tokens, mode="patch")
+    # 整篇重写的输出量约等于修订后回答的长度
+    metrics.observe("writer_patch_saved_tokens", max(estimate_tokens(revised) - tokens, 0))
+    return revised
+
+
 async def writer_agent(state: AgentState) -> dict[str, Any]:
     """
     Writer Agent: 专门负责根据上下文生成高质量回答。
+
+    writer_revision_mode 为 patch 时，反思轮次只输出针对上一版回答的编辑指令并在本地应用。
     """
     messages = state["messages"]
-    knowledge_context = state.get("knowledge_context", "")
+    question = get_last_content(messages)
+    knowledge_context = knowledge_for(state, "writer", question)
     reflection = state.get("reflection", "")
     iteration = state.get("iteration", 0)
+    previous = state.get("current_answer", "")
 
-    system_prompt = GENERATE_SYSTEM_PROMPT_BASE
-
-    if knowledge_context:
-        system_prompt += GENERATE_SYSTEM_PROMPT_KNOWLEDGE.format(
-            knowledge_context=knowledge_context
-        )
-
-    if reflection and iteration > 0:
-        system_prompt += GENERATE_SYSTEM_PROMPT_REFLECTION.format(reflection=reflection)
+    if settings.writer_revision_mode == "patch" and iteration > 0 and reflection and previous:
+        revised = await revise_answer(question, previous, reflection, knowledge_context)
+        if revised is not None:
+            logger.info(f"[Writer] 补丁修订回答 (第 {iteration + 1} 轮)")
+            return {"current_answer": revised, "iteration": iteration + 1, "next_agent": "reviewer"}
 
-    all_messages = [SystemMessage(content=system_prompt)] + messages
-    response = await llm.ainvoke(all_messages)
+    # 静态前缀 + 历史在前，知识与反思在当前问题之前，便于命中前缀缓存
+    all_messages = build_writer_messages(
+        messages, knowledge_context, reflection if iteration > 0 else ""
+    )
+    response = await model_registry.ainvoke(ModelRole.WRITE, all_messages)
+    record_prompt_cache("writer", response)
+    metrics.observe(
+        "writer_output_tokens", output_tokens(response), mode="full" if iteration > 0 else "initial"
+    )
 
     logger.info(f"[Writer] 生成回答 (第 {iteration + 1} 轮)")
     return {
@@ -95,38 +288,127 @@ async def writer_agent(state: AgentState) -> dict[str, Any]:
         "next_agent": "reviewer"
     }
 
-async def reviewer_agent(state: AgentState) -> dict[str, Any]:
+async def stream_verdict(messages: list) -> tuple[Verdict, str]:
+    """流式获取评估输出，结论为满意时立即停止生成；需要改进时读完改进意见
+
+    输出中没有结论关键词（空输出、被截断等）时按需要改进处理。
+    """
+    text = ""
+    stream = model_registry.astream(ModelRole.REVIEW, messages)
+    async with aclosing(stream):
+        async for chunk in stream:
+            if getattr(chunk, "usage_metadata", None):
+                record_prompt_cache("reviewer", chunk)
+            text += chunk.content if isinstance(chunk.content, str) else ""
+            if parse_verdict(text, final=False) is Verdict.SATISFIED:
+                metrics.inc("reviewer_early_stop_total")
+                return Verdict.SATISFIED, text
+    verdict = parse_verdict(text)
+    if verdict is None:
+        verdict = Verdict.NEEDS_IMPROVEMENT
+    return verdict, text.strip()
+
+
+async def reviewer_agent(state: AgentState, max_iterations: int | None = None) -> dict[str, Any]:
     """
     Reviewer Agent: 专门负责评估回答质量并决定下一步。
+
+    max_iterations 为本图的反思轮次上限，默认使用 settings.max_iterations。
     """
     messages = state["messages"]
     question = get_last_content(messages)
     answer = state.get("current_answer", "")
-    knowledge_context = state.get("knowledge_context", "")
+    knowledge_context = knowledge_for(state, "reviewer", question)
     iteration = state.get("iteration", 0)
 
     # 最大迭代次数检查
-    if iteration >= settings.max_iterations:
+    if iteration >= (max_iterations or settings.max_iterations):
         logger.info("[Reviewer] 达到最大迭代次数，满意结束")
         return {"is_satisfied": True, "reflection": "", "next_agent": "end"}
 
-    reflect_prompt = REFLECT_PROMPT.format(
-        question=question,
-        answer=answer,
-        knowledge_context=knowledge_context[:1000] if knowledge_context else "无外部知识",
+    verdict, response_text = await stream_verdict(
+        build_reviewer_messages(question, answer, knowledge_context)
     )
+    metrics.inc("reviewer_verdict_total", verdict=verdict.value)
 
-    response = await llm.ainvoke([HumanMessage(content=reflect_prompt)])
-    response_text = str(response.content).strip()
-
-    if "SATISFIED" in response_text.upper() and "NEEDS_IMPROVEMENT" not in response_text.upper():
+    if verdict is Verdict.SATISFIED:
         logger.info("[Reviewer] 评估结果: 满意")
         return {"is_satisfied": True, "reflection": "", "next_agent": "end"}
     else:
-        reflection = response_text.replace("NEEDS_IMPROVEMENT", "").strip()
+        reflection = strip_verdict(response_text)
         logger.info(f"[Reviewer] 评估结果: 不满意 - {reflection[:30]}...")
         return {
             "is_satisfied": False, 
             "reflection": reflection, 
             "next_agent": "searcher"
         }
+
+
+_BEST_RE = re.compile(r"BEST\s*[:：]\s*\[?(\d+)")
+
+async def candidates_agent(state: AgentState) -> dict[str, Any]:
+    """
+    Candidates Agent: 以不同温度与提问框架并行生成多个候选回答。
+    """
+    messages = state["messages"]
+    knowledge_context = knowledge_for(state, "writer", get_last_content(messages))
+    temperatures = settings.parallel_candidate_temperatures
+    count = settings.parallel_candidates
+
+    async def generate(index: int) -> str:
+        all_messages = build_writer_messages(
+            messages,
+            knowledge_context,
+            instruction=CANDIDATE_FRAMINGS[index % len(CANDIDATE_FRAMINGS)],
+        )
+        response = await model_registry.ainvoke(
+            ModelRole.WRITE, all_messages, temperature=temperatures[index % len(temperatures)]
+        )
+        record_prompt_cache("writer", response)
+        return str(response.content)
+
+    outcomes = await asyncio.gather(*(generate(i) for i in range(count)), return_exceptions=True)
+    candidates = [o for o in outcomes if isinstance(o, str) and o.strip()]
+    if not candidates:
+        errors = [o for o in outcomes if isinstance(o, BaseException)]
+        raise errors[0] if errors else RuntimeError("候选回答生成失败")
+
+    logger.info(f"[Candidates] 并行生成 {len(candidates)}/{count} 个候选回答")
+    return {
+        "candidates": candidates,
+        "current_answer": candidates[0],
+        "iteration": state.get("iteration", 0) + 1,
+        "next_agent": "judge",
+    }
+
+def parse_selection(text: str, count: int) -> int:
+    """解析评审输出中的 BEST 编号，返回从 0 开始的下标；无法解析时选第一个"""
+    match = _BEST_RE.search(text)
+    if match and 1 <= int(match.group(1)) <= count:
+        return int(match.group(1)) - 1
+    return 0
+
+async def judge_agent(state: AgentState) -> dict[str, Any]:
+    """
+    Judge Agent: 一次比较全部候选回答并选出最佳，代替逐轮打回重写。
+    """
+    candidates = state.get("candidates") or [state.get("current_answer", "")]
+    question = get_last_content(state["messages"])
+
+    selected = 0
+    if len(candidates) > 1:
+        knowledge_context = knowledge_for(state, "reviewer", question)
+        response = await model_registry.ainvoke(
+            ModelRole.REVIEW, build_selector_messages(question, candidates, knowledge_context)
+        )
+        record_prompt_cache("selector", response)
+        selected = parse_selection(str(response.content), len(candidates))
+
+    metrics.inc("parallel_candidate_selected_total", rank=str(selected + 1))
+    logger.info(f"[Judge] 选出第 {selected + 1} 个候选回答")
+    return {
+        "current_answer": candidates[selected],
+        "is_satisfied": True,
+        "reflection": "",
+        "next_agent": "end",
+    }
@@ -4,9 +4,13 @@ from langgraph.graph import add_messages
 class AgentState(TypedDict):
     """基础 Agent 状态"""
     messages: Annotated[list, add_messages]  # 对话历史
-    knowledge_context: str      # 检索到的知识
+    knowledge_context: str      # 检索到的知识（按 writer 预算装箱后的文本）
+    knowledge_items: list       # 去重后的结构化检索条目 {"content", "source", "score"}
+    seen_sources: list          # 本次运行已检索到的来源去重键（URL / 内容哈希）
+    searched_queries: list      # 本次运行已执行的检索查询（规范化后）
     need_knowledge: bool        # 是否需要检索
     current_answer: str         # 当前生成的回答
+    candidates: list            # 并行生成的候选回答（parallel 模式）
     reflection: str             # 反思意见
     is_satisfied: bool          # 是否满意当前回答
     iteration: int              # 当前迭代轮次（最大 3）
@@ -0,0 +1,40 @@
+"""评估结论解析
+
+评估输出以 SATISFIED 或 NEEDS_IMPROVEMENT 开头（后者附改进意见）。只识别位于输出
+或某一行开头的大写协议关键词，以第一个完整出现的为准；正文里的 "not fully satisfied"、
+"would be satisfied" 等普通措辞不算结论。"NOT SATISFIED"、"UNSATISFIED" 等否定形式
+视为需要改进；支持在流式输出的过程中增量解析，结论确定后即可停止生成。
+"""
+
+import re
+from enum import Enum
+
+_VERDICT_RE = re.compile(
+    r"^[ \t*#>]*(NOT[ \t]+|UN|DIS)?(SATISFIED|NEEDS[_ ]IMPROVEMENT)(?![A-Za-z_])", re.MULTILINE
+)
+
+
+class Verdict(str, Enum):
+    """评估结论"""
+
+    SATISFIED = "satisfied"
+    NEEDS_IMPROVEMENT = "needs_improvement"
+
+
+def parse_verdict(text: str, final: bool = True) -> Verdict | None:
+    """解析评估结论
+
+    final=False 用于流式缓冲区：尚未出现关键词，或关键词位于缓冲区末尾、还不能确定
+    边界（后续内容可能让它成为更长的单词）时返回 None。final=True 时没有关键词视为需要改进。
+    """
+    match = _VERDICT_RE.search(text)
+    if not final and (match is None or match.end() == len(text)):
+        return None
+    if match is None or match.group(1) or match.group(2) != "SATISFIED":
+        return Verdict.NEEDS_IMPROVEMENT
+    return Verdict.SATISFIED
+
+
+def strip_verdict(text: str) -> str:
+    """去掉结论关键词，保留改进意见"""
+    return _VERDICT_RE.sub("", text, count=1).strip()
@@ -0,0 +1,123 @@
+"""准入控制与背压
+
+进程级的并发闸门：同时执行的请求数受 max_in_flight 限制，超出部分进入有界 FIFO
+等待队列；队列已满或排队超过期限时立即返回 429 并附带 Retry-After，避免在流量
+尖峰下所有请求一起超时。
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException, status
+
+from src.app.core.config import settings
+from src.app.core.logging import logger
+from src.app.core.metrics import metrics
+
+
+class AdmissionController:
+    """max-in-flight + 有界等待队列"""
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        max_queue: int,
+        queue_timeout: float,
+        retry_after_seconds: float = 1.0,
+        enabled: bool = True,
+    ) -> None:
+        self.enabled = enabled
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after_seconds = retry_after_seconds
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    def _export(self) -> None:
+        metrics.set_gauge("chat_in_flight", self.in_flight)
+        metrics.set_gauge("chat_queued", self.queued)
+
+    def _retry_after(self) -> int:
+        """按近期运行平均耗时估算重试等待秒数"""
+        average_run = metrics.mean("agent_run_duration_seconds") or self.retry_after_seconds
+        return max(1, math.ceil(average_run))
+
+    def _reject(self, reason: str) -> HTTPException:
+        metrics.inc("chat_rejected_total", reason=reason)
+        logger.warning(f"[Admission] 拒绝请求: {reason} (in_flight={self.in_flight})")
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"服务繁忙，请稍后重试 ({reason})",
+            headers={"Retry-After": str(self._retry_after())},
+        )
+
+    async def acquire(self) -> None:
+        """获取执行名额；无法在期限内获得时抛出 429"""
+        if not self.enabled:
+            return
+        if self.in_flight < self.max_in_flight and not self.queued:
+            self.in_flight += 1
+            self._export()
+            return
+
+        if self.queued >= self.max_queue:
+            raise self._reject("queue_full")
+
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._export()
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise self._reject("queue_timeout")
+        except asyncio.CancelledError:
+            # 名额已经移交给本请求但请求被取消：归还名额
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters and waiter.done():
+                self._waiters.remove(waiter)
+            metrics.observe("chat_queue_wait_seconds", time.perf_counter() - started)
+            self._export()
+
+    def release(self) -> None:
+        """释放名额，优先直接移交给队首等待者"""
+        if not self.enabled:
+            return
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._export()
+                return
+        self.in_flight -= 1
+        self._export()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """在名额内执行代码块"""
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+# 准入控制单例
+admission_controller = AdmissionController(
+    max_in_flight=settings.admission_max_in_flight,
+    max_queue=settings.admission_max_queue,
+    queue_timeout=settings.admission_queue_timeout_seconds,
+    enabled=settings.admission_enabled,
+)
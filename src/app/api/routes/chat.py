@@ -1,23 +1,43 @@
 """聊天路由"""
 
-import json
-from typing import AsyncGenerator
+import asyncio
+import time
+from contextlib import aclosing
+from typing import Any, AsyncGenerator
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Header
 from fastapi.responses import StreamingResponse
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import BaseMessage, HumanMessage
 
-from src.app.agents.graph import agent
-from src.app.api.schemas import ChatRequest, ChatResponse
+from src.app.agents.graph import get_agent
+from src.app.agents.runner import AgentRun, make_run_key, run_manager
+from src.app.api.admission import admission_controller
+from src.app.api.schemas import (
+    BatchChatRequest,
+    BatchChatResponse,
+    BatchItemResult,
+    ChatRequest,
+    ChatResponse,
+    UsageSummary,
+)
+from src.app.api.sse import SSEResponse, format_sse
+from src.app.core.config import settings
+from src.app.core.metrics import metrics
+from src.app.services.answer_cache import answer_cache
+from src.app.services.knowledge import shared_search_context
+from src.app.services.memory import conversation_memory
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
 
-def get_initial_state(message: str) -> dict:
-    """获取初始状态"""
+def get_initial_state(message: str, history: list[BaseMessage] | None = None) -> dict:
+    """获取初始状态（history 为会话记忆中加载的历史消息）"""
     return {
-        "messages": [HumanMessage(content=message)],
+        "messages": [*(history or []), HumanMessage(content=message)],
         "knowledge_context": "",
+        "knowledge_items": [],
+        "seen_sources": [],
+        "searched_queries": [],
         "need_knowledge": False,
         "current_answer": "",
         "reflection": "",
@@ -26,11 +46,49 @@ def get_initial_state(message: str) -> dict:
     }
 
 
-@router.post("", response_model=ChatResponse)
-async def chat(request: ChatRequest) -> ChatResponse:
-    """聊天接口（非流式）"""
-    result = await agent.ainvoke(get_initial_state(request.message))
+def describe_step(node_name: str, node_output: dict[str, Any]) -> dict[str, Any]:
+    """将节点输出转换为步骤事件"""
+    step_info: dict[str, Any] = {"step": node_name}
+    node_output = node_output or {}
+
+    if node_name == "check":
+        need_knowledge = node_output.get("need_knowledge", False)
+        step_info["detail"] = f"需要检索知识: {'是' if need_knowledge else '否'}"
+
+    elif node_name in ("retrieve", "searcher"):
+        context = node_output.get("knowledge_context", "")
+        step_info["detail"] = f"检索到 {len(context)} 字符的知识"
+        if context:
+            step_info["preview"] = context[:200] + "..." if len(context) > 200 else context
+
+    elif node_name in ("generate", "writer"):
+        answer = node_output.get("current_answer", "")
+        iteration = node_output.get("iteration", 0)
+        step_info["detail"] = f"生成回答 (第 {iteration} 轮)"
+        step_info["answer"] = answer
+
+    elif node_name in ("reflect", "reviewer"):
+        is_satisfied = node_output.get("is_satisfied", False)
+        reflection = node_output.get("reflection", "")
+        step_info["detail"] = f"反思评估: {'满意' if is_satisfied else '需要改进'}"
+        if reflection:
+            step_info["reflection"] = reflection
+
+    elif node_name == "candidates":
+        step_info["detail"] = f"并行生成 {len(node_output.get('candidates', []))} 个候选回答"
+
+    elif node_name == "judge":
+        step_info["detail"] = "比较候选并选出最佳回答"
+        step_info["answer"] = node_output.get("current_answer", "")
 
+    elif node_name == "finalize":
+        step_info["detail"] = "完成"
+
+    return step_info
+
+
+def build_response(result: dict[str, Any], usage: dict[str, Any] | None = None) -> ChatResponse:
+    """从最终状态（及运行的用量汇总）构建响应"""
     messages = result.get("messages", [])
     reply = messages[-1].content if messages else "抱歉，我无法生成回复。"
 
@@ -38,58 +96,255 @@ async def chat(request: ChatRequest) -> ChatResponse:
         reply=str(reply),
         used_knowledge=bool(result.get("knowledge_context")),
         iterations=result.get("iteration", 1),
+        cached=False,
+        usage=UsageSummary(**usage) if usage is not None else None,
+    )
+
+
+def is_cacheable(request: ChatRequest) -> bool:
+    """会话请求依赖上下文，不参与回答缓存"""
+    return settings.answer_cache_enabled and not request.conversation_id
+
+
+def resolve_mode(request: ChatRequest) -> str:
+    """请求的运行模式，未指定时使用配置"""
+    return request.mode or settings.default_chat_mode
+
+
+def lookup_cached(request: ChatRequest) -> ChatResponse | None:
+    """查找语义缓存中的回答（不同模式的回答分开缓存）"""
+    if not request.use_cache or not is_cacheable(request):
+        return None
+    cached = answer_cache.lookup(request.message, namespace=resolve_mode(request))
+    return ChatResponse(**cached, cached=True) if cached else None
+
+
+def request_origin(request: ChatRequest) -> str:
+    """请求身份（模式、会话与归一化消息），断线重连时校验与原运行一致"""
+    return make_run_key(
+        request.message, f"{resolve_mode(request)}\x00{request.conversation_id or ''}"
+    )
+
+
+async def load_history(request: ChatRequest) -> list[BaseMessage]:
+    """加载会话历史"""
+    if not request.conversation_id or not settings.conversation_memory_enabled:
+        return []
+    return await conversation_memory.load(request.conversation_id)
+
+
+async def start_run(request: ChatRequest) -> tuple[AgentRun, bool]:
+    """启动或加入一次 Agent 运行（相同模式的相同请求共享执行），返回 (运行, 是否新启动)"""
+    mode = resolve_mode(request)
+    history = await load_history(request)
+    context = "\x00".join([mode, request.conversation_id or "", *(str(m.content) for m in history)])
+    key = make_run_key(request.message, context)
+
+    def on_complete(finished: AgentRun) -> None:
+        if finished.result is None or finished.error is not None:
+            return
+        # 按模式记录延迟与 token 成本，用于选择模式与候选数
+        metrics.observe(
+            "chat_mode_duration_seconds", time.perf_counter() - finished.started_at, mode=mode
+        )
+        metrics.observe("chat_mode_tokens", finished.usage.total_tokens, mode=mode)
+        answer = build_response(finished.result)
+        if is_cacheable(request):
+            answer_cache.store(
+                request.message, answer.model_dump(exclude={"cached", "usage"}), namespace=mode
+            )
+        if request.conversation_id and settings.conversation_memory_enabled:
+            conversation_memory.schedule_append(
+                request.conversation_id, request.message, answer.reply
+            )
+
+    created = False
+
+    def on_start(run: AgentRun) -> None:
+        nonlocal created
+        created = True
+        run.add_done_callback(on_complete)
+
+    run = run_manager.get_or_start(
+        key,
+        get_agent(mode),
+        get_initial_state(request.message, history),
+        on_start=on_start,
+        origin=request_origin(request),
+    )
+    return run, created
+
+
+async def persist_turn(request: ChatRequest, run: AgentRun) -> None:
+    """等待本轮对话写入会话记忆，客户端收到回答后发起的下一轮即可加载到它"""
+    if request.conversation_id and settings.conversation_memory_enabled:
+        await run.settled()  # 结束回调（排入持久化）已执行
+        await conversation_memory.flush(request.conversation_id)
+
+
+async def run_to_completion(request: ChatRequest) -> ChatResponse:
+    """启动或加入一次运行并等待结果"""
+    run, _ = await start_run(request)
+    result = await run.wait()
+    await persist_turn(request, run)
+    return build_response(result, run.usage.summary())
+
+
+async def answer(request: ChatRequest) -> ChatResponse:
+    """回答单个问题：优先命中缓存，否则在准入名额内启动或加入一次运行
+
+    同步接口、批量问题与异步任务共用这一入口，全部计入同一个 in_flight 上限。
+    """
+    cached = lookup_cached(request)
+    if cached is not None:
+        return cached
+
+    async with admission_controller.slot():
+        return await run_to_completion(request)
+
+
+@router.post("", response_model=ChatResponse)
+async def chat(request: ChatRequest) -> ChatResponse:
+    """聊天接口（非流式）
+
+    缓存命中直接返回；否则需先通过准入控制，繁忙时返回 429。
+    """
+    return await answer(request)
+
+
+async def iter_batch(request: BatchChatRequest) -> AsyncGenerator[BatchItemResult, None]:
+    """以有界并发执行批量问题，按完成顺序产出结果
+
+    所有问题在同一个共享检索作用域中运行，批内相同的检索查询只调用一次 Tavily。
+    每个未命中缓存的问题各占一个准入名额，被拒绝的问题以 error 返回。
+    """
+    concurrency = min(
+        request.concurrency or settings.batch_default_concurrency, settings.batch_max_concurrency
     )
+    semaphore = asyncio.Semaphore(concurrency)
+    context = shared_search_context()
+
+    async def process(index: int, question: ChatRequest) -> BatchItemResult:
+        async with semaphore:
+            try:
+                return BatchItemResult(index=index, response=await answer(question), error=None)
+            except Exception as e:
+                metrics.inc("chat_batch_errors_total")
+                return BatchItemResult(index=index, response=None, error=str(e))
+
+    tasks = [
+        asyncio.create_task(process(i, q), context=context) for i, q in enumerate(request.questions)
+    ]
+    metrics.inc("chat_batch_questions_total", len(tasks))
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+@router.post("/batch", response_model=BatchChatResponse)
+async def chat_batch(request: BatchChatRequest) -> BatchChatResponse | StreamingResponse:
+    """批量聊天接口
+
+    默认返回与请求顺序一致的结果列表；stream=true 时以 NDJSON 逐行返回（按完成顺序，
+    每行带 index）。
+    """
+    if request.stream:
+
+        async def generate() -> AsyncGenerator[str, None]:
+            async with aclosing(iter_batch(request)) as results:
+                async for item in results:
+                    yield item.model_dump_json() + "\n"
+
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+    results = [item async for item in iter_batch(request)]
+    return BatchChatResponse(results=sorted(results, key=lambda item: item.index))
+
+
+async def replay_cached(cached: ChatResponse) -> AsyncGenerator[str, None]:
+    """以 SSE 事件输出缓存命中的回答"""
+    yield format_sse({"step": "cache", "detail": "命中回答缓存", "answer": cached.reply})
+    yield format_sse({"step": "done", "cached": True})
 
 
 @router.post("/stream")
-async def chat_stream(request: ChatRequest) -> StreamingResponse:
-    """流式聊天接口"""
+async def chat_stream(
+    request: ChatRequest,
+    last_event_id: str | None = Header(default=None, alias="Last-Event-ID"),
+) -> SSEResponse:
+    """流式聊天接口
+
+    stream_tokens 开启时，settings.stream_token_nodes 中节点的 LLM token 增量
+    以 {"step": "token"} 事件实时推送，并与节点级步骤事件交错输出。
+    加入进行中的相同请求时，会先回放已产生的事件；客户端断开后释放订阅，
+    若宽限期内无人重连则该运行被取消。名额在整个推流期间占用，响应结束时释放。
+
+    运行事件带有 id（"<run_id>:<seq>"）。断线重连时携带 Last-Event-ID 请求头，
+    可重新挂到原运行上，只回放错过的事件；原运行已过期，或请求（模式、会话、消息）
+    与原运行不一致时按新请求处理。
+    """
+    resumed = run_manager.resolve_event_id(last_event_id)
+    if resumed is not None and resumed[0].origin != request_origin(request):
+        metrics.inc("chat_stream_resume_rejected_total")
+        resumed = None
+    if resumed is None:
+        cached = lookup_cached(request)
+        if cached is not None:
+            return SSEResponse(replay_cached(cached))
+
+    await admission_controller.acquire()
+    try:
+        owner = False  # 只有启动运行的订阅者记录 TTFT，合并加入与重连的首 token 来自回放
+        if resumed is not None:
+            run, after = resumed
+            metrics.inc("chat_stream_resumed_total")
+        else:
+            (run, owner), after = await start_run(request), 0
+    except BaseException:
+        admission_controller.release()
+        raise
 
     async def generate() -> AsyncGenerator[str, None]:
+        started = time.perf_counter()
+        ttft: float | None = None
         try:
-            async for event in agent.astream(
-                get_initial_state(request.message), stream_mode="updates"
-            ):
-                for node_name, node_output in event.items():
-                    step_info = {"step": node_name}
-
-                    if node_name == "check":
-                        need_knowledge = node_output.get("need_knowledge", False)
-                        step_info["detail"] = f"需要检索知识: {'是' if need_knowledge else '否'}"
-
-                    elif node_name == "retrieve":
-                        context = node_output.get("knowledge_context", "")
-                        step_info["detail"] = f"检索到 {len(context)} 字符的知识"
-                        if context:
-                            step_info["preview"] = (
-                                context[:200] + "..." if len(context) > 200 else context
-                            )
-
-                    elif node_name == "generate":
-                        answer = node_output.get("current_answer", "")
-                        iteration = node_output.get("iteration", 0)
-                        step_info["detail"] = f"生成回答 (第 {iteration} 轮)"
-                        step_info["answer"] = answer
-
-                    elif node_name == "reflect":
-                        is_satisfied = node_output.get("is_satisfied", False)
-                        reflection = node_output.get("reflection", "")
-                        step_info["detail"] = f"反思评估: {'满意' if is_satisfied else '需要改进'}"
-                        if reflection:
-                            step_info["reflection"] = reflection
-
-                    elif node_name == "finalize":
-                        step_info["detail"] = "完成"
-
-                    yield f"data: {json.dumps(step_info, ensure_ascii=False)}\n\n"
-
-            yield f"data: {json.dumps({'step': 'done'}, ensure_ascii=False)}\n\n"
+            async with aclosing(run.subscribe(after=after)) as events:
+                async for event in events:
+                    event_id = f"{run.run_id}:{event['seq']}"
+                    if event["type"] == "gap":
+                        yield format_sse({"step": "gap", "missed": event["missed"]}, event_id)
+                    elif event["type"] == "token":
+                        if not request.stream_tokens:
+                            continue
+                        if ttft is None:
+                            ttft = time.perf_counter() - started
+                            if owner:
+                                metrics.observe("chat_stream_ttft_seconds", ttft)
+                        yield format_sse(
+                            {"step": "token", "node": event["node"], "content": event["content"]},
+                            event_id,
+                        )
+                    else:
+                        yield format_sse(describe_step(event["node"], event["output"]), event_id)
+
+            if isinstance(run.error, Exception):
+                raise run.error
+            if run.error is not None:
+                raise RuntimeError("运行已取消")
+            await persist_turn(request, run)
+
+            done: dict[str, Any] = {"step": "done", "usage": run.usage.summary()}
+            if ttft is not None:
+                done["ttft_ms"] = round(ttft * 1000, 1)
+            yield format_sse(done)
 
         except Exception as e:
-            yield f"data: {json.dumps({'step': 'error', 'detail': str(e)}, ensure_ascii=False)}\n\n"
+            metrics.inc("chat_stream_errors_total")
+            yield format_sse({"step": "error", "detail": str(e)})
+        finally:
+            metrics.observe("chat_stream_duration_seconds", time.perf_counter() - started)
 
-    return StreamingResponse(
-        generate(),
-        media_type="text/event-stream",
-        headers={"Cache-Control": "no-cache", "Connection": "keep-alive"},
-    )
+    return SSEResponse(generate(), on_close=admission_controller.release)
@@ -1,9 +1,12 @@
 """健康检查路由"""
 
-from fastapi import APIRouter
+from typing import Any
+
+from fastapi import APIRouter, HTTPException, Request, status
 
 from src.app.api.schemas import HealthResponse
 from src.app.core.config import settings
+from src.app.core.metrics import metrics
 
 router = APIRouter(tags=["health"])
 
@@ -18,3 +21,17 @@ async def root() -> HealthResponse:
 async def health() -> HealthResponse:
     """健康检查"""
     return HealthResponse(version=settings.app_version)
+
+
+@router.get("/ready", response_model=HealthResponse)
+async def ready(request: Request) -> HealthResponse:
+    """就绪检查：启动完成前及收到 SIGTERM 后的排空期间返回 503"""
+    if not getattr(request.app.state, "ready", False):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="not ready")
+    return HealthResponse(version=settings.app_version)
+
+
+@router.get("/metrics")
+async def get_metrics() -> dict[str, Any]:
+    """进程内指标快照"""
+    return metrics.snapshot()
@@ -0,0 +1,53 @@
+"""异步任务路由"""
+
+from typing import Any
+
+from fastapi import APIRouter, HTTPException, status
+
+from src.app.api.routes.chat import answer
+from src.app.api.schemas import ChatJobRequest, ChatJobResponse, ChatRequest
+from src.app.core.config import settings
+from src.app.services.jobs import CallbackURLError, job_queue
+
+router = APIRouter(prefix="/chat/jobs", tags=["jobs"])
+
+
+async def run_job(payload: dict[str, Any]) -> dict[str, Any]:
+    """任务处理函数：与同步接口共用缓存、请求合并、会话记忆与准入名额"""
+    response = await answer(ChatRequest(**payload))
+    return response.model_dump()
+
+
+def ensure_jobs_enabled() -> None:
+    """任务接口未启用时返回 503（此时不会建表，也不应访问数据库）"""
+    if not settings.jobs_enabled:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="任务接口未启用"
+        )
+
+
+@router.post("", response_model=ChatJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_job(request: ChatJobRequest) -> ChatJobResponse:
+    """提交异步聊天任务，立即返回任务 ID
+
+    适用于反思轮次较多、耗时可能超过负载均衡空闲超时的请求。结果通过
+    GET /chat/jobs/{job_id} 查询，或在 callback_url 上接收回调。
+    """
+    ensure_jobs_enabled()
+    try:
+        job = await job_queue.submit(
+            request.model_dump(exclude={"callback_url"}), callback_url=request.callback_url
+        )
+    except CallbackURLError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e)) from e
+    return ChatJobResponse(**job)
+
+
+@router.get("/{job_id}", response_model=ChatJobResponse)
+async def get_job(job_id: str) -> ChatJobResponse:
+    """查询任务状态与结果"""
+    ensure_jobs_enabled()
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="任务不存在")
+    return ChatJobResponse(**job)
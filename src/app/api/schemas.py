@@ -1,13 +1,51 @@
 """请求/响应模型"""
 
+from datetime import datetime
+from typing import Literal
+
 from pydantic import BaseModel, Field
 
+from src.app.core.config import settings
+
+
+ChatMode = Literal["fast", "standard", "thorough", "parallel"]
+
 
 class ChatRequest(BaseModel):
     """聊天请求"""
 
     message: str = Field(..., description="用户消息", min_length=1)
     conversation_id: str | None = Field(None, description="会话 ID")
+    stream_tokens: bool = Field(True, description="流式接口是否逐 token 推送回答")
+    use_cache: bool = Field(True, description="是否允许返回缓存的相似问题回答")
+    mode: ChatMode | None = Field(
+        None,
+        description="运行模式：fast 单次检索与生成 / standard 最多重写一次 / thorough 完整反思循环"
+        " / parallel 并行候选后一次比较选优，默认使用配置",
+    )
+
+
+class NodeUsage(BaseModel):
+    """单个图节点的 LLM 用量"""
+
+    calls: int = Field(0, description="LLM 调用次数")
+    tokens: int = Field(0, description="输入 + 输出 token 数")
+    seconds: float = Field(0.0, description="LLM 调用累计耗时（秒）")
+    cost: float = Field(0.0, description="费用（按 LLM_PRICES 计算）")
+
+
+class UsageSummary(BaseModel):
+    """一次运行的 LLM 用量汇总"""
+
+    prompt_tokens: int = Field(0, description="输入 token 数")
+    completion_tokens: int = Field(0, description="输出 token 数")
+    cached_tokens: int = Field(0, description="命中服务商前缀缓存的输入 token 数")
+    total_tokens: int = Field(0, description="总 token 数")
+    llm_calls: int = Field(0, description="LLM 调用次数")
+    llm_cache_hits: int = Field(0, description="命中本地 LLM 响应缓存的调用次数")
+    llm_seconds: float = Field(0.0, description="LLM 调用累计耗时（秒，并行调用分别计入）")
+    cost: float = Field(0.0, description="费用（按 LLM_PRICES 计算）")
+    nodes: dict[str, NodeUsage] = Field(default_factory=dict, description="按图节点细分")
 
 
 class ChatResponse(BaseModel):
@@ -16,6 +54,50 @@ class ChatResponse(BaseModel):
     reply: str = Field(..., description="AI 回复")
     used_knowledge: bool = Field(..., description="是否使用了外部知识")
     iterations: int = Field(..., description="反思迭代次数")
+    cached: bool = Field(False, description="是否命中回答缓存")
+    usage: UsageSummary | None = Field(None, description="本次运行的 LLM 用量（命中回答缓存时为空）")
+
+
+class BatchChatRequest(BaseModel):
+    """批量聊天请求"""
+
+    questions: list[ChatRequest] = Field(
+        ..., description="问题列表", min_length=1, max_length=settings.batch_max_questions
+    )
+    concurrency: int | None = Field(None, description="并发执行上限，默认使用配置", ge=1)
+    stream: bool = Field(False, description="是否以 NDJSON 流式返回（按完成顺序）")
+
+
+class BatchItemResult(BaseModel):
+    """批量聊天单项结果"""
+
+    index: int = Field(..., description="问题在请求中的序号")
+    response: ChatResponse | None = Field(None, description="聊天响应")
+    error: str | None = Field(None, description="失败原因")
+
+
+class BatchChatResponse(BaseModel):
+    """批量聊天响应（与请求顺序一致）"""
+
+    results: list[BatchItemResult] = Field(..., description="结果列表")
+
+
+class ChatJobRequest(ChatRequest):
+    """异步聊天任务请求"""
+
+    callback_url: str | None = Field(None, description="任务结束后以 POST 通知结果的回调地址")
+
+
+class ChatJobResponse(BaseModel):
+    """异步聊天任务状态"""
+
+    job_id: str = Field(..., description="任务 ID")
+    status: str = Field(..., description="任务状态：queued / running / succeeded / failed")
+    result: ChatResponse | None = Field(None, description="聊天响应（成功后返回）")
+    error: str | None = Field(None, description="失败原因")
+    attempts: int = Field(0, description="已执行次数")
+    created_at: datetime | None = Field(None, description="提交时间")
+    updated_at: datetime | None = Field(None, description="最近更新时间")
 
 
 class HealthResponse(BaseModel):
@@ -0,0 +1,63 @@
+"""SSE 响应工具"""
+
+import json
+from collections.abc import AsyncGenerator, Callable
+from typing import Any
+
+import anyio
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+def format_sse(payload: dict[str, Any], event_id: str | None = None) -> str:
+    """序列化为 SSE data 帧；event_id 作为 id 字段，供客户端断线重连时回传 Last-Event-ID"""
+    frame = f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    if event_id is not None:
+        frame = f"id: {event_id}\n{frame}"
+    return frame
+
+
+class SSEResponse(StreamingResponse):
+    """可感知客户端断开的 SSE 响应
+
+    无论 ASGI 版本如何都监听 http.disconnect：客户端断开时立即取消推流，并显式关闭
+    事件生成器，使其 finally 块（释放订阅、取消后台运行）及时执行，而不是等到下一次
+    写入失败或被垃圾回收时才触发。on_close 在响应结束（含断开）后必定被调用。
+    """
+
+    def __init__(
+        self,
+        content: AsyncGenerator[str, None],
+        on_close: Callable[[], None] | None = None,
+    ) -> None:
+        self.on_close = on_close
+        super().__init__(
+            content,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "Connection": "keep-alive"},
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            async with anyio.create_task_group() as task_group:
+
+                async def stream() -> None:
+                    await self.stream_response(send)
+                    task_group.cancel_scope.cancel()
+
+                task_group.start_soon(stream)
+                await self.listen_for_disconnect(receive)
+                task_group.cancel_scope.cancel()
+        except OSError:
+            raise ClientDisconnect()
+        finally:
+            aclose = getattr(self.body_iterator, "aclose", None)
+            if aclose is not None:
+                with anyio.CancelScope(shield=True):
+                    await aclose()
+            if self.on_close is not None:
+                self.on_close()
+
+        if self.background is not None:
+            await self.background()
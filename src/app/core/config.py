@@ -2,6 +2,7 @@
 
 import urllib.parse
 from functools import lru_cache
+from typing import Any
 
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings
@@ -21,12 +22,102 @@ class Settings(BaseSettings):
     deepseek_api_key: str = ""
     deepseek_base_url: str = "https://api.deepseek.com/v1"
     deepseek_model: str = "deepseek-chat"
+    # 按角色覆盖模型配置，如 {"check": {"model": "deepseek-chat", "max_tokens": 8}}
+    llm_roles: dict[str, dict[str, Any]] = {}
+    # LLM 响应缓存：按角色启用（启用的角色温度固定为 0），如 ["check", "refine"]
+    llm_cache_roles: list[str] = []
+    llm_cache_path: str = ""  # SQLite 磁盘层路径，留空则只使用内存层
+    llm_cache_memory_max_entries: int = 2000
+    llm_cache_memory_ttl_seconds: float = 3600.0
+    llm_cache_disk_max_entries: int = 100000
+    llm_cache_disk_ttl_seconds: float = 7 * 24 * 3600.0
+    # 对冲请求：调用超过近期延迟分位数仍未返回时再发一次，先返回者胜出
+    llm_hedge_enabled: bool = False
+    llm_hedge_percentile: float = 95.0  # 对冲时机取近期延迟的分位数（0-100）
+    llm_hedge_min_samples: int = 20  # 延迟样本不足时不对冲
+    llm_hedge_min_delay_seconds: float = 0.5
+    llm_hedge_max_per_minute: int = 30  # 每分钟对冲次数上限
+    llm_hedge_base_url: str = ""  # 对冲请求的备用地址，留空则发往原地址
+    # 调用速率调度：0 表示不限制（服务商返回 x-ratelimit-* 头时按其自动调整）
+    llm_rate_limit_rpm: int = 0
+    llm_rate_limit_tpm: int = 0
+    llm_rate_limit_default_output_tokens: int = 512  # 未配置 max_tokens 的角色预估的输出 token
+    llm_rate_limit_backoff_seconds: float = 5.0  # 429 未带 retry-after 时的暂停时间
+    # 各模型每百万 token 单价，用于用量核算，如 {"deepseek-chat": {"input": 0.27, "cached_input": 0.07, "output": 1.1}}
+    llm_prices: dict[str, dict[str, float]] = {}
 
     # Tavily
     tavily_api_key: str = ""
 
     # Agent
     max_iterations: int = 3
+    default_chat_mode: str = "thorough"  # 未指定 mode 时使用：fast / standard / thorough / parallel
+    parallel_candidates: int = 3  # parallel 模式并行生成的候选数
+    parallel_candidate_temperatures: list[float] = [0.3, 0.7, 1.0]  # 按候选序号轮换
+    writer_revision_mode: str = "full"  # 反思轮次 full（整篇重写）/ patch（输出编辑指令本地应用）
+    knowledge_max_items: int = 20  # 状态中保留的去重检索条目上限
+    knowledge_token_budgets: dict[str, int] = {"writer": 3000, "reviewer": 800}  # 各节点知识预算
+    knowledge_rerank_score_weight: float = 0.5  # 重排时 Tavily 得分的权重，其余为字面重合度
+    speculative_retrieval: bool = False  # 首轮检索与"是否需要检索"判断并行发起
+    delta_retrieval: bool = True  # 反思轮次只针对缺失信息增量检索，跳过已用过的查询与来源
+    delta_retrieval_max_queries: int = 3  # 每轮反思最多生成的补充查询数
+    retrieval_classifier_mode: str = "off"  # off / shadow（只对比不生效）/ on
+    retrieval_classifier_threshold: float = 0.9  # 模型置信度达到阈值才本地决定
+    retrieval_classifier_min_samples: int = 200  # 决策样本不足时只使用规则
+    retrieval_classifier_log_path: str = ""  # LLM 决策日志（JSONL），用于训练模型
+
+    # Streaming
+    stream_token_nodes: list[str] = ["writer", "generate"]  # 逐 token 推送的节点，可追加 "reviewer"
+    stream_replay_max_events: int = 2000  # 每个运行在内存中保留的事件数
+    stream_spill_dir: str = ""  # 超出内存缓冲的事件溢写目录，留空则丢弃
+    stream_replay_ttl_seconds: float = 300.0  # 运行结束后仍可重连回放的时长
+    stream_resume_grace_seconds: float = 15.0  # 客户端全部断开后等待重连的宽限期
+
+    # Request coalescing
+    chat_coalescing_enabled: bool = True  # 合并进行中的相同请求
+
+    # Answer cache
+    answer_cache_enabled: bool = False  # 近似命中可能返回相近问题的回答，需显式开启
+    answer_cache_ttl_seconds: float = 600.0
+    answer_cache_max_entries: int = 1000
+    answer_cache_similarity_threshold: float = 0.95  # 字符 n-gram 余弦相似度阈值
+
+    # Conversation memory
+    conversation_memory_enabled: bool = True
+    conversation_history_token_budget: int = 2000  # 送入 writer 的历史消息 token 上限
+    conversation_summary_token_budget: int = 500  # 压缩摘要 token 上限
+
+    # Batch
+    batch_max_questions: int = 1000
+    batch_default_concurrency: int = 8
+    batch_max_concurrency: int = 32
+
+    # Admission control
+    admission_enabled: bool = True
+    admission_max_in_flight: int = 64  # 同时执行的聊天请求上限
+    admission_max_queue: int = 128  # 等待队列长度上限
+    admission_queue_timeout_seconds: float = 10.0  # 排队期限，超时返回 429
+
+    # Jobs
+    jobs_enabled: bool = False  # 需要可写的共享数据库，未配置时保持关闭
+    jobs_workers: int = 4  # 每个进程的后台 worker 数
+    jobs_poll_interval_seconds: float = 5.0  # 扫描数据库中待执行任务的间隔
+    jobs_lease_seconds: float = 60.0  # 运行中任务心跳超时后视为 worker 已失联并重新排队
+    jobs_max_attempts: int = 3
+    jobs_callback_timeout_seconds: float = 10.0
+    jobs_callback_allowed_hosts: list[
+        str
+    ] = []  # 回调主机白名单（支持 *.example.com），为空时拒绝回调
+    jobs_callback_schemes: list[str] = ["https"]
+
+    # Server
+    server_host: str = "0.0.0.0"
+    server_port: int = 8000
+    server_workers: int = 4  # 生产模式 worker 进程数
+    server_loop: str = "uvloop"
+    server_http: str = "httptools"
+    server_graceful_timeout: float = 30.0  # SIGTERM 后等待进行中请求/推流完成的秒数
+    startup_warmup_db: bool = False  # 启动时预热数据库连接池
 
     # HTTP Client
     http_verify_ssl: bool = True
@@ -44,6 +135,8 @@ class Settings(BaseSettings):
     def database_url(self) -> str:
         """根据配置生成异步数据库连接字符串（包含密码转义）"""
         safe_password = urllib.parse.quote_plus(self.db_password)
+        if self.db_type.lower() == "sqlite":
+            return f"sqlite+aiosqlite:///{self.db_name}.db"
         if self.db_type.lower() == "mysql":
             return f"mysql+aiomysql://{self.db_user}:{safe_password}@{self.db_host}:{self.db_port}/{self.db_name}"
         return f"postgresql+asyncpg://{self.db_user}:{safe_password}@{self.db_host}:{self.db_port}/{self.db_name}"
@@ -2,8 +2,10 @@
 
 from collections.abc import AsyncGenerator
 from contextlib import asynccontextmanager
+from typing import Any, cast
 
 from sqlalchemy import text
+from sqlalchemy.engine import CursorResult, Result
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase
 
@@ -17,30 +19,45 @@ class Base(DeclarativeBase):
 
 def _validate_database_url(url: str) -> None:
     """验证数据库 URL 是否使用异步驱动"""
-    if not any(driver in url for driver in ("asyncpg", "aiomysql")):
+    if not any(driver in url for driver in ("asyncpg", "aiomysql", "aiosqlite")):
         raise ValueError(
-            f"Database URL must use an asynchronous driver (asyncpg or aiomysql). "
+            f"Database URL must use an asynchronous driver (asyncpg, aiomysql or aiosqlite). "
             f"Got: {url}"
         )
 
 
+def affected_rows(result: Result[Any]) -> int:
+    """UPDATE / DELETE 语句影响的行数"""
+    return cast(CursorResult[Any], result).rowcount
+
+
 class DatabaseService:
     """异步数据库服务"""
 
-    def __init__(self):
+    def __init__(self, database_url: str | None = None):
+        self._database_url = database_url
         self._engine = None
         self._session_factory = None
 
+    @property
+    def database_url(self) -> str:
+        """连接字符串，未显式指定时使用配置"""
+        return self._database_url or settings.database_url
+
     def _get_engine(self):
         """获取或创建引擎（懒加载）"""
         if self._engine is None:
-            _validate_database_url(settings.database_url)
+            url = self.database_url
+            _validate_database_url(url)
+            # SQLite (aiosqlite) 仅用于本地/测试，不支持连接池参数
+            pool_options = (
+                {} if url.startswith("sqlite") else {"pool_size": 5, "max_overflow": 10}
+            )
             self._engine = create_async_engine(
-                settings.database_url,
+                url,
                 echo=False,  # 禁用全量 SQL 日志，防止老版本 MySQL (5.6) 或复杂环境下报错
                 pool_pre_ping=True,
-                pool_size=5,
-                max_overflow=10,
+                **pool_options,
             )
         return self._engine
 
@@ -94,6 +111,8 @@ class DatabaseService:
         """关闭数据库连接"""
         if self._engine is not None:
             await self._engine.dispose()
+            self._engine = None
+            self._session_factory = None
             logger.info("Database engine closed")
 
 
@@ -0,0 +1,109 @@
+"""进程内指标采集"""
+
+import math
+import threading
+from collections import deque
+from typing import Any
+
+
+def _metric_key(name: str, labels: dict[str, Any]) -> str:
+    """生成带标签的指标键，例如 chat_requests_total{mode="stream"}"""
+    if not labels:
+        return name
+    label_str = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{label_str}}}"
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    """计算已排序样本的分位数 (q 取值 0-100)"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, math.ceil(q / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+class MetricsRegistry:
+    """轻量级指标注册表：计数器、仪表盘和滑动窗口直方图"""
+
+    def __init__(self, window: int = 1024) -> None:
+        self._window = window
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = {}
+        self._gauges: dict[str, float] = {}
+        self._histograms: dict[str, deque[float]] = {}
+        self._histogram_totals: dict[str, tuple[int, float]] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        """累加计数器"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set_gauge(self, name: str, value: float, **labels: Any) -> None:
+        """设置仪表盘当前值"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        """记录一次观测值 (如延迟)"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            samples = self._histograms.setdefault(key, deque(maxlen=self._window))
+            samples.append(value)
+            count, total = self._histogram_totals.get(key, (0, 0.0))
+            self._histogram_totals[key] = (count + 1, total + value)
+
+    def get_counter(self, name: str, **labels: Any) -> float:
+        """读取计数器当前值"""
+        with self._lock:
+            return self._counters.get(_metric_key(name, labels), 0.0)
+
+    def get_gauge(self, name: str, **labels: Any) -> float:
+        """读取仪表盘当前值"""
+        with self._lock:
+            return self._gauges.get(_metric_key(name, labels), 0.0)
+
+    def mean(self, name: str, **labels: Any) -> float:
+        """读取直方图全部观测值的均值"""
+        with self._lock:
+            count, total = self._histogram_totals.get(_metric_key(name, labels), (0, 0.0))
+        return total / count if count else 0.0
+
+    def percentile(self, name: str, q: float, **labels: Any) -> float:
+        """读取直方图最近窗口内的分位数"""
+        with self._lock:
+            samples = sorted(self._histograms.get(_metric_key(name, labels), ()))
+        return _percentile(samples, q)
+
+    def snapshot(self) -> dict[str, Any]:
+        """导出全部指标"""
+        with self._lock:
+            histograms = {}
+            for key, samples in self._histograms.items():
+                ordered = sorted(samples)
+                count, total = self._histogram_totals[key]
+                histograms[key] = {
+                    "count": count,
+                    "sum": round(total, 6),
+                    "p50": _percentile(ordered, 50),
+                    "p95": _percentile(ordered, 95),
+                    "p99": _percentile(ordered, 99),
+                }
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "histograms": histograms,
+            }
+
+    def reset(self) -> None:
+        """清空全部指标 (测试用)"""
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+            self._histogram_totals.clear()
+
+
+# 指标单例
+metrics = MetricsRegistry()
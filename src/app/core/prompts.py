@@ -1,7 +1,17 @@
-"""Prompt 模板定义"""
+"""Prompt 模板定义与组装
+
+组装函数把静态内容放在前面、每次请求都会变化的内容放在最后一条用户消息之前，
+使同一模板的请求共享字节完全一致的前缀，从而命中服务商的提示词前缀缓存
+（DeepSeek 上下文硬盘缓存等）。record_prompt_cache 按模板统计缓存命中率。
+"""
 
 import os
 from pathlib import Path
+from typing import Any
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+from src.app.core.metrics import metrics
 
 # Base directory for prompts (project root/prompts)
 PROMPTS_DIR = (Path(__file__).resolve() / ".." / ".." / ".." / ".." / "prompts").resolve()
@@ -20,11 +30,132 @@ CHECK_PROMPT_DEFAULT = _load_prompt("check_prompt_default.md")
 
 # 检索节点 (Retrieve Node)
 REFINE_PROMPT = _load_prompt("refine_prompt.md")
+GAP_QUERY_PROMPT = _load_prompt("gap_query_prompt.md")
 
 # 生成节点 (Generate Node)
 GENERATE_SYSTEM_PROMPT_BASE = _load_prompt("generate_system_prompt_base.md")
 GENERATE_SYSTEM_PROMPT_KNOWLEDGE = _load_prompt("generate_system_prompt_knowledge.md")
 GENERATE_SYSTEM_PROMPT_REFLECTION = _load_prompt("generate_system_prompt_reflection.md")
+REVISE_SYSTEM_PROMPT = _load_prompt("revise_system_prompt.md")
+REVISE_INPUT_PROMPT = _load_prompt("revise_input_prompt.md")
 
 # 反思节点 (Reflect Node)
-REFLECT_PROMPT = _load_prompt("reflect_prompt.md")
+REFLECT_SYSTEM_PROMPT = _load_prompt("reflect_system_prompt.md")
+REFLECT_INPUT_PROMPT = _load_prompt("reflect_input_prompt.md")
+
+# 并行候选 (Parallel Candidates)
+CANDIDATE_FRAMINGS = [
+    line.strip() for line in _load_prompt("candidate_framings.md").splitlines() if line.strip()
+]
+SELECT_SYSTEM_PROMPT = _load_prompt("select_system_prompt.md")
+SELECT_INPUT_PROMPT = _load_prompt("select_input_prompt.md")
+
+# 会话记忆压缩 (Conversation Memory)
+SUMMARIZE_PROMPT = _load_prompt("summarize_prompt.md")
+
+
+def build_writer_messages(
+    messages: list[BaseMessage],
+    knowledge_context: str = "",
+    reflection: str = "",
+    instruction: str = "",
+) -> list[BaseMessage]:
+    """组装生成节点的消息
+
+    布局：静态 System Prompt → 历史对话 → 本轮动态上下文（知识、反思意见、额外指令）
+    → 当前问题。动态内容不再拼进开头的 System Prompt，前缀在同一会话的多轮请求间保持稳定。
+    历史开头的系统消息（会话摘要）并入开头的 System Prompt，不会出现在对话中间。
+    """
+    dynamic = ""
+    if knowledge_context:
+        dynamic += GENERATE_SYSTEM_PROMPT_KNOWLEDGE.format(knowledge_context=knowledge_context)
+    if reflection:
+        dynamic += GENERATE_SYSTEM_PROMPT_REFLECTION.format(reflection=reflection)
+    if instruction:
+        dynamic += f"\n{instruction}"
+
+    history = messages[:-1]
+    system = [GENERATE_SYSTEM_PROMPT_BASE]
+    while history and isinstance(history[0], SystemMessage):
+        system.append(str(history[0].content))
+        history = history[1:]
+
+    layout: list[BaseMessage] = [SystemMessage(content="\n\n".join(system))]
+    layout += history
+    if dynamic:
+        layout.append(SystemMessage(content=dynamic.strip()))
+    layout += messages[-1:]
+    return layout
+
+
+def build_revision_messages(
+    question: str, answer: str, reflection: str, knowledge_context: str
+) -> list[BaseMessage]:
+    """组装补丁修订的消息：静态的编辑指令格式在前，本轮回答与反思意见在后"""
+    return [
+        SystemMessage(content=REVISE_SYSTEM_PROMPT),
+        HumanMessage(
+            content=REVISE_INPUT_PROMPT.format(
+                question=question,
+                answer=answer,
+                reflection=reflection,
+                knowledge_context=knowledge_context or "无外部知识",
+            )
+        ),
+    ]
+
+
+def build_reviewer_messages(
+    question: str, answer: str, knowledge_context: str
+) -> list[BaseMessage]:
+    """组装评估节点的消息：静态评估标准在前，本轮问答与知识在后"""
+    return [
+        SystemMessage(content=REFLECT_SYSTEM_PROMPT),
+        HumanMessage(
+            content=REFLECT_INPUT_PROMPT.format(
+                question=question,
+                answer=answer,
+                knowledge_context=knowledge_context or "无外部知识",
+            )
+        ),
+    ]
+
+
+def build_selector_messages(
+    question: str, candidates: list[str], knowledge_context: str
+) -> list[BaseMessage]:
+    """组装候选比较的消息：静态评审标准在前，问题与编号候选在后"""
+    numbered = "\n\n".join(f"[{i}]\n{answer}" for i, answer in enumerate(candidates, start=1))
+    return [
+        SystemMessage(content=SELECT_SYSTEM_PROMPT),
+        HumanMessage(
+            content=SELECT_INPUT_PROMPT.format(
+                question=question,
+                knowledge_context=knowledge_context or "无外部知识",
+                candidates=numbered,
+            )
+        ),
+    ]
+
+
+def cached_prompt_tokens(response: Any) -> int:
+    """从响应中读取命中前缀缓存的输入 token 数"""
+    usage = getattr(response, "usage_metadata", None) or {}
+    cached = (usage.get("input_token_details") or {}).get("cache_read")
+    if cached is None:
+        # DeepSeek 原生字段
+        token_usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+        cached = token_usage.get("prompt_cache_hit_tokens", 0)
+    return int(cached or 0)
+
+
+def record_prompt_cache(template: str, response: Any) -> None:
+    """按模板累计输入 token 与缓存命中 token，并更新命中率"""
+    usage = getattr(response, "usage_metadata", None)
+    if not isinstance(usage, dict) or not usage.get("input_tokens"):
+        return
+    metrics.inc("prompt_input_tokens_total", usage["input_tokens"], template=template)
+    metrics.inc("prompt_cached_tokens_total", cached_prompt_tokens(response), template=template)
+    total = metrics.get_counter("prompt_input_tokens_total", template=template)
+    cached = metrics.get_counter("prompt_cached_tokens_total", template=template)
+    metrics.set_gauge("prompt_cache_hit_ratio", cached / total, template=template)
@@ -0,0 +1,47 @@
+"""本地 token 估算
+
+不依赖具体模型分词器的近似估算：CJK 字符按 1 token 计，拉丁单词按每 4 个字符
+1 token 计，标点各计 1 token。用于预算控制，结果偏保守。
+"""
+
+import math
+import re
+
+_TOKEN_RE = re.compile(
+    r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]"  # CJK 单字
+    r"|[A-Za-z0-9_]+"  # 拉丁单词 / 数字
+    r"|[^\sA-Za-z0-9_]"  # 其他符号
+)
+
+
+def _piece_tokens(piece: str) -> int:
+    if piece[0].isascii() and (piece[0].isalnum() or piece[0] == "_"):
+        return math.ceil(len(piece) / 4)
+    return 1
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的 token 数"""
+    if not text:
+        return 0
+    return sum(_piece_tokens(m.group()) for m in _TOKEN_RE.finditer(text))
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """按 token 预算截断文本（保留开头）"""
+    if budget <= 0:
+        return ""
+    used = 0
+    for match in _TOKEN_RE.finditer(text):
+        used += _piece_tokens(match.group())
+        if used > budget:
+            return text[: match.start()].rstrip()
+    return text
+
+
+def chars_for_tokens(budget: int, sample: str) -> int:
+    """按样本文本的字符与 token 比例，把 token 预算换算为近似字符数（用于提示中的字数要求）"""
+    tokens = estimate_tokens(sample)
+    if not tokens:
+        return budget
+    return max(int(budget * len(sample) / tokens), 1)
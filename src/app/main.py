@@ -1,11 +1,99 @@
 """应用入口"""
 
+import argparse
+import asyncio
+import signal
+import threading
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from types import FrameType
+
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from src.app.api.routes import chat, health
+from src.app.agents.runner import run_manager
+from src.app.api.routes import chat, health, jobs
 from src.app.core.config import settings
+from src.app.core.database import db_service
+from src.app.core.http_client import http_client, insecure_client
+from src.app.core.logging import logger
+from src.app.services.jobs import job_queue
+from src.app.services.llm_cache import llm_cache
+from src.app.services.memory import conversation_memory
+from src.app.services.retrieval_classifier import retrieval_classifier
+
+
+def install_drain_signal(application: FastAPI) -> None:
+    """SIGTERM 到达时先标记未就绪并记下排空期限，再交给 uvicorn 的处理器开始停机
+
+    uvicorn 在服务期间以 signal.signal 安装自己的处理器，这里在其外再包一层；
+    信号只能在主线程注册（TestClient 等在子线程运行生命周期时跳过）。
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_sigterm(signum: int, frame: FrameType | None) -> None:
+        if application.state.ready:
+            application.state.ready = False
+            application.state.drain_deadline = time.monotonic() + settings.server_graceful_timeout
+            logger.info("收到 SIGTERM，就绪检查转为 503，开始排空")
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+
+async def drain_background(deadline: float) -> None:
+    """在同一个期限内并发排空任务 worker、Agent 运行、会话写入与决策日志"""
+    timeout = max(deadline - time.monotonic(), 0.0)
+    await asyncio.gather(
+        job_queue.stop(timeout=timeout),
+        run_manager.drain(timeout=timeout),
+        conversation_memory.drain(timeout=timeout),
+        retrieval_classifier.drain(timeout=timeout),
+    )
+
+
+@asynccontextmanager
+async def lifespan(application: FastAPI) -> AsyncIterator[None]:
+    """应用生命周期：就绪前创建共享 HTTP 客户端并启动任务 worker，停机时排空进行中的任务并关闭资源
+
+    排空期限从收到 SIGTERM 起算，uvicorn 排空连接与这里排空后台任务共用
+    server_graceful_timeout，停机总时长不超过它加上关闭资源的时间。
+    """
+    application.state.ready = False
+    application.state.drain_deadline = None
+
+    await http_client.get_async_client()
+    await insecure_client.get_async_client()
+    if settings.startup_warmup_db:
+        await db_service.health_check()
+    if settings.jobs_enabled:
+        await job_queue.start(jobs.run_job)
+
+    application.state.ready = True
+    install_drain_signal(application)
+    logger.info("应用已就绪")
+    try:
+        yield
+    finally:
+        application.state.ready = False
+        deadline = application.state.drain_deadline or (
+            time.monotonic() + settings.server_graceful_timeout
+        )
+        logger.info("应用停机中，等待进行中的任务完成...")
+        await drain_background(deadline)
+
+        await http_client.close_async()
+        await insecure_client.close_async()
+        http_client.close_sync()
+        insecure_client.close_sync()
+        await db_service.close()
+        llm_cache.close()
+        logger.info("应用资源已释放")
 
 
 def create_app() -> FastAPI:
@@ -16,6 +104,7 @@ def create_app() -> FastAPI:
         description="Agentic RAG with LangGraph + DeepSeek + Self-Reflection",
         docs_url="/docs",
         redoc_url="/redoc",
+        lifespan=lifespan,
     )
 
     # CORS
@@ -30,6 +119,7 @@ def create_app() -> FastAPI:
     # 注册路由
     application.include_router(health.router)
     application.include_router(chat.router)
+    application.include_router(jobs.router)
 
     return application
 
@@ -37,13 +127,37 @@ def create_app() -> FastAPI:
 app = create_app()
 
 
-def main() -> None:
-    """启动应用"""
+def main(argv: list[str] | None = None) -> None:
+    """启动应用
+
+    默认以开发模式运行（单进程 + 热重载）；--prod 以生产模式运行：多 worker 进程、
+    uvloop/httptools、SIGTERM 后在 server_graceful_timeout 内优雅排空进行中的推流。
+    """
+    parser = argparse.ArgumentParser(description=settings.app_name)
+    parser.add_argument("--prod", action="store_true", help="生产模式")
+    parser.add_argument("--workers", type=int, default=settings.server_workers)
+    args = parser.parse_args(argv)
+
+    if not args.prod:
+        uvicorn.run(
+            "src.app.main:app",
+            host=settings.server_host,
+            port=settings.server_port,
+            reload=True,
+        )
+        return
+
     uvicorn.run(
         "src.app.main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
+        host=settings.server_host,
+        port=settings.server_port,
+        workers=args.workers,
+        loop=settings.server_loop,
+        http=settings.server_http,
+        lifespan="on",
+        timeout_graceful_shutdown=int(settings.server_graceful_timeout),
+        proxy_headers=True,
+        access_log=False,
     )
 
 
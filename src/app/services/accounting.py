@@ -0,0 +1,158 @@
+"""单次运行的 LLM 用量核算
+
+AgentRun 执行期间通过上下文变量绑定一个 RunAccounting，ModelRegistry 的每次调用
+（包括 gather 出去的并行调用）都把输入、输出、命中前缀缓存的 token、延迟、模型、角色
+以及所在的图节点记入其中。汇总结果随 ChatResponse.usage 与流式 done 事件返回，
+同时按角色与节点累计到进程指标，用于找出图中最贵、最慢的部分。
+"""
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any
+
+from src.app.core.config import settings
+from src.app.core.metrics import metrics
+from src.app.core.prompts import cached_prompt_tokens
+
+
+@dataclass
+class LLMCall:
+    """一次 LLM 调用的用量"""
+
+    role: str
+    model: str
+    node: str
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
+    seconds: float
+    cost: float
+    cache_hit: bool = False
+
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int) -> float:
+    """按 LLM_PRICES 中的每百万 token 单价计算费用（未配置单价的模型记为 0）"""
+    price = settings.llm_prices.get(model)
+    if not price:
+        return 0.0
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    total = (
+        uncached * price.get("input", 0.0)
+        + cached_tokens * price.get("cached_input", price.get("input", 0.0))
+        + completion_tokens * price.get("output", 0.0)
+    )
+    return total / 1_000_000
+
+
+def current_node() -> str:
+    """当前所在的图节点（图外调用返回空字符串）"""
+    try:
+        from langgraph.config import get_config
+
+        return str(get_config().get("metadata", {}).get("langgraph_node", ""))
+    except RuntimeError:
+        return ""
+
+
+class RunAccounting:
+    """一次运行内全部 LLM 调用的用量"""
+
+    def __init__(self) -> None:
+        self.calls: list[LLMCall] = []
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(call.prompt_tokens + call.completion_tokens for call in self.calls)
+
+    def record(self, call: LLMCall) -> None:
+        self.calls.append(call)
+
+    def summary(self) -> dict[str, Any]:
+        """汇总 token、费用与延迟，并按节点细分"""
+        nodes: dict[str, dict[str, Any]] = {}
+        for call in self.calls:
+            node = nodes.setdefault(
+                call.node or "other", {"calls": 0, "tokens": 0, "seconds": 0.0, "cost": 0.0}
+            )
+            node["calls"] += 1
+            node["tokens"] += call.prompt_tokens + call.completion_tokens
+            node["seconds"] += call.seconds
+            node["cost"] += call.cost
+        for node in nodes.values():
+            node["seconds"] = round(node["seconds"], 3)
+            node["cost"] = round(node["cost"], 6)
+        prompt = sum(call.prompt_tokens for call in self.calls)
+        completion = sum(call.completion_tokens for call in self.calls)
+        return {
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "cached_tokens": sum(call.cached_tokens for call in self.calls),
+            "total_tokens": prompt + completion,
+            "llm_calls": len(self.calls),
+            "llm_cache_hits": sum(call.cache_hit for call in self.calls),
+            "llm_seconds": round(sum(call.seconds for call in self.calls), 3),
+            "cost": round(sum(call.cost for call in self.calls), 6),
+            "nodes": nodes,
+        }
+
+
+_accounting: ContextVar[RunAccounting | None] = ContextVar("run_accounting", default=None)
+
+
+def bind_accounting(accounting: RunAccounting) -> None:
+    """在当前上下文（通常是运行自己的任务）中绑定核算对象"""
+    _accounting.set(accounting)
+
+
+@contextmanager
+def accounting_scope() -> Iterator[RunAccounting]:
+    """在上下文内核算 LLM 用量（用于图之外的调用方）"""
+    accounting = RunAccounting()
+    token = _accounting.set(accounting)
+    try:
+        yield accounting
+    finally:
+        _accounting.reset(token)
+
+
+def record_llm_call(
+    role: str,
+    model: str,
+    message: Any,
+    seconds: float,
+    cache_hit: bool = False,
+    estimated: tuple[int, int] | None = None,
+) -> None:
+    """记录一次调用：写入当前运行的核算对象，并累计到进程指标
+
+    estimated 为 (输入, 输出) 的估算值，在响应不带用量（如提前结束的流式调用）时使用。
+    """
+    usage = getattr(message, "usage_metadata", None)
+    if isinstance(usage, dict) and usage.get("total_tokens"):
+        prompt, completion = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+        cached = cached_prompt_tokens(message)
+    else:
+        prompt, completion = estimated or (0, 0)
+        cached = 0
+    call = LLMCall(
+        role=role,
+        model=model,
+        node=current_node(),
+        prompt_tokens=prompt,
+        completion_tokens=completion,
+        cached_tokens=cached,
+        seconds=seconds,
+        cost=0.0 if cache_hit else call_cost(model, prompt, completion, cached),
+        cache_hit=cache_hit,
+    )
+    if call.cost:
+        metrics.inc("llm_cost_total", call.cost, role=role)
+    if call.node:
+        metrics.inc("node_llm_tokens_total", prompt + completion, node=call.node)
+        metrics.observe("node_llm_seconds", seconds, node=call.node)
+
+    accounting = _accounting.get()
+    if accounting is not None:
+        accounting.record(call)
@@ -0,0 +1,212 @@
+"""语义回答缓存
+
+以字符 n-gram 向量的余弦相似度匹配近似问题，命中时直接返回已生成的最终回答。
+只差一个关键词的问题（"enable X" 与 "disable X"、"Python 3.11" 与 "Python 3.10"）
+字符相似度同样很高，因此近似命中还要求两者的数字、标识符与否定词完全一致。
+缓存带 TTL，并按 LRU 淘汰以限制内存占用。
+"""
+
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Any
+
+from src.app.core.config import settings
+from src.app.core.logging import logger
+from src.app.core.metrics import metrics
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_PUNCT_RE = re.compile(r"[^\w\s]")
+# 标识符：含分隔符的词（us-east-1、payment-service、3.11）或含数字的词（gpt4、2024）
+_IDENT_RE = re.compile(r"[a-z0-9]+(?:[-_./:][a-z0-9]+)+|[a-z]*[0-9][a-z0-9]*")
+_WORD_RE = re.compile(r"[a-z']+")
+_NEGATION_WORDS = frozenset(
+    {"not", "no", "never", "without", "none", "cannot", "can't", "don't", "doesn't", "isn't"}
+    | {"aren't", "won't", "shouldn't", "disable", "disabled", "unable"}
+)
+_NEGATION_CHARS = frozenset("不没无非别未禁")
+
+# 召回时只取文档频率最低的若干个 n-gram，且候选数有上限，避免常见 n-gram 退化为全表扫描
+_PROBE_GRAMS = 8
+_MAX_CANDIDATES = 64
+
+
+def _normalize(text: str) -> str:
+    text = _PUNCT_RE.sub(" ", text.casefold())
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def ngram_vector(text: str, n: int = 2) -> Counter[str]:
+    """生成字符 n-gram 词频向量（中英文通用，无需分词）"""
+    normalized = _normalize(text)
+    if len(normalized) < n:
+        return Counter([normalized]) if normalized else Counter()
+    return Counter(normalized[i : i + n] for i in range(len(normalized) - n + 1))
+
+
+def guard_features(text: str) -> frozenset[str]:
+    """近似命中时必须一致的特征：数字与标识符、否定词"""
+    lowered = text.casefold()
+    features = {f"id:{match}" for match in _IDENT_RE.findall(lowered)}
+    features |= {f"neg:{word}" for word in _WORD_RE.findall(lowered) if word in _NEGATION_WORDS}
+    features |= {f"neg:{char}" for char in lowered if char in _NEGATION_CHARS}
+    return frozenset(features)
+
+
+def cosine_similarity(a: Counter[str], b: Counter[str]) -> float:
+    """计算两个稀疏向量的余弦相似度"""
+    if not a or not b:
+        return 0.0
+    if len(a) > len(b):
+        a, b = b, a
+    dot = sum(count * b.get(gram, 0) for gram, count in a.items())
+    norm = math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values()))
+    return dot / norm if norm else 0.0
+
+
+@dataclass
+class _CacheEntry:
+    namespace: str
+    question: str
+    vector: Counter[str]
+    answer: dict[str, Any]
+    expires_at: float
+    grams: set[str] = field(default_factory=set)
+    guards: frozenset[str] = frozenset()
+
+
+class AnswerCache:
+    """带 TTL 与 LRU 淘汰的近似问题回答缓存"""
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl_seconds: float = 600.0,
+        similarity_threshold: float = 0.95,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+        self._index: dict[str, set[str]] = {}  # n-gram -> 问题键，用于候选召回
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, question: str, namespace: str = "") -> dict[str, Any] | None:
+        """查找与问题相同或足够相似的缓存回答（仅在同一命名空间内匹配）"""
+        key = f"{namespace}\x00{_normalize(question)}"
+        vector = ngram_vector(question)
+        guards = guard_features(question)
+        now = time.monotonic()
+
+        with self._lock:
+            candidates = self._candidates(key, vector, namespace, now)
+
+        # 相似度在锁外计算（条目创建后不再修改）
+        best_key, best_score = None, 0.0
+        for candidate, entry in candidates:
+            if candidate == key:
+                best_key, best_score = candidate, 1.0
+                break
+            if entry.guards != guards:
+                continue
+            score = cosine_similarity(vector, entry.vector)
+            if score > best_score:
+                best_key, best_score = candidate, score
+
+        if best_key is None or best_score < self.similarity_threshold:
+            metrics.inc("answer_cache_misses_total")
+            return None
+
+        with self._lock:
+            hit = self._entries.get(best_key)
+            if hit is None:
+                metrics.inc("answer_cache_misses_total")
+                return None
+            self._entries.move_to_end(best_key)
+        metrics.inc("answer_cache_hits_total")
+        logger.info(f"[AnswerCache] 命中缓存 (相似度 {best_score:.2f})")
+        return dict(hit.answer)
+
+    def _candidates(
+        self, key: str, vector: Counter[str], namespace: str, now: float
+    ) -> list[tuple[str, _CacheEntry]]:
+        """召回候选：精确键优先，其余按最稀有的 n-gram 召回并限制数量（调用方持有锁）"""
+        keys = [key] if key in self._entries else []
+        probes = sorted(
+            (gram for gram in vector if gram in self._index), key=lambda g: len(self._index[g])
+        )[:_PROBE_GRAMS]
+        for gram in probes:
+            for candidate in self._index[gram]:
+                if len(keys) >= _MAX_CANDIDATES:
+                    break
+                if candidate not in keys:
+                    keys.append(candidate)
+
+        candidates = []
+        for candidate in keys:
+            entry = self._entries.get(candidate)
+            if entry is None or entry.namespace != namespace:
+                continue
+            if entry.expires_at <= now:
+                self._remove(candidate)
+                continue
+            candidates.append((candidate, entry))
+        return candidates
+
+    def store(self, question: str, answer: dict[str, Any], namespace: str = "") -> None:
+        """写入最终回答"""
+        normalized = _normalize(question)
+        if not normalized:
+            return
+        key = f"{namespace}\x00{normalized}"
+        vector = ngram_vector(question)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            entry = _CacheEntry(
+                namespace=namespace,
+                question=question,
+                vector=vector,
+                answer=dict(answer),
+                expires_at=time.monotonic() + self.ttl_seconds,
+                grams=set(vector),
+                guards=guard_features(question),
+            )
+            self._entries[key] = entry
+            for gram in entry.grams:
+                self._index.setdefault(gram, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                metrics.inc("answer_cache_evictions_total")
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        for gram in entry.grams:
+            keys = self._index.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[gram]
+
+
+# 缓存单例
+answer_cache = AnswerCache(
+    max_entries=settings.answer_cache_max_entries,
+    ttl_seconds=settings.answer_cache_ttl_seconds,
+    similarity_threshold=settings.answer_cache_similarity_threshold,
+)
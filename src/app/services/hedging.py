@@ -0,0 +1,130 @@
+"""LLM 对冲请求
+
+偶发的慢响应决定了尾延迟。调用超过近期延迟的某个分位数仍未返回时，再发起一次相同的
+请求（可发往备用地址），先返回者胜出，另一个被取消。对冲次数受每分钟预算限制，
+避免服务整体变慢时对冲把调用量翻倍。
+"""
+
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import TypeVar
+
+from src.app.core.config import settings
+
+T = TypeVar("T")
+
+
+class HedgePolicy:
+    """按角色维护近期延迟样本，给出对冲时机并管理每分钟预算"""
+
+    def __init__(
+        self,
+        percentile: float | None = None,
+        min_samples: int | None = None,
+        min_delay_seconds: float | None = None,
+        max_per_minute: int | None = None,
+        window: int = 256,
+    ) -> None:
+        self.percentile = percentile or settings.llm_hedge_percentile
+        self.min_samples = min_samples or settings.llm_hedge_min_samples
+        self.min_delay_seconds = (
+            settings.llm_hedge_min_delay_seconds if min_delay_seconds is None else min_delay_seconds
+        )
+        self.max_per_minute = (
+            settings.llm_hedge_max_per_minute if max_per_minute is None else max_per_minute
+        )
+        self._window = window
+        self._latencies: dict[str, deque[float]] = {}
+        self._hedges: deque[float] = deque()  # 最近一分钟内的对冲时间点
+        self._lock = threading.Lock()
+
+    def record(self, key: str, seconds: float) -> None:
+        """记录一次成功调用的延迟"""
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=self._window)).append(seconds)
+
+    def delay(self, key: str) -> float | None:
+        """对冲前的等待时间；样本不足时返回 None（不对冲）"""
+        with self._lock:
+            samples = sorted(self._latencies.get(key, ()))
+        if len(samples) < self.min_samples:
+            return None
+        rank = max(0, math.ceil(self.percentile / 100 * len(samples)) - 1)
+        return max(samples[rank], self.min_delay_seconds)
+
+    def acquire(self) -> bool:
+        """占用一次对冲预算，超出每分钟上限时返回 False"""
+        now = time.monotonic()
+        with self._lock:
+            while self._hedges and self._hedges[0] <= now - 60:
+                self._hedges.popleft()
+            if len(self._hedges) >= self.max_per_minute:
+                return False
+            self._hedges.append(now)
+            return True
+
+
+def _failure(task: asyncio.Future) -> BaseException:
+    """失败任务的异常；被取消的任务返回具体异常而不是 CancelledError"""
+    exception = None if task.cancelled() else task.exception()
+    return exception or RuntimeError("LLM 请求被取消")
+
+
+def _result(task: asyncio.Future[T]) -> T:
+    if task.cancelled():
+        raise _failure(task)
+    return task.result()
+
+
+async def race(
+    primary: Callable[[], Awaitable[T]],
+    hedge: Callable[[], Awaitable[T]],
+    delay: float,
+    acquire: Callable[[], bool],
+    discard: Callable[[T], None] | None = None,
+) -> tuple[T, str]:
+    """发起主请求，超过 delay 未返回且有预算时发起对冲请求，返回 (结果, 结局)
+
+    结局：primary（未对冲）/ budget_exhausted / primary_won / hedge_won。
+    某一方失败（含被取消）时等待另一方；两者都失败时优先抛出主请求的异常，
+    被取消的一方以 RuntimeError 代替 CancelledError，避免被误当作调用方取消。
+    落败方与胜出方同时完成时，其结果交给 discard（供核算落败请求的用量）。
+    """
+    primary_task = asyncio.ensure_future(primary())
+    tasks = [primary_task]
+    winner_task = primary_task
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return _result(primary_task), "primary"
+        if not acquire():
+            await asyncio.wait(tasks)
+            return _result(primary_task), "budget_exhausted"
+
+        hedge_task = asyncio.ensure_future(hedge())
+        tasks.append(hedge_task)
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is None:
+                    winner_task = task
+                    winner = "primary_won" if task is primary_task else "hedge_won"
+                    return task.result(), winner
+        failed = primary_task if not primary_task.cancelled() else hedge_task
+        raise _failure(failed)
+    finally:
+        for task in tasks:
+            # 已完成的任务无法取消；其中成功但未被返回的结果交给 discard
+            if (
+                not task.cancel()
+                and task is not winner_task
+                and discard is not None
+                and not task.cancelled()
+                and task.exception() is None
+            ):
+                discard(task.result())
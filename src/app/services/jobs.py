@@ -0,0 +1,365 @@
+"""异步任务服务
+
+长耗时的 Agent 运行以任务形式提交：请求立即返回任务 ID，由后台 worker 池执行，
+状态与结果持久化在 DatabaseService 的 chat_jobs 表中。任务通过条件更新认领，
+多个进程共享同一张表时每个任务只会被一个 worker 执行；运行中的任务定期续约，
+worker 重启或失联后未完成的任务会被重新排队。
+
+回调地址由服务端发起 POST，提交与发送时都会校验：协议与主机须在白名单内，
+主机解析出的地址不能落在内网、回环或链路本地网段，且不跟随重定向。回调直接发往
+校验过的 IP（Host 头与 TLS SNI 保持原主机名），避免 DNS 重绑定绕过校验。
+"""
+
+import asyncio
+import ipaddress
+import socket
+from collections.abc import Awaitable, Callable, Coroutine
+from datetime import datetime, timedelta
+from enum import Enum
+from fnmatch import fnmatch
+from typing import Any
+from urllib.parse import urlsplit, urlunsplit
+from uuid import uuid4
+
+from sqlalchemy import JSON, DateTime, Integer, String, Text, select, update
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.app.core.config import settings
+from src.app.core.database import Base, DatabaseService, affected_rows, db_service
+from src.app.core.http_client import http_client
+from src.app.core.logging import logger
+from src.app.core.metrics import metrics
+
+JobHandler = Callable[[dict[str, Any]], Awaitable[dict[str, Any]]]
+
+
+class CallbackURLError(ValueError):
+    """回调地址不被允许"""
+
+
+def _is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def validate_callback_url(url: str) -> str:
+    """校验回调地址的协议与主机，返回主机名；不允许时抛出 CallbackURLError"""
+    parts = urlsplit(url)
+    if parts.scheme not in settings.jobs_callback_schemes:
+        raise CallbackURLError(f"不允许的回调协议: {parts.scheme or '(空)'}")
+    host = (parts.hostname or "").lower()
+    if not host:
+        raise CallbackURLError("回调地址缺少主机名")
+    if parts.username or parts.password:
+        raise CallbackURLError("回调地址不能包含用户信息")
+    if not any(fnmatch(host, pattern.lower()) for pattern in settings.jobs_callback_allowed_hosts):
+        raise CallbackURLError(f"回调主机不在允许列表中: {host}")
+    try:
+        public = _is_public(host)
+    except ValueError:
+        public = True  # 域名，发送前解析后再校验
+    if not public:
+        raise CallbackURLError(f"回调地址指向内网或保留地址: {host}")
+    return host
+
+
+async def _resolve_host(host: str) -> list[str]:
+    infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    return [str(info[4][0]) for info in infos]
+
+
+async def pin_callback_url(url: str) -> tuple[str, dict[str, str], dict[str, Any]]:
+    """发送前再次校验并解析主机，返回 (指向已校验 IP 的地址, 请求头, 请求扩展)
+
+    解析出的所有地址都必须是公网地址。连接直接发往校验过的 IP，Host 头与 TLS SNI
+    （证书校验同样按它进行）保持原主机名，之后不会再做一次 DNS 解析。
+    """
+    host = validate_callback_url(url)
+    addresses = await _resolve_host(host)
+    if not addresses or not all(_is_public(address) for address in addresses):
+        raise CallbackURLError(f"回调主机解析到内网或保留地址: {host}")
+    parts = urlsplit(url)
+    address = addresses[0].split("%", 1)[0]
+    netloc = f"[{address}]" if ":" in address else address
+    if parts.port is not None:
+        netloc = f"{netloc}:{parts.port}"
+    host_header = host if parts.port is None else f"{host}:{parts.port}"
+    pinned = urlunsplit(parts._replace(netloc=netloc))
+    return pinned, {"Host": host_header}, {"sni_hostname": host}
+
+
+class JobStatus(str, Enum):
+    """任务状态"""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class ChatJob(Base):
+    """聊天任务记录"""
+
+    __tablename__ = "chat_jobs"
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    status: Mapped[str] = mapped_column(String(16), default=JobStatus.QUEUED.value, index=True)
+    request: Mapped[dict[str, Any]] = mapped_column(JSON)
+    result: Mapped[dict[str, Any] | None] = mapped_column(JSON)
+    error: Mapped[str | None] = mapped_column(Text)
+    callback_url: Mapped[str | None] = mapped_column(String(2048))
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime | None] = mapped_column(DateTime, default=datetime.utcnow)
+    # 运行中兼作心跳时间
+    updated_at: Mapped[datetime | None] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+def _to_dict(job: ChatJob) -> dict[str, Any]:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "result": job.result,
+        "error": job.error,
+        "attempts": job.attempts,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+
+
+class JobQueue:
+    """基于数据库的任务队列 + 进程内 worker 池"""
+
+    def __init__(
+        self,
+        db: DatabaseService = db_service,
+        workers: int | None = None,
+        poll_interval: float | None = None,
+        lease_seconds: float | None = None,
+        max_attempts: int | None = None,
+    ) -> None:
+        self.db = db
+        self.workers = workers or settings.jobs_workers
+        self.poll_interval = poll_interval or settings.jobs_poll_interval_seconds
+        self.lease_seconds = lease_seconds or settings.jobs_lease_seconds
+        self.max_attempts = max_attempts or settings.jobs_max_attempts
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+        self._pending: set[str] = set()  # 已放入本进程队列、尚未认领的任务
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._busy: set[asyncio.Task[Any]] = set()  # 正在执行任务的 worker
+        self._stopping = False
+        self._handler: JobHandler | None = None
+
+    def _enqueue(self, job_id: str) -> None:
+        if job_id not in self._pending:
+            self._pending.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    async def submit(
+        self, request: dict[str, Any], callback_url: str | None = None
+    ) -> dict[str, Any]:
+        """持久化一个新任务并放入队列，回调地址不被允许时抛出 CallbackURLError"""
+        if callback_url is not None:
+            validate_callback_url(callback_url)
+        job = ChatJob(
+            id=uuid4().hex,
+            status=JobStatus.QUEUED.value,
+            request=request,
+            callback_url=callback_url,
+            attempts=0,
+        )
+        async with self.db.get_session() as session:
+            session.add(job)
+        self._enqueue(job.id)
+        metrics.inc("chat_jobs_submitted_total")
+        return _to_dict(job)
+
+    async def get(self, job_id: str) -> dict[str, Any] | None:
+        """查询任务状态与结果"""
+        async with self.db.get_session() as session:
+            job = await session.get(ChatJob, job_id)
+            return _to_dict(job) if job is not None else None
+
+    async def start(self, handler: JobHandler) -> None:
+        """建表后启动 worker 池与数据库扫描（submit / get 依赖这里创建的表）"""
+        if self._tasks:
+            return
+        await self.db.init_db()
+        self._handler = handler
+        self._stopping = False
+        self._queue = asyncio.Queue()  # 绑定到当前事件循环
+        self._pending.clear()
+        for _ in range(self.workers):
+            self._spawn(self._worker())
+        self._spawn(self._poll())
+
+    def _spawn(self, coro: Coroutine[Any, Any, None]) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def stop(self, timeout: float) -> None:
+        """停止扫描与认领，再等待进行中的任务完成
+
+        先停掉扫描和空闲 worker，已出队但未认领的任务留在数据库中由其他进程接手；
+        超时仍未完成的任务保持 running 状态，续约过期后由存活的 worker 重新排队。
+        """
+        if not self._tasks:
+            return
+        self._stopping = True
+        for task in self._tasks - self._busy:
+            task.cancel()
+        if self._busy:
+            await asyncio.wait(self._busy, timeout=timeout)
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _poll(self) -> None:
+        """定期回收失联任务并拉取数据库中的待执行任务"""
+        while True:
+            try:
+                await self.recover()
+            except Exception as e:
+                logger.error(f"[Jobs] 扫描任务表失败: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def recover(self) -> int:
+        """将续约过期的运行中任务重新排队，并把待执行任务放入本进程队列"""
+        stale_before = datetime.utcnow() - timedelta(seconds=self.lease_seconds)
+        async with self.db.get_session() as session:
+            requeued = await session.execute(
+                update(ChatJob)
+                .where(ChatJob.status == JobStatus.RUNNING.value, ChatJob.updated_at < stale_before)
+                .values(status=JobStatus.QUEUED.value, updated_at=datetime.utcnow())
+            )
+            recovered = affected_rows(requeued)
+            if recovered:
+                metrics.inc("chat_jobs_recovered_total", recovered)
+                logger.warning(f"[Jobs] 重新排队 {recovered} 个失联任务")
+            queued = await session.scalars(
+                select(ChatJob.id)
+                .where(ChatJob.status == JobStatus.QUEUED.value)
+                .order_by(ChatJob.created_at)
+            )
+            job_ids = list(queued)
+        for job_id in job_ids:
+            self._enqueue(job_id)
+        return len(job_ids)
+
+    async def _claim(self, job_id: str) -> ChatJob | None:
+        """以条件更新认领任务，未抢到或已超过重试次数时返回 None"""
+        async with self.db.get_session() as session:
+            claimed = await session.execute(
+                update(ChatJob)
+                .where(ChatJob.id == job_id, ChatJob.status == JobStatus.QUEUED.value)
+                .values(
+                    status=JobStatus.RUNNING.value,
+                    attempts=ChatJob.attempts + 1,
+                    updated_at=datetime.utcnow(),
+                )
+            )
+            if not affected_rows(claimed):
+                return None
+            job = await session.get(ChatJob, job_id)
+
+        if job is None:
+            return None
+        if job.attempts > self.max_attempts:
+            await self._finish(job, JobStatus.FAILED, error="超过最大重试次数")
+            return None
+        return job
+
+    async def _heartbeat(self, job_id: str) -> None:
+        """运行期间定期续约"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            async with self.db.get_session() as session:
+                await session.execute(
+                    update(ChatJob).where(ChatJob.id == job_id).values(updated_at=datetime.utcnow())
+                )
+
+    async def _worker(self) -> None:
+        worker = asyncio.current_task()
+        assert worker is not None  # 由 _spawn 以任务运行
+        while not self._stopping:
+            job_id = await self._queue.get()
+            self._pending.discard(job_id)
+            if self._stopping:
+                return
+            self._busy.add(worker)
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                logger.error(f"[Jobs] 任务 {job_id} 处理异常: {e}")
+            finally:
+                self._busy.discard(worker)
+
+    async def _run(self, job_id: str) -> None:
+        handler = self._handler
+        if handler is None:
+            raise RuntimeError("JobQueue has not been started")
+        job = await self._claim(job_id)
+        if job is None:
+            return
+
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        started = asyncio.get_running_loop().time()
+        try:
+            result = await handler(job.request)
+        except Exception as e:
+            logger.error(f"[Jobs] 任务 {job_id} 执行失败: {e}")
+            await self._finish(job, JobStatus.FAILED, error=str(e))
+        else:
+            await self._finish(job, JobStatus.SUCCEEDED, result=result)
+        finally:
+            heartbeat.cancel()
+            metrics.observe(
+                "chat_job_duration_seconds", asyncio.get_running_loop().time() - started
+            )
+
+    async def _finish(
+        self,
+        job: ChatJob,
+        status: JobStatus,
+        result: dict[str, Any] | None = None,
+        error: str | None = None,
+    ) -> None:
+        """写入终态并发送回调"""
+        async with self.db.get_session() as session:
+            await session.execute(
+                update(ChatJob)
+                .where(ChatJob.id == job.id)
+                .values(
+                    status=status.value, result=result, error=error, updated_at=datetime.utcnow()
+                )
+            )
+        metrics.inc("chat_jobs_finished_total", status=status.value)
+        if job.callback_url:
+            await self._callback(
+                job.callback_url,
+                {"job_id": job.id, "status": status.value, "result": result, "error": error},
+            )
+
+    async def _callback(self, url: str, payload: dict[str, Any]) -> None:
+        """回调通知，失败只记录日志（结果仍可通过查询接口获取）"""
+        try:
+            pinned, headers, extensions = await pin_callback_url(url)
+            response = await http_client.post(
+                pinned,
+                json_data=payload,
+                headers=headers,
+                extensions=extensions,
+                timeout=settings.jobs_callback_timeout_seconds,
+                follow_redirects=False,
+            )
+            response.raise_for_status()
+            metrics.inc("chat_job_callbacks_total", outcome="ok")
+        except Exception as e:
+            metrics.inc("chat_job_callbacks_total", outcome="error")
+            logger.error(f"[Jobs] 回调 {url} 失败: {e}")
+
+
+# 任务队列单例
+job_queue = JobQueue()
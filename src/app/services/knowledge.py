@@ -1,9 +1,25 @@
 """Tavily 知识检索服务"""
 
+import asyncio
+import contextvars
+
 from tavily import AsyncTavilyClient
 
 from src.app.core.config import settings
 from src.app.core.logging import logger
+from src.app.core.metrics import metrics
+
+# 共享检索作用域：同一作用域内相同查询只调用一次 Tavily
+_shared_searches: contextvars.ContextVar[dict[tuple[str, int], asyncio.Task] | None] = (
+    contextvars.ContextVar("shared_searches", default=None)
+)
+
+
+def shared_search_context() -> contextvars.Context:
+    """创建带共享检索作用域的上下文，在其中创建的任务共享相同查询的检索结果"""
+    context = contextvars.copy_context()
+    context.run(_shared_searches.set, {})
+    return context
 
 
 class KnowledgeService:
@@ -26,7 +42,23 @@ class KnowledgeService:
 
         Returns:
             检索结果列表
+
+        在 shared_search_context() 创建的上下文中，相同查询共享一次检索调用。
         """
+        shared = _shared_searches.get()
+        if shared is None:
+            return await self._search(query, max_results)
+
+        key = (" ".join(query.split()).casefold(), max_results)
+        task = shared.get(key)
+        if task is None:
+            task = asyncio.create_task(self._search(query, max_results))
+            shared[key] = task
+        else:
+            metrics.inc("knowledge_search_shared_total")
+        return list(await asyncio.shield(task))
+
+    async def _search(self, query: str, max_results: int) -> list[dict]:
         if not self.client:
             logger.warning("Tavily API Key 未配置")
             return []
@@ -1,20 +1,347 @@
-"""LLM 服务"""
+"""LLM 服务
 
+按图中的角色（判断、查询优化、生成、修订、评估、摘要、SRE 诊断）路由模型：每个角色可单独
+配置 model / temperature / max_tokens / base_url，廉价角色可以放到更快的模型上。
+节点通过 model_registry.ainvoke / astream(role, messages) 调用，按角色记录延迟与 token 指标。
+LLM_CACHE_ROLES 中的角色以温度 0 调用，ainvoke 的响应经 llm_cache 精确匹配缓存；
+开启 LLM_HEDGE_ENABLED 时，ainvoke 超过近期延迟分位数仍未返回会发起对冲请求；逐 token
+推送给客户端的调用不对冲，对冲请求不挂图的回调，避免 SSE 中出现重复的 token。
+所有调用先经 rate_scheduler 按 RPM / TPM 额度与优先级放行，结束后记入当前运行的用量核算。
+"""
+
+import asyncio
+import time
+from collections.abc import AsyncGenerator, Awaitable, Callable
+from contextlib import aclosing
+from dataclasses import dataclass, replace
+from enum import Enum
+from typing import Any, cast
+
+from langchain_core.messages import AIMessage, BaseMessage, BaseMessageChunk
 from langchain_openai import ChatOpenAI
+from langgraph.constants import TAG_NOSTREAM
+from openai import RateLimitError
 from pydantic import SecretStr
 
 from src.app.core.config import settings
+from src.app.core.metrics import metrics
+from src.app.core.tokens import estimate_tokens
+from src.app.services.accounting import current_node, record_llm_call
+from src.app.services.hedging import HedgePolicy, race
+from src.app.services.llm_cache import LLMCache, cache_key, llm_cache
+from src.app.services.rate_limiter import RateScheduler, rate_scheduler
+
+
+class ModelRole(str, Enum):
+    """模型角色"""
+
+    CHECK = "check"  # 是否需要检索（YES/NO）
+    REFINE = "refine"  # 检索查询优化
+    WRITE = "write"  # 回答生成
+    REVISE = "revise"  # 反思轮次的补丁修订
+    REVIEW = "review"  # 回答评估与反思
+    SUMMARIZE = "summarize"  # 会话历史压缩
+    SRE_DIAGNOSIS = "sre_diagnosis"  # SRE 根因诊断
+
+
+@dataclass(frozen=True)
+class ModelConfig:
+    """单个角色的模型配置"""
+
+    model: str
+    temperature: float = 0.7
+    max_tokens: int | None = None
+    base_url: str | None = None
+    api_key: str | None = None
+
+
+# 各角色的默认参数（模型与地址默认沿用 DeepSeek 配置，可通过 LLM_ROLES 覆盖）
+ROLE_DEFAULTS: dict[ModelRole, dict[str, Any]] = {
+    ModelRole.CHECK: {"temperature": 0.0, "max_tokens": 16},
+    ModelRole.REFINE: {"temperature": 0.3, "max_tokens": 256},
+    ModelRole.WRITE: {"temperature": 0.7},
+    ModelRole.REVISE: {"temperature": 0.2},
+    ModelRole.REVIEW: {"temperature": 0.2},
+    ModelRole.SUMMARIZE: {"temperature": 0.3},
+    ModelRole.SRE_DIAGNOSIS: {"temperature": 0.2},
+}
 
 
-def get_llm() -> ChatOpenAI:
-    """获取 LLM 实例"""
+def get_llm(config: ModelConfig | None = None) -> ChatOpenAI:
+    """获取 LLM 实例（默认为生成角色的配置）"""
+    config = config or model_registry.config(ModelRole.WRITE)
+    api_key = config.api_key or settings.deepseek_api_key
     return ChatOpenAI(
-        model=settings.deepseek_model,
-        api_key=SecretStr(settings.deepseek_api_key) if settings.deepseek_api_key else None,
-        base_url=settings.deepseek_base_url,
-        temperature=0.7,
+        model=config.model,
+        api_key=SecretStr(api_key) if api_key else None,
+        base_url=config.base_url or settings.deepseek_base_url,
+        temperature=config.temperature,
+        max_completion_tokens=config.max_tokens,  # max_tokens 字段的别名
+        stream_usage=True,  # 流式输出时同样返回 token 用量
+        include_response_headers=True,  # 供速率调度读取 x-ratelimit-* 头
     )
 
 
-# LLM 单例
-llm = get_llm()
+def _streams_tokens(kwargs: dict[str, Any]) -> bool:
+    """调用是否位于逐 token 推送给客户端的节点中（未标记 nostream）"""
+    if current_node() not in settings.stream_token_nodes:
+        return False
+    return TAG_NOSTREAM not in (kwargs.get("config") or {}).get("tags", [])
+
+
+class ModelRegistry:
+    """按角色缓存模型实例并记录调用指标"""
+
+    def __init__(
+        self,
+        overrides: dict[str, dict[str, Any]] | None = None,
+        cache: LLMCache | None = None,
+        cache_roles: list[str] | None = None,
+        scheduler: RateScheduler | None = None,
+    ) -> None:
+        self.overrides = settings.llm_roles if overrides is None else overrides
+        self.cache = cache or llm_cache
+        self.cache_roles = set(settings.llm_cache_roles if cache_roles is None else cache_roles)
+        self.hedge_policy = HedgePolicy()
+        self.scheduler = scheduler or rate_scheduler
+        self._models: dict[ModelConfig, ChatOpenAI] = {}
+
+    def config(self, role: ModelRole) -> ModelConfig:
+        """合并默认参数与覆盖配置；启用缓存的角色温度固定为 0，保证命中的结果有效"""
+        base = ModelConfig(model=settings.deepseek_model)
+        config = replace(
+            base, **{**ROLE_DEFAULTS.get(role, {}), **self.overrides.get(role.value, {})}
+        )
+        if role.value in self.cache_roles:
+            config = replace(config, temperature=0.0)
+        return config
+
+    def _cache_key(
+        self, role: ModelRole, messages: list[BaseMessage], kwargs: dict[str, Any]
+    ) -> str | None:
+        """可缓存的调用返回缓存键；未启用缓存或调用时覆盖了非零温度返回 None"""
+        if role.value not in self.cache_roles or kwargs.get("temperature", 0) != 0:
+            return None
+        params = {k: v for k, v in kwargs.items() if k != "config"}
+        return cache_key(self.config(role), messages, params)
+
+    def get(self, role: ModelRole) -> ChatOpenAI:
+        """获取角色对应的模型实例（配置相同的角色共享实例与连接池）"""
+        return self._model(self.config(role))
+
+    def get_hedge(self, role: ModelRole) -> ChatOpenAI:
+        """获取对冲请求使用的模型实例（配置了备用地址时发往备用地址）"""
+        config = self.config(role)
+        if settings.llm_hedge_base_url:
+            config = replace(config, base_url=settings.llm_hedge_base_url)
+        return self._model(config)
+
+    def _model(self, config: ModelConfig) -> ChatOpenAI:
+        model = self._models.get(config)
+        if model is None:
+            model = self._models[config] = get_llm(config)
+        return model
+
+    async def ainvoke(
+        self, role: ModelRole, messages: list[BaseMessage], **kwargs: Any
+    ) -> BaseMessage:
+        """以角色调用模型，记录延迟、token 与错误指标"""
+        model = self.config(role).model
+        started = time.perf_counter()
+        key = self._cache_key(role, messages, kwargs)
+        if key is not None:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                content, tier = cached
+                metrics.inc("llm_cache_hits_total", role=role.value, tier=tier)
+                response: BaseMessage = AIMessage(
+                    content=content, response_metadata={"llm_cache": tier}
+                )
+                record_llm_call(
+                    role.value, model, response, time.perf_counter() - started, cache_hit=True
+                )
+                return response
+            metrics.inc("llm_cache_misses_total", role=role.value)
+
+        try:
+            response = await self._invoke(role, messages, kwargs)
+        except Exception:
+            metrics.inc("llm_errors_total", role=role.value)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe("llm_call_seconds", elapsed, role=role.value)
+
+        self._record_usage(role, response)
+        record_llm_call(role.value, model, response, elapsed)
+        if key is not None and isinstance(response.content, str):
+            await self.cache.set(key, response.content)
+        return response
+
+    def _estimate_tokens(self, role: ModelRole, messages: list[BaseMessage]) -> int:
+        """调度用的 token 预估：输入估算 + 输出上限"""
+        output = self.config(role).max_tokens or settings.llm_rate_limit_default_output_tokens
+        return sum(estimate_tokens(str(message.content)) for message in messages) + output
+
+    def _settle(self, estimated: int, message: Any) -> bool:
+        """以响应头与实际用量修正调度器额度，返回是否已按实际用量结算"""
+        metadata = getattr(message, "response_metadata", None)
+        if isinstance(metadata, dict):
+            self.scheduler.observe_headers(metadata.get("headers"))
+        usage = getattr(message, "usage_metadata", None)
+        if isinstance(usage, dict) and usage.get("total_tokens"):
+            self.scheduler.settle(estimated, usage["total_tokens"])
+            return True
+        return False
+
+    async def _invoke(
+        self, role: ModelRole, messages: list[BaseMessage], kwargs: dict[str, Any]
+    ) -> BaseMessage:
+        """经调度器放行后发起调用；开启对冲且延迟样本充足时以对冲方式调用
+
+        每次调用各自结算预留的额度：失败或被取消（含对冲中落败的一方）时全部归还。
+        胜出的响应由 ainvoke 计入核算；对冲中落败的请求同样计费，在此计入当前运行：
+        已完成的按实际用量，被取消的拿不到用量，按估算的输入 token 计入（输出记为 0）。
+        """
+        estimated = self._estimate_tokens(role, messages)
+
+        async def call(model: ChatOpenAI, call_kwargs: dict[str, Any] = kwargs) -> BaseMessage:
+            await self.scheduler.acquire(estimated)
+            try:
+                response = await model.ainvoke(messages, **call_kwargs)
+            except RateLimitError as e:
+                self.scheduler.on_rate_limited(e.response.headers)
+                self.scheduler.settle(estimated, 0)
+                raise
+            except BaseException:
+                self.scheduler.settle(estimated, 0)
+                raise
+            self._settle(estimated, response)
+            return response
+
+        if not settings.llm_hedge_enabled or _streams_tokens(kwargs):
+            return await call(self.get(role))
+
+        model = self.config(role).model
+        prompt = sum(estimate_tokens(str(message.content)) for message in messages)
+        seconds: dict[int, float] = {}  # id(响应) -> 该请求自身的耗时，供核算落败方
+
+        async def attempt(chat_model: ChatOpenAI, call_kwargs: dict[str, Any]) -> BaseMessage:
+            started = time.perf_counter()
+            try:
+                response = await call(chat_model, call_kwargs)
+            except asyncio.CancelledError:
+                elapsed = time.perf_counter() - started
+                record_llm_call(role.value, model, None, elapsed, estimated=(prompt, 0))
+                raise
+            seconds[id(response)] = time.perf_counter() - started
+            return response
+
+        def discard(response: BaseMessage) -> None:
+            self._record_usage(role, response)
+            record_llm_call(role.value, model, response, seconds.get(id(response), 0.0))
+
+        async def primary(
+            invoke: Callable[[ChatOpenAI, dict[str, Any]], Awaitable[BaseMessage]] = attempt,
+        ) -> BaseMessage:
+            # 只记录主请求自身的延迟：用对冲后的延迟更新分位数会让对冲时机越来越早
+            started = time.perf_counter()
+            try:
+                response = await invoke(self.get(role), kwargs)
+            except asyncio.CancelledError:
+                # 被对冲取消时实际延迟至少是已等待的时间
+                self.hedge_policy.record(role.value, time.perf_counter() - started)
+                raise
+            self.hedge_policy.record(role.value, time.perf_counter() - started)
+            return response
+
+        async def hedge() -> BaseMessage:
+            # 对冲请求不挂图的回调，token 与追踪事件只来自主请求
+            config = kwargs.get("config") or {}
+            tags = [*config.get("tags", []), TAG_NOSTREAM]
+            detached = {**kwargs, "config": {**config, "callbacks": [], "tags": tags}}
+            return await attempt(self.get_hedge(role), detached)
+
+        delay = self.hedge_policy.delay(role.value)
+        if delay is None:
+            return await primary(call)  # 不对冲，只积累延迟样本
+        response, outcome = await race(
+            primary, hedge, delay, self.hedge_policy.acquire, discard=discard
+        )
+        self._record_hedge(role, outcome)
+        return response
+
+    @staticmethod
+    def _record_hedge(role: ModelRole, outcome: str) -> None:
+        """记录对冲结局与对冲率；p99 对比见 llm_call_seconds 在开启前后的变化"""
+        metrics.inc("llm_hedge_eligible_total", role=role.value)
+        if outcome != "primary":
+            metrics.inc("llm_hedges_total", role=role.value, outcome=outcome)
+        hedged = sum(
+            metrics.get_counter("llm_hedges_total", role=role.value, outcome=o)
+            for o in ("primary_won", "hedge_won")
+        )
+        eligible = metrics.get_counter("llm_hedge_eligible_total", role=role.value)
+        metrics.set_gauge("llm_hedge_rate", hedged / eligible, role=role.value)
+
+    async def astream(
+        self, role: ModelRole, messages: list[BaseMessage], **kwargs: Any
+    ) -> AsyncGenerator[BaseMessageChunk, None]:
+        """以角色流式调用模型
+
+        调用方提前结束迭代（aclose）时底层流随之关闭，服务端停止生成；此时拿不到
+        末尾的用量块，用量核算与调度器额度都按已收到的文本估算，出错且没有输出时全部归还。
+        """
+        estimated = self._estimate_tokens(role, messages)
+        await self.scheduler.acquire(estimated)
+        started = time.perf_counter()
+        last_usage: Any = None
+        settled = False
+        text = ""
+        try:
+            # ChatOpenAI.astream 是异步生成器，标注为 AsyncIterator；aclosing 需要 aclose
+            stream = cast(
+                AsyncGenerator[BaseMessageChunk, None], self.get(role).astream(messages, **kwargs)
+            )
+            async with aclosing(stream):
+                async for chunk in stream:
+                    self._record_usage(role, chunk)
+                    settled = self._settle(estimated, chunk) or settled
+                    if isinstance(getattr(chunk, "usage_metadata", None), dict):
+                        last_usage = chunk
+                    text += chunk.content if isinstance(chunk.content, str) else ""
+                    yield chunk
+        except RateLimitError as e:
+            self.scheduler.on_rate_limited(e.response.headers)
+            metrics.inc("llm_errors_total", role=role.value)
+            raise
+        except Exception:
+            metrics.inc("llm_errors_total", role=role.value)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe("llm_call_seconds", elapsed, role=role.value)
+            prompt = sum(estimate_tokens(str(message.content)) for message in messages)
+            if not settled:
+                self.scheduler.settle(estimated, prompt + estimate_tokens(text) if text else 0)
+            record_llm_call(
+                role.value,
+                self.config(role).model,
+                last_usage,
+                elapsed,
+                estimated=(prompt, estimate_tokens(text)),
+            )
+
+    @staticmethod
+    def _record_usage(role: ModelRole, message: Any) -> None:
+        usage = getattr(message, "usage_metadata", None)
+        if isinstance(usage, dict):
+            metrics.inc("llm_input_tokens_total", usage.get("input_tokens", 0), role=role.value)
+            metrics.inc("llm_output_tokens_total", usage.get("output_tokens", 0), role=role.value)
+
+
+# 模型注册表单例
+model_registry = ModelRegistry()
+
+# 生成角色的 LLM 单例（兼容直接使用 llm 的调用方）
+llm = model_registry.get(ModelRole.WRITE)
@@ -0,0 +1,186 @@
+"""LLM 响应精确匹配缓存
+
+判断、查询优化、诊断等分类式调用经常以完全相同的输入重复出现。以模型配置、调用参数
+与消息内容的哈希为键缓存响应：内存 LRU 在前，SQLite 磁盘层在后，两层各自有 TTL 与
+条目上限；磁盘命中会回填内存层。由 ModelRegistry 按角色启用，启用缓存的角色温度固定为 0。
+
+内存层只在事件循环线程中访问，不加锁；磁盘层在线程池中执行，由独立的锁串行化。
+磁盘层超出上限一定比例后才批量淘汰，避免每次写入都扫描整张表。
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from langchain_core.messages import BaseMessage
+
+from src.app.core.config import settings
+from src.app.core.logging import logger
+
+if TYPE_CHECKING:
+    from src.app.services.llm import ModelConfig
+
+
+def cache_key(config: "ModelConfig", messages: list[BaseMessage], params: dict[str, Any]) -> str:
+    """模型配置 + 调用参数 + 消息内容的哈希（API Key 不参与）"""
+    payload = {
+        "config": {k: v for k, v in asdict(config).items() if k != "api_key"},
+        "params": params,
+        "messages": [(message.type, message.content) for message in messages],
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+_DISK_EVICT_SLACK = 0.1  # 磁盘层条目数超过上限的这一比例后才淘汰回上限
+
+
+class LLMCache:
+    """内存 LRU + SQLite 两级缓存，值为响应文本"""
+
+    def __init__(
+        self,
+        path: str | None = None,
+        memory_max_entries: int | None = None,
+        memory_ttl_seconds: float | None = None,
+        disk_max_entries: int | None = None,
+        disk_ttl_seconds: float | None = None,
+    ) -> None:
+        path = settings.llm_cache_path if path is None else path
+        self.path = Path(path) if path else None
+        self.memory_max_entries = memory_max_entries or settings.llm_cache_memory_max_entries
+        self.memory_ttl_seconds = memory_ttl_seconds or settings.llm_cache_memory_ttl_seconds
+        self.disk_max_entries = disk_max_entries or settings.llm_cache_disk_max_entries
+        self.disk_ttl_seconds = disk_ttl_seconds or settings.llm_cache_disk_ttl_seconds
+        self._memory: OrderedDict[str, tuple[str, float]] = OrderedDict()  # key -> (值, 过期时间)
+        self._disk_lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._disk_rows = 0  # 磁盘层条目数估计（覆盖写入也计数，淘汰时重新统计）
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path is None:
+                raise RuntimeError("LLM 缓存未配置磁盘路径")
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)"
+            )
+            self._disk_rows = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return self._conn
+
+    def _memory_get(self, key: str) -> str | None:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.time():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_set(self, key: str, value: str) -> None:
+        self._memory[key] = (value, time.time() + self.memory_ttl_seconds)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key: str) -> str | None:
+        with self._disk_lock:
+            conn = self._connect()
+            row: tuple[str, float] | None = conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            now = time.time()
+            if created_at + self.disk_ttl_seconds <= now:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return value
+
+    def _disk_set(self, key: str, value: str) -> None:
+        with self._disk_lock:
+            conn = self._connect()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._disk_rows += 1
+            if self._disk_rows > self.disk_max_entries * (1 + _DISK_EVICT_SLACK):
+                self._disk_evict(conn, now)
+            conn.commit()
+
+    def _disk_evict(self, conn: sqlite3.Connection, now: float) -> None:
+        """清理过期条目，并按最近访问时间淘汰超出上限的条目（调用方持有磁盘锁）"""
+        conn.execute("DELETE FROM llm_cache WHERE created_at <= ?", (now - self.disk_ttl_seconds,))
+        conn.execute(
+            "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache "
+            "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_max_entries,),
+        )
+        self._disk_rows = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    async def get(self, key: str) -> tuple[str, str] | None:
+        """查找缓存，返回 (值, 命中层级 memory/disk)"""
+        value = self._memory_get(key)
+        if value is not None:
+            return value, "memory"
+        if self.path is None:
+            return None
+        try:
+            value = await asyncio.to_thread(self._disk_get, key)
+        except sqlite3.Error as e:
+            logger.error(f"[LLMCache] 读取磁盘缓存失败: {e}")
+            return None
+        if value is None:
+            return None
+        self._memory_set(key, value)
+        return value, "disk"
+
+    async def set(self, key: str, value: str) -> None:
+        """写入两级缓存（磁盘写入失败只记录日志）"""
+        self._memory_set(key, value)
+        if self.path is None:
+            return
+        try:
+            await asyncio.to_thread(self._disk_set, key, value)
+        except sqlite3.Error as e:
+            logger.error(f"[LLMCache] 写入磁盘缓存失败: {e}")
+
+    def clear(self) -> None:
+        """清空内存层"""
+        self._memory.clear()
+
+    def close(self) -> None:
+        """关闭磁盘连接"""
+        with self._disk_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# LLM 响应缓存单例
+llm_cache = LLMCache()
@@ -0,0 +1,261 @@
+"""会话记忆服务
+
+按 conversation_id 通过 DatabaseService 持久化对话历史。历史超过 token 预算时，
+最早的轮次被 LLM 压缩进滚动摘要，使送入 writer 的历史消息始终处于固定预算内。
+摘要在数据库事务之外生成，写入以版本号做乐观并发控制，同一会话的并发轮次不会互相覆盖。
+"""
+
+import asyncio
+import weakref
+from datetime import datetime
+from typing import Any
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from sqlalchemy import JSON, DateTime, Integer, String, Text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.app.core.config import settings
+from src.app.core.database import Base, DatabaseService, affected_rows, db_service
+from src.app.core.logging import logger
+from src.app.core.metrics import metrics
+from src.app.core.prompts import SUMMARIZE_PROMPT
+from src.app.core.tokens import chars_for_tokens, estimate_tokens, truncate_to_tokens
+from src.app.services.llm import ModelRole, model_registry
+from src.app.services.rate_limiter import Priority, llm_priority
+
+
+class ConversationRecord(Base):
+    """会话记录：滚动摘要 + 未压缩的近期消息"""
+
+    __tablename__ = "conversations"
+
+    id: Mapped[str] = mapped_column(String(128), primary_key=True)
+    summary: Mapped[str] = mapped_column(Text, default="")
+    # [{"role": ..., "content": ...}]
+    messages: Mapped[list[dict[str, Any]]] = mapped_column(JSON, default=list)
+    updated_at: Mapped[datetime | None] = mapped_column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+    version: Mapped[int] = mapped_column(Integer, default=1)  # 乐观锁版本号，每次写入加一
+
+
+# 与其他进程并发写入同一会话时的最大尝试次数
+_MAX_APPEND_ATTEMPTS = 3
+
+
+def _to_message(item: dict[str, str]) -> BaseMessage:
+    if item.get("role") == "assistant":
+        return AIMessage(content=item.get("content", ""))
+    return HumanMessage(content=item.get("content", ""))
+
+
+def _messages_tokens(messages: list[dict[str, str]]) -> int:
+    return sum(estimate_tokens(m.get("content", "")) for m in messages)
+
+
+class ConversationMemory:
+    """会话记忆：加载窗口化历史、追加新轮次并压缩旧轮次"""
+
+    def __init__(
+        self,
+        db: DatabaseService = db_service,
+        history_token_budget: int | None = None,
+        summary_token_budget: int | None = None,
+    ) -> None:
+        self.db = db
+        self.history_token_budget = (
+            history_token_budget or settings.conversation_history_token_budget
+        )
+        self.summary_token_budget = (
+            summary_token_budget or settings.conversation_summary_token_budget
+        )
+        self._schema_ready = False
+        self._schema_lock = asyncio.Lock()
+        self._pending: dict[str, set[asyncio.Task]] = {}  # 会话 -> 后台持久化任务
+        self._locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+
+    async def _ensure_schema(self) -> None:
+        if self._schema_ready:
+            return
+        async with self._schema_lock:
+            if not self._schema_ready:
+                await self.db.init_db()
+                self._schema_ready = True
+
+    async def load(self, conversation_id: str) -> list[BaseMessage]:
+        """加载会话历史（摘要 + 预算内的近期消息）；读取失败时降级为空历史
+
+        摘要作为第一条消息返回；本进程内该会话尚未完成的写入会先等待其完成。
+        """
+        await self.flush(conversation_id)
+        try:
+            await self._ensure_schema()
+            async with self.db.get_session() as session:
+                record = await session.get(ConversationRecord, conversation_id)
+                if record is None:
+                    return []
+                summary, messages = record.summary, list(record.messages or [])
+        except Exception as e:
+            logger.error(f"[Memory] 加载会话 {conversation_id} 失败: {e}")
+            return []
+
+        history: list[BaseMessage] = []
+        budget = self.history_token_budget
+        if summary:
+            summary_message = f"以下是之前对话的摘要：\n{summary}"
+            history.append(SystemMessage(content=summary_message))
+            budget -= estimate_tokens(summary_message)
+
+        window = self._fit_window(messages, budget)
+        metrics.observe("conversation_history_tokens", _messages_tokens(window))
+        return history + [_to_message(m) for m in window]
+
+    def _fit_window(self, messages: list[dict[str, str]], budget: int) -> list[dict[str, str]]:
+        """从最新消息向前保留，直到用完预算；单条超长消息被截断"""
+        window: list[dict[str, str]] = []
+        remaining = max(budget, 0)
+        for item in reversed(messages):
+            tokens = estimate_tokens(item.get("content", ""))
+            if tokens > remaining:
+                if not window and remaining > 0:
+                    content = truncate_to_tokens(item.get("content", ""), remaining)
+                    window.append({**item, "content": content})
+                break
+            window.append(item)
+            remaining -= tokens
+        return list(reversed(window))
+
+    async def append_turn(self, conversation_id: str, user_message: str, reply: str) -> None:
+        """追加一轮对话，超出预算时将最早的轮次压缩进摘要
+
+        读取、摘要（LLM 调用）与写入分开进行，不在事务中等待 LLM。写入时校验读取时的
+        版本号，被其他进程抢先写入则重新读取后重试；同一进程内同一会话的写入依次执行。
+        """
+        await self._ensure_schema()
+        turn = [{"role": "user", "content": user_message}, {"role": "assistant", "content": reply}]
+        lock = self._locks.setdefault(conversation_id, asyncio.Lock())
+        async with lock:
+            for _ in range(_MAX_APPEND_ATTEMPTS):
+                summary, messages, version = await self._read(conversation_id)
+                messages += turn
+                evicted = self._evict(summary, messages)
+                if evicted:
+                    summary = await self._summarize(summary, evicted)
+                if await self._write(conversation_id, summary, messages, version):
+                    if evicted:
+                        metrics.inc("conversation_compactions_total")
+                        logger.info(f"[Memory] 会话 {conversation_id} 压缩了 {len(evicted)} 条消息")
+                    return
+                metrics.inc("conversation_write_conflicts_total")
+        raise RuntimeError(f"会话 {conversation_id} 并发写入冲突，已重试 {_MAX_APPEND_ATTEMPTS} 次")
+
+    async def _read(self, conversation_id: str) -> tuple[str, list[dict[str, Any]], int | None]:
+        """读取摘要、消息与版本号（会话不存在时版本号为 None）"""
+        async with self.db.get_session() as session:
+            record = await session.get(ConversationRecord, conversation_id)
+            if record is None:
+                return "", [], None
+            return record.summary or "", list(record.messages or []), record.version
+
+    async def _write(
+        self,
+        conversation_id: str,
+        summary: str,
+        messages: list[dict[str, Any]],
+        version: int | None,
+    ) -> bool:
+        """按读取时的版本号写入；版本已变化或会话已被并发创建时返回 False"""
+        try:
+            async with self.db.get_session() as session:
+                if version is None:
+                    session.add(
+                        ConversationRecord(id=conversation_id, summary=summary, messages=messages)
+                    )
+                    return True
+                result = await session.execute(
+                    update(ConversationRecord)
+                    .where(
+                        ConversationRecord.id == conversation_id,
+                        ConversationRecord.version == version,
+                    )
+                    .values(
+                        summary=summary,
+                        messages=messages,
+                        version=version + 1,
+                        updated_at=datetime.utcnow(),
+                    )
+                )
+                return affected_rows(result) == 1
+        except IntegrityError:
+            return False
+
+    def _evict(self, summary: str, messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """超出预算时按轮次（用户 + 助手）成对移出最早的消息，返回被移出的消息"""
+        evicted: list[dict[str, Any]] = []
+        while (
+            len(messages) > 2
+            and estimate_tokens(summary) + _messages_tokens(messages) > self.history_token_budget
+        ):
+            evicted += messages[:2]
+            del messages[:2]
+        return evicted
+
+    def schedule_append(self, conversation_id: str, user_message: str, reply: str) -> None:
+        """在后台持久化一轮对话；flush / load 会等待它完成"""
+
+        async def _append() -> None:
+            try:
+                await self.append_turn(conversation_id, user_message, reply)
+            except Exception as e:
+                logger.error(f"[Memory] 保存会话 {conversation_id} 失败: {e}")
+
+        task = asyncio.create_task(_append())
+        pending = self._pending.setdefault(conversation_id, set())
+        pending.add(task)
+
+        def _done(finished: asyncio.Task) -> None:
+            pending.discard(finished)
+            if not pending and self._pending.get(conversation_id) is pending:
+                del self._pending[conversation_id]
+
+        task.add_done_callback(_done)
+
+    async def flush(self, conversation_id: str) -> None:
+        """等待本进程内该会话尚未完成的持久化"""
+        pending = self._pending.get(conversation_id)
+        if pending:
+            await asyncio.wait(set(pending))
+
+    async def drain(self, timeout: float) -> None:
+        """等待后台持久化任务完成（用于优雅停机）"""
+        tasks = {task for pending in self._pending.values() for task in pending}
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    async def _summarize(self, summary: str, evicted: list[dict[str, Any]]) -> str:
+        """将被移出窗口的消息并入滚动摘要"""
+        dialogue = "\n".join(
+            f"{'用户' if m.get('role') == 'user' else '助手'}: {m.get('content', '')}"
+            for m in evicted
+        )
+        prompt = SUMMARIZE_PROMPT.format(
+            summary=summary or "无",
+            dialogue=dialogue,
+            max_chars=chars_for_tokens(self.summary_token_budget, f"{summary}\n{dialogue}"),
+        )
+        try:
+            # 后台压缩不应与在线请求争抢速率额度
+            with llm_priority(Priority.LOW):
+                response = await model_registry.ainvoke(
+                    ModelRole.SUMMARIZE, [HumanMessage(content=prompt)]
+                )
+            new_summary = str(response.content).strip()
+        except Exception as e:
+            logger.error(f"[Memory] 生成摘要失败，退化为截断拼接: {e}")
+            new_summary = f"{summary}\n{dialogue}".strip()
+        return truncate_to_tokens(new_summary, self.summary_token_budget)
+
+
+# 会话记忆单例
+conversation_memory = ConversationMemory()
@@ -0,0 +1,221 @@
+"""LLM 调用速率调度
+
+RAG 图、作战室与 SRE 流程的所有节点共用同一个服务商配额。调度器以两个令牌桶分别跟踪
+每分钟请求数（RPM）与估算 token 数（TPM），额度不足时调用按优先级排队，而不是同时
+打到服务商再收一串 429。限额可通过配置给出，也会根据响应中的 x-ratelimit-* 头与
+429 的 retry-after 自动调整。
+
+优先级通过上下文变量传递：SRE 流程可用 llm_priority(priority_for_severity(severity))
+包住调用，使 CRITICAL 事件的调用排在普通聊天之前。
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections.abc import Iterator, Mapping
+from contextlib import contextmanager, suppress
+from contextvars import ContextVar
+from enum import IntEnum
+
+from src.app.core.config import settings
+from src.app.core.logging import logger
+from src.app.core.metrics import metrics
+
+
+class Priority(IntEnum):
+    """调用优先级（数值越小越先调度）"""
+
+    CRITICAL = 0
+    HIGH = 1
+    NORMAL = 2
+    LOW = 3
+
+
+# 事件严重级别到调用优先级的映射（键为 Severity 的取值）
+SEVERITY_PRIORITY: dict[str, Priority] = {
+    "critical": Priority.CRITICAL,
+    "high": Priority.HIGH,
+    "medium": Priority.NORMAL,
+    "low": Priority.LOW,
+    "info": Priority.LOW,
+}
+
+_priority: ContextVar[Priority] = ContextVar("llm_priority", default=Priority.NORMAL)
+
+
+def priority_for_severity(severity: str) -> Priority:
+    """事件严重级别对应的调用优先级"""
+    return SEVERITY_PRIORITY.get(str(getattr(severity, "value", severity)), Priority.NORMAL)
+
+
+def current_priority() -> Priority:
+    """当前上下文的调用优先级"""
+    return _priority.get()
+
+
+@contextmanager
+def llm_priority(priority: Priority) -> Iterator[None]:
+    """在上下文内以指定优先级调用 LLM（对其中创建的任务同样生效）"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """每分钟额度的令牌桶，limit 为 0 表示不限制"""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.level = float(limit)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        if self.limit:
+            self.level = min(self.limit, self.level + (now - self.updated) * self.limit / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """攒够 amount 还需等待的秒数（单次需求超过额度时按额度计）"""
+        if not self.limit:
+            return 0.0
+        need = min(amount, self.limit)
+        return 0.0 if self.level >= need else (need - self.level) * 60 / self.limit
+
+    def take(self, amount: float) -> None:
+        """扣减额度（负数为退还，不超过上限）"""
+        if self.limit:
+            self.level = min(self.limit, self.level - amount)
+
+    def set_limit(self, limit: int) -> None:
+        if limit == self.limit:
+            return
+        self.level = float(limit) if not self.limit else min(self.level, limit)
+        self.limit = limit
+
+
+def _header_int(headers: Mapping[str, str], name: str) -> int | None:
+    value = headers.get(name)
+    try:
+        return int(float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RateScheduler:
+    """RPM / TPM 双令牌桶 + 优先级队列"""
+
+    def __init__(self, rpm: int | None = None, tpm: int | None = None) -> None:
+        self.requests = TokenBucket(settings.llm_rate_limit_rpm if rpm is None else rpm)
+        self.tokens = TokenBucket(settings.llm_rate_limit_tpm if tpm is None else tpm)
+        self._waiters: list[tuple[int, int, asyncio.Future[None], int]] = []
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._wakeup: asyncio.Event | None = None
+        self._dispatcher: asyncio.Task[None] | None = None
+
+    def _ready_in(self, tokens: int) -> float:
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        return max(
+            self._paused_until - now, self.requests.wait_time(1), self.tokens.wait_time(tokens)
+        )
+
+    def _take(self, tokens: int) -> None:
+        self.requests.take(1)
+        self.tokens.take(tokens)
+
+    async def acquire(self, tokens: int) -> None:
+        """按当前上下文的优先级申请一次调用与预估 token 额度"""
+        priority = current_priority()
+        started = time.perf_counter()
+        if not self._waiters and self._ready_in(tokens) <= 0:
+            self._take(tokens)
+        else:
+            future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._seq), future, tokens))
+            self._kick()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self.settle(tokens, 0, refund_request=True)  # 已分配额度但调用方放弃
+                raise
+        metrics.observe(
+            "llm_queue_wait_seconds", time.perf_counter() - started, priority=priority.name.lower()
+        )
+
+    def settle(self, estimated: int, actual: int, refund_request: bool = False) -> None:
+        """调用结束后以实际 token 用量修正预估值"""
+        now = time.monotonic()
+        self.tokens.refill(now)
+        self.tokens.take(actual - estimated)
+        if refund_request:
+            self.requests.take(-1)
+        self._kick()
+
+    def observe_headers(self, headers: Mapping[str, str] | None) -> None:
+        """根据服务商的限流响应头调整额度"""
+        if not headers:
+            return
+        headers = {k.lower(): v for k, v in headers.items()}
+        now = time.monotonic()
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            limit = _header_int(headers, f"x-ratelimit-limit-{kind}")
+            if limit:
+                bucket.set_limit(limit)
+                metrics.set_gauge("llm_rate_limit", limit, kind=kind)
+            remaining = _header_int(headers, f"x-ratelimit-remaining-{kind}")
+            if remaining is not None and bucket.limit:
+                bucket.refill(now)
+                bucket.level = min(bucket.level, remaining)
+
+    def on_rate_limited(self, headers: Mapping[str, str] | None) -> None:
+        """收到 429 后按 retry-after（缺省为配置的退避时间）暂停调度"""
+        self.observe_headers(headers)
+        retry_after = _header_int({k.lower(): v for k, v in (headers or {}).items()}, "retry-after")
+        seconds = retry_after or settings.llm_rate_limit_backoff_seconds
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        metrics.inc("llm_rate_limited_total")
+        logger.warning(f"[RateScheduler] 服务商限流，暂停调度 {seconds:.0f} 秒")
+
+    def _kick(self) -> None:
+        """唤醒（必要时启动）调度任务"""
+        if not self._waiters:
+            return
+        loop = asyncio.get_running_loop()
+        dispatcher = self._dispatcher
+        if (
+            self._wakeup is None
+            or dispatcher is None
+            or dispatcher.done()
+            or dispatcher.get_loop() is not loop
+        ):
+            self._wakeup = asyncio.Event()
+            self._dispatcher = loop.create_task(self._dispatch(self._wakeup))
+        else:
+            self._wakeup.set()
+
+    async def _dispatch(self, wakeup: asyncio.Event) -> None:
+        """按优先级依次放行排队的调用（队首额度不足时等待补充或被更高优先级插队）"""
+        while self._waiters:
+            _, _, future, tokens = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            wait = self._ready_in(tokens)
+            if wait <= 0:
+                heapq.heappop(self._waiters)
+                self._take(tokens)
+                future.set_result(None)
+                continue
+            wakeup.clear()
+            with suppress(TimeoutError):
+                await asyncio.wait_for(wakeup.wait(), wait)
+
+
+# LLM 调用调度器单例
+rate_scheduler = RateScheduler()
@@ -0,0 +1,189 @@
+"""检索需求本地分类器
+
+在 searcher_agent 调用 LLM 判断"是否需要检索"之前做一次本地快速判断：
+先匹配关键词/正则规则，再用基于历史决策日志训练的朴素贝叶斯模型打分。
+只有置信度达到阈值的情况在本地决定，其余仍交给 LLM。LLM 的判断在线更新模型，
+并由后台任务在线程池中批量追加到决策日志，不阻塞事件循环。
+"""
+
+import asyncio
+import json
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from src.app.core.config import settings
+from src.app.core.logging import logger
+from src.app.services.answer_cache import ngram_vector
+
+# 明确不需要检索：问候、致谢、闲聊
+NO_RULES = [
+    re.compile(r"^\s*(你好|您好|嗨|哈喽|早上好|下午好|晚上好|在吗)[\s!！。.~～]*$"),
+    re.compile(r"^\s*(谢谢|多谢|感谢|好的|好|嗯|ok|再见|拜拜)[\s!！。.~～]*$", re.IGNORECASE),
+    re.compile(r"^\s*(hi|hello|hey|thanks|thank you|bye)[\s!.]*$", re.IGNORECASE),
+    re.compile(r"你是谁|你叫什么|你能做什么"),
+]
+
+# 明确需要检索：时效性、明确要求查询
+YES_RULES = [
+    re.compile(r"最新|最近|今天|今年|新闻|实时|股价|价格|汇率|天气"),
+    re.compile(r"查一下|搜索|搜一下|检索|查询"),
+    re.compile(r"\b(latest|news|today|current|price|weather)\b", re.IGNORECASE),
+    re.compile(r"(?<!\d)20\d\d(?!\d)"),
+]
+
+# 反思意见只涉及表达方式：格式、语气、篇幅、结构
+STYLE_RULES = [
+    re.compile(r"格式|排版|语气|措辞|表述|表达|啰嗦|冗长|简洁|精简|篇幅|结构|条理|分点|可读性|口语"),
+    re.compile(r"\b(format|formatting|tone|wording|verbose|concise|structure|readab\w*)\b", re.IGNORECASE),
+]
+
+# 反思意见指出事实缺失或错误：需要补充检索
+GAP_RULES = [
+    re.compile(r"缺少|缺失|遗漏|没有提到|未提及|不完整|不准确|错误|过时|数据|来源|引用|证据|细节|例子|示例"),
+    re.compile(
+        r"\b(missing|lacks?|incomplete|inaccurate|incorrect|outdated|source|citation|evidence|example)\b",
+        re.IGNORECASE,
+    ),
+]
+
+
+@dataclass
+class Decision:
+    """本地判断结果"""
+
+    need_knowledge: bool
+    confidence: float
+    source: str  # "rule" / "model"
+
+
+class NaiveBayesModel:
+    """基于字符 bigram 的多项式朴素贝叶斯二分类"""
+
+    def __init__(self) -> None:
+        self.doc_counts = {True: 0, False: 0}
+        self.gram_counts: dict[bool, Counter[str]] = {True: Counter(), False: Counter()}
+        self.gram_totals = {True: 0, False: 0}  # 各类别的 n-gram 总数
+        self.vocabulary: set[str] = set()
+
+    @property
+    def samples(self) -> int:
+        return self.doc_counts[True] + self.doc_counts[False]
+
+    def fit(self, message: str, label: bool) -> None:
+        grams = ngram_vector(message)
+        self.doc_counts[label] += 1
+        self.gram_counts[label].update(grams)
+        self.gram_totals[label] += sum(grams.values())
+        self.vocabulary.update(grams)
+
+    def predict(self, message: str) -> tuple[bool, float]:
+        """返回 (预测类别, 后验概率)"""
+        grams = ngram_vector(message)
+        vocab_size = len(self.vocabulary) + 1
+        log_probs: dict[bool, float] = {}
+        for label in (True, False):
+            total = self.gram_totals[label]
+            log_prob = math.log((self.doc_counts[label] + 1) / (self.samples + 2))
+            for gram, count in grams.items():
+                likelihood = (self.gram_counts[label][gram] + 1) / (total + vocab_size)
+                log_prob += count * math.log(likelihood)
+            log_probs[label] = log_prob
+
+        label = log_probs[True] >= log_probs[False]
+        margin = log_probs[not label] - log_probs[label]
+        return label, 1.0 / (1.0 + math.exp(margin))
+
+
+class RetrievalClassifier:
+    """规则 + 朴素贝叶斯的检索需求分类器
+
+    决策日志为 JSONL，每行 {"message": ..., "need_knowledge": true/false}，由 LLM 的
+    判断结果持续追加；启动时从日志训练模型，样本数不足 min_samples 时只使用规则。
+    """
+
+    def __init__(
+        self,
+        log_path: str | None = None,
+        threshold: float | None = None,
+        min_samples: int | None = None,
+    ) -> None:
+        log_path = settings.retrieval_classifier_log_path if log_path is None else log_path
+        self.log_path = Path(log_path) if log_path else None
+        self.threshold = threshold or settings.retrieval_classifier_threshold
+        self.min_samples = min_samples or settings.retrieval_classifier_min_samples
+        self.model = NaiveBayesModel()
+        self._unflushed: list[dict[str, Any]] = []  # 待追加到决策日志的记录
+        self._flush_task: asyncio.Task[None] | None = None
+        self._load()
+
+    def _load(self) -> None:
+        if self.log_path is None or not self.log_path.exists():
+            return
+        try:
+            with self.log_path.open(encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.model.fit(record["message"], bool(record["need_knowledge"]))
+            logger.info(f"[Classifier] 从决策日志加载 {self.model.samples} 条样本")
+        except Exception as e:
+            logger.error(f"[Classifier] 加载决策日志失败: {e}")
+
+    def classify(self, message: str) -> Decision | None:
+        """本地判断；无法确信时返回 None，交由 LLM 决定"""
+        if any(rule.search(message) for rule in NO_RULES):
+            return Decision(need_knowledge=False, confidence=1.0, source="rule")
+        if any(rule.search(message) for rule in YES_RULES):
+            return Decision(need_knowledge=True, confidence=1.0, source="rule")
+
+        if self.model.samples < self.min_samples:
+            return None
+        label, confidence = self.model.predict(message)
+        if confidence < self.threshold:
+            return None
+        return Decision(need_knowledge=label, confidence=confidence, source="model")
+
+    def record(self, message: str, need_knowledge: bool) -> None:
+        """记录一次 LLM 判断：在线更新模型，决策日志由后台任务追加（需在事件循环中调用）"""
+        self.model.fit(message, need_knowledge)
+        if self.log_path is None:
+            return
+        self._unflushed.append({"message": message, "need_knowledge": need_knowledge})
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush(self.log_path))
+
+    async def _flush(self, path: Path) -> None:
+        """在后台线程中批量追加积压的决策记录"""
+        while self._unflushed:
+            batch = list(self._unflushed)
+            try:
+                await asyncio.to_thread(self._append, path, batch)
+            except OSError as e:
+                logger.error(f"[Classifier] 写入决策日志失败: {e}")
+            del self._unflushed[: len(batch)]
+
+    @staticmethod
+    def _append(path: Path, records: list[dict[str, Any]]) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a", encoding="utf-8") as f:
+            f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+
+    async def drain(self, timeout: float) -> None:
+        """等待决策日志写完（用于优雅停机）"""
+        if self._flush_task is not None and not self._flush_task.done():
+            await asyncio.wait([self._flush_task], timeout=timeout)
+
+
+def is_style_only(reflection: str) -> bool:
+    """反思意见是否只涉及表达方式（此时重新检索无助于改进回答）"""
+    if any(rule.search(reflection) for rule in GAP_RULES):
+        return False
+    return any(rule.search(reflection) for rule in STYLE_RULES)
+
+
+# 检索需求分类器单例
+retrieval_classifier = RetrievalClassifier()
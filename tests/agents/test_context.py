@@ -0,0 +1,57 @@
+"""知识上下文管理测试"""
+
+from src.app.agents.context import knowledge_for, merge_items, pack_context, update_knowledge
+from src.app.core.tokens import estimate_tokens
+
+
+def test_merge_dedupes_by_url_and_content():
+    """测试按规范化 URL 与内容哈希去重，重复时保留较高得分"""
+    items = merge_items(
+        [], [{"content": "LangGraph 是图编排框架", "source": "https://a.com/x/", "score": 0.4}]
+    )
+    items = merge_items(
+        items,
+        [
+            {"content": "更新后的片段", "source": "https://A.com/x#intro", "score": 0.9},
+            {"content": "langgraph  是图编排框架", "source": "Tavily AI Summary", "score": 1.0},
+            {"content": "另一篇文章", "source": "https://b.com", "score": 0.5},
+        ],
+    )
+
+    assert [item["source"] for item in items] == ["https://a.com/x/", "https://b.com"]
+    assert items[0]["score"] == 1.0
+
+
+def test_pack_prefers_relevant_items_within_budget():
+    """测试装箱按相关度排序且不超过预算"""
+    items = [
+        {"content": "天气晴朗，适合出游。" * 5, "source": "https://weather.com", "score": 0.5},
+        {"content": "LangGraph 的检查点用于持久化状态", "source": "https://docs.com", "score": 0.5},
+    ]
+    context = pack_context(items, "LangGraph 检查点是什么", budget=40)
+
+    assert context.startswith("[来源: https://docs.com]")
+    assert "weather.com" not in context
+    assert estimate_tokens(context) <= 40
+
+
+def test_context_stays_bounded_across_iterations(monkeypatch):
+    """测试多轮检索后送入各节点的上下文仍在预算内"""
+    from src.app.core.config import settings
+
+    monkeypatch.setattr(settings, "knowledge_token_budgets", {"writer": 120, "reviewer": 50})
+    state: dict = {"knowledge_items": [], "knowledge_context": ""}
+    for round_ in range(5):
+        results = [
+            {
+                "content": f"第 {round_} 轮的检索片段 {i}，内容较长" * 3,
+                "source": f"https://s.com/{round_}/{i}",
+                "score": 0.8,
+            }
+            for i in range(5)
+        ]
+        state.update(update_knowledge(state, results, "检索片段"))
+
+    assert estimate_tokens(state["knowledge_context"]) <= 120
+    assert estimate_tokens(knowledge_for(state, "reviewer", "检索片段")) <= 50
+    assert len(state["knowledge_items"]) <= settings.knowledge_max_items
@@ -0,0 +1,57 @@
+"""回答补丁修订测试"""
+
+import pytest
+
+from src.app.agents.revision import RevisionError, apply_edits, parse_edits
+
+ANSWER = """## 简介
+LangGraph 是一个图编排框架。
+
+## 检查点
+检查点用于保存状态。
+
+### 存储
+支持内存与 SQLite。
+
+## 总结
+适合构建多步 Agent。"""
+
+
+def test_parse_edits_accepts_fenced_json_and_wrapper():
+    """测试解析代码块包裹的数组与 {"edits": [...]} 两种格式"""
+    assert parse_edits('```json\n[{"op": "append", "text": "补充"}]\n```') == [
+        {"op": "append", "text": "补充"}
+    ]
+    assert parse_edits('{"edits": [{"op": "delete", "target": "x"}]}')[0]["op"] == "delete"
+    with pytest.raises(RevisionError):
+        parse_edits("好的，我会修改回答")
+
+
+def test_apply_edits():
+    """测试替换片段、替换整个章节（含子章节）、插入与追加"""
+    revised = apply_edits(
+        ANSWER,
+        [
+            {"op": "replace", "target": "图编排框架", "text": "有状态的图编排框架"},
+            {"op": "replace_section", "heading": "## 检查点", "text": "## 检查点\n每步自动保存。"},
+            {"op": "insert_after", "target": "## 简介", "text": "（基于 LangChain）"},
+            {"op": "append", "text": "参考：官方文档"},
+        ],
+    )
+
+    assert "有状态的图编排框架" in revised
+    assert "### 存储" not in revised
+    assert "## 检查点\n每步自动保存。\n\n## 总结" in revised
+    assert revised.startswith("## 简介\n\n（基于 LangChain）\nLangGraph")
+    assert revised.endswith("适合构建多步 Agent。\n\n参考：官方文档")
+
+
+def test_apply_edits_fails_atomically():
+    """测试找不到原文片段时整体失败"""
+    with pytest.raises(RevisionError):
+        apply_edits(
+            ANSWER,
+            [{"op": "append", "text": "补充"}, {"op": "replace", "target": "不存在", "text": "x"}],
+        )
+    with pytest.raises(RevisionError):
+        apply_edits(ANSWER, [])
@@ -0,0 +1,163 @@
+"""Agent 运行管理测试"""
+
+import asyncio
+from contextlib import aclosing
+
+import pytest
+
+from src.app.agents.runner import AgentRunManager, make_run_key
+
+
+class FakeGraph:
+    """按调用计数的假 Graph"""
+
+    def __init__(self, gate: asyncio.Event) -> None:
+        self.calls = 0
+        self.gate = gate
+
+    async def astream(self, state, **_kwargs):
+        self.calls += 1
+        yield "updates", {"searcher": {"knowledge_context": ""}}
+        await self.gate.wait()
+        yield "updates", {"writer": {"current_answer": "答案", "iteration": 1}}
+        yield "values", {**state, "current_answer": "答案", "iteration": 1}
+
+
+def test_make_run_key_normalizes_message():
+    """测试合并键忽略空白与大小写差异"""
+    assert make_run_key("  What is  LangGraph? ") == make_run_key("what is langgraph?")
+    assert make_run_key("hello", "conv-1") != make_run_key("hello", "conv-2")
+
+
+@pytest.mark.asyncio
+async def test_concurrent_duplicates_share_one_execution():
+    """测试并发重复请求共享一次执行，迟到的订阅者可回放全部事件"""
+    gate = asyncio.Event()
+    graph = FakeGraph(gate)
+    manager = AgentRunManager()
+    key = make_run_key("问题")
+
+    first = manager.get_or_start(key, graph, {"messages": []})
+    second = manager.get_or_start(key, graph, {"messages": []})
+    assert first is second
+
+    waiters = [asyncio.create_task(first.wait()) for _ in range(3)]
+    await asyncio.sleep(0)
+    gate.set()
+    results = await asyncio.gather(*waiters)
+
+    assert graph.calls == 1
+    assert all(r["current_answer"] == "答案" for r in results)
+
+    late_events = [event async for event in first.subscribe()]
+    assert [e["node"] for e in late_events] == ["searcher", "writer"]
+    assert manager.in_flight_count == 0
+
+
+@pytest.mark.asyncio
+async def test_run_cancelled_when_last_subscriber_leaves(monkeypatch):
+    """测试最后一个订阅者离开后，未完成的运行被取消并计入放弃指标"""
+    from src.app.core.config import settings
+    from src.app.core.metrics import metrics
+
+    monkeypatch.setattr(settings, "stream_resume_grace_seconds", 0)
+    graph = FakeGraph(asyncio.Event())  # gate 永不打开，模拟长时间的 LLM 调用
+    run = AgentRunManager().get_or_start(make_run_key("被放弃的问题"), graph, {"messages": []})
+    abandoned_before = metrics.get_counter("agent_runs_abandoned_total")
+
+    async with aclosing(run.subscribe()) as events:
+        first = await anext(events)
+        assert first["node"] == "searcher"
+
+    with pytest.raises(asyncio.CancelledError):
+        await run._task
+    assert run.abandoned
+    assert metrics.get_counter("agent_runs_abandoned_total") == abandoned_before + 1
+
+
+@pytest.mark.asyncio
+async def test_reconnect_within_grace_resumes_after_last_event(monkeypatch):
+    """测试宽限期内凭 Last-Event-ID 重连：运行不被取消，只回放错过的事件"""
+    from src.app.core.config import settings
+
+    monkeypatch.setattr(settings, "stream_resume_grace_seconds", 5)
+    gate = asyncio.Event()
+    manager = AgentRunManager()
+    run = manager.get_or_start(make_run_key("重连的问题"), FakeGraph(gate), {"messages": []})
+
+    async with aclosing(run.subscribe()) as events:
+        first = await anext(events)
+    last_event_id = f"{run.run_id}:{first['seq']}"
+
+    resumed = manager.resolve_event_id(last_event_id)
+    assert resumed == (run, 1)
+    gate.set()
+    replay = [event async for event in run.subscribe(after=resumed[1])]
+
+    assert not run.abandoned
+    assert [e["node"] for e in replay] == ["writer"]
+    assert manager.resolve_event_id(last_event_id) is not None  # 结束后仍在保留期内
+    assert manager.resolve_event_id("unknown:1") is None
+
+
+@pytest.mark.asyncio
+async def test_bounded_buffer_spills_to_disk_or_reports_gap(tmp_path):
+    """测试超出内存缓冲的事件：配置溢写目录时从磁盘回放，否则产出 gap 事件"""
+    from src.app.agents.runner import AgentRun
+
+    gate = asyncio.Event()
+    gate.set()
+    spilled = AgentRun("k1", FakeGraph(gate), {}, max_buffer=1, spill_dir=str(tmp_path)).start()
+    dropped = AgentRun("k2", FakeGraph(gate), {}, max_buffer=1, spill_dir="").start()
+    await spilled.wait()
+    await dropped.wait()
+
+    assert [e["seq"] for e in spilled.events] == [2]
+    assert [e["node"] for e in [e async for e in spilled.subscribe()]] == ["searcher", "writer"]
+
+    replay = [e async for e in dropped.subscribe()]
+    assert replay[0] == {"type": "gap", "seq": 1, "missed": 1}
+    assert replay[1]["node"] == "writer"
+
+    spilled.discard_spill()
+    assert not spilled.spill_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_drain_waits_for_runs_without_coalescing(monkeypatch):
+    """测试关闭请求合并时，优雅停机仍会等待所有进行中的运行"""
+    from src.app.core.config import settings
+
+    monkeypatch.setattr(settings, "chat_coalescing_enabled", False)
+    gate = asyncio.Event()
+    manager = AgentRunManager()
+    run = manager.get_or_start(make_run_key("停机中的问题"), FakeGraph(gate), {"messages": []})
+    assert manager.in_flight_count == 0
+    assert manager.active_count == 1
+
+    assert await manager.drain(timeout=0.01) is False
+    gate.set()
+    assert await manager.drain(timeout=1) is True
+    assert run.result is not None
+    assert manager.active_count == 0
+
+
+@pytest.mark.asyncio
+async def test_resume_reads_spilled_events_from_offset(tmp_path):
+    """测试从中途序号重连时，只从溢写文件的对应位置读取错过的事件"""
+    from src.app.agents.runner import AgentRun
+
+    class ManyStepsGraph:
+        async def astream(self, state, **_kwargs):
+            for i in range(5):
+                yield "updates", {f"step{i}": {}}
+            yield "values", state
+
+    run = AgentRun("k3", ManyStepsGraph(), {}, max_buffer=1, spill_dir=str(tmp_path)).start()
+    await run.wait()
+
+    assert run.spill_path.read_text(encoding="utf-8").count("\n") == 4
+    assert [e["seq"] for e in [e async for e in run.subscribe(after=2)]] == [3, 4, 5]
+    assert [e["node"] for e in [e async for e in run.subscribe()]][:2] == ["step0", "step1"]
+    run.discard_spill()
+    assert not run.spill_path.exists()
@@ -0,0 +1,41 @@
+"""评估结论解析测试"""
+
+from src.app.agents.verdict import Verdict, parse_verdict, strip_verdict
+
+
+def test_first_keyword_wins_and_negation_needs_improvement():
+    """测试两个关键词同时出现时以先出现的为准，否定形式视为需要改进"""
+    assert parse_verdict("SATISFIED") is Verdict.SATISFIED
+    assert (
+        parse_verdict("NEEDS_IMPROVEMENT\n补充示例后即可达到 SATISFIED 标准")
+        is Verdict.NEEDS_IMPROVEMENT
+    )
+    assert parse_verdict("SATISFIED，无需 NEEDS_IMPROVEMENT") is Verdict.SATISFIED
+    assert parse_verdict("NOT SATISFIED: 缺少数据") is Verdict.NEEDS_IMPROVEMENT
+    assert parse_verdict("UNSATISFIED.") is Verdict.NEEDS_IMPROVEMENT
+    assert parse_verdict("回答缺少细节") is Verdict.NEEDS_IMPROVEMENT
+
+
+def test_satisfied_inside_prose_is_not_a_verdict():
+    """测试正文中出现的 satisfied 不被当作结论，只认行首的大写关键词"""
+    assert parse_verdict("The answer is not fully satisfied yet.") is Verdict.NEEDS_IMPROVEMENT
+    assert parse_verdict("The user would be satisfied, but 缺少示例") is Verdict.NEEDS_IMPROVEMENT
+    assert parse_verdict("I am SATISFIED with parts of it\nNEEDS_IMPROVEMENT") is (
+        Verdict.NEEDS_IMPROVEMENT
+    )
+    assert parse_verdict("评估如下：\nSATISFIED") is Verdict.SATISFIED
+    assert parse_verdict("**SATISFIED**") is Verdict.SATISFIED
+    assert parse_verdict("the user would be satisfied\n", final=False) is None
+
+
+def test_streaming_waits_until_keyword_boundary():
+    """测试流式解析：关键词不完整或位于缓冲区末尾时尚未确定"""
+    assert parse_verdict("SATIS", final=False) is None
+    assert parse_verdict("SATISFIED", final=False) is None
+    assert parse_verdict("SATISFIED\n", final=False) is Verdict.SATISFIED
+    assert parse_verdict("NOT ", final=False) is None
+
+
+def test_strip_verdict_keeps_reflection():
+    """测试去掉结论关键词后保留改进意见"""
+    assert strip_verdict("NEEDS_IMPROVEMENT\n请补充检查点的用法") == "请补充检查点的用法"
@@ -7,9 +7,20 @@ import pytest
 
 @pytest.fixture
 def mock_llm():
-    """Mock DeepSeek LLM"""
-    with patch("src.app.agents.specialized_nodes.llm") as mock:
+    """Mock DeepSeek LLM（所有角色返回同一个 mock 模型）"""
+    from unittest.mock import MagicMock
+
+    from src.app.services.llm import model_registry
+
+    mock = MagicMock()
+
+    async def astream(messages, **kwargs):
+        # 流式调用默认以 ainvoke 的返回值作为唯一的块，用例只需设置 ainvoke
+        yield await mock.ainvoke(messages, **kwargs)
+
+    with patch.object(model_registry, "get", return_value=mock):
         mock.ainvoke = AsyncMock(return_value=AsyncMock(content="NO"))
+        mock.astream = astream
         yield mock
 
 
@@ -21,3 +32,12 @@ def mock_knowledge_service():
             return_value=[{"content": "测试内容", "source": "https://example.com", "score": 0.9}]
         )
         yield mock
+
+
+@pytest.fixture(autouse=True)
+def clear_answer_cache():
+    """每个用例前清空回答缓存，避免用例间互相命中"""
+    from src.app.services.answer_cache import answer_cache
+
+    answer_cache.clear()
+    yield
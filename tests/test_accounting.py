@@ -0,0 +1,86 @@
+"""LLM 用量核算测试"""
+
+from unittest.mock import AsyncMock
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from src.app.services.accounting import accounting_scope, record_llm_call
+
+
+def test_summary_with_cost_and_cached_tokens(monkeypatch):
+    """测试按单价计算费用（缓存命中的输入按缓存单价），并按节点汇总"""
+    from src.app.core.config import settings
+
+    monkeypatch.setattr(
+        settings,
+        "llm_prices",
+        {"deepseek-chat": {"input": 1.0, "cached_input": 0.1, "output": 2.0}},
+    )
+    response = AIMessage(
+        content="回答",
+        usage_metadata={
+            "input_tokens": 1_000_000,
+            "output_tokens": 500_000,
+            "total_tokens": 1_500_000,
+            "input_token_details": {"cache_read": 400_000},
+        },
+    )
+
+    with accounting_scope() as accounting:
+        record_llm_call("write", "deepseek-chat", response, 2.0)
+        record_llm_call("check", "other-model", None, 0.5, estimated=(10, 1))
+    summary = accounting.summary()
+
+    assert summary["total_tokens"] == 1_500_011
+    assert summary["cached_tokens"] == 400_000
+    assert summary["cost"] == pytest.approx(0.6 + 0.04 + 1.0)
+    assert summary["llm_seconds"] == 2.5
+    assert summary["nodes"]["other"]["calls"] == 2
+
+
+@pytest.mark.asyncio
+async def test_run_accounts_llm_calls_per_graph_node(mock_llm):
+    """测试运行中各节点的 LLM 调用（包括并行调用）记入运行自身的核算"""
+    import asyncio
+
+    from langgraph.graph import END, StateGraph
+
+    from src.app.agents.runner import AgentRun
+    from src.app.agents.state import AgentState
+    from src.app.services.llm import ModelRole, model_registry
+
+    mock_llm.ainvoke = AsyncMock(
+        return_value=AIMessage(
+            content="YES",
+            usage_metadata={"input_tokens": 20, "output_tokens": 5, "total_tokens": 25},
+        )
+    )
+
+    async def checker(_state):
+        await model_registry.ainvoke(ModelRole.CHECK, [HumanMessage(content="?")])
+        return {}
+
+    async def fan_out(_state):
+        await asyncio.gather(
+            *(
+                model_registry.ainvoke(ModelRole.WRITE, [HumanMessage(content="?")])
+                for _ in range(2)
+            )
+        )
+        return {}
+
+    graph = StateGraph(AgentState)
+    graph.add_node("checker", checker)
+    graph.add_node("fan_out", fan_out)
+    graph.set_entry_point("checker")
+    graph.add_edge("checker", "fan_out")
+    graph.add_edge("fan_out", END)
+
+    run = AgentRun("key", graph.compile(), {"messages": []}).start()
+    await run.wait()
+    summary = run.usage.summary()
+
+    assert summary["total_tokens"] == 75
+    assert summary["nodes"]["checker"]["calls"] == 1
+    assert summary["nodes"]["fan_out"]["tokens"] == 50
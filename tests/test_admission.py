@@ -0,0 +1,42 @@
+"""准入控制测试"""
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from src.app.api.admission import AdmissionController
+
+
+@pytest.mark.asyncio
+async def test_queue_full_is_rejected_fast():
+    """测试队列满时立即返回 429 与 Retry-After，释放后名额移交给队首"""
+    controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=5)
+    await controller.acquire()
+
+    queued = asyncio.create_task(controller.acquire())
+    await asyncio.sleep(0)
+    assert controller.queued == 1
+
+    with pytest.raises(HTTPException) as exc_info:
+        await controller.acquire()
+    assert exc_info.value.status_code == 429
+    assert int(exc_info.value.headers["Retry-After"]) >= 1
+
+    controller.release()
+    await queued
+    assert controller.in_flight == 1
+    assert controller.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_deadline_rejects():
+    """测试排队超过期限返回 429，且不泄漏名额"""
+    controller = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout=0.01)
+    async with controller.slot():
+        with pytest.raises(HTTPException) as exc_info:
+            await controller.acquire()
+        assert exc_info.value.status_code == 429
+
+    assert controller.in_flight == 0
+    assert controller.queued == 0
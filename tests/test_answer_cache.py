@@ -0,0 +1,80 @@
+"""语义回答缓存测试"""
+
+import time
+
+from src.app.services.answer_cache import AnswerCache, ngram_vector
+
+ANSWER = {"reply": "LangGraph 是一个编排框架", "used_knowledge": True, "iterations": 2}
+
+
+def test_exact_and_similar_questions_hit():
+    """测试相同与近似问题均可命中，并保留元数据"""
+    cache = AnswerCache(similarity_threshold=0.8)
+    cache.store("什么是 LangGraph？", ANSWER)
+
+    assert cache.lookup("什么是 LangGraph？") == ANSWER
+    assert cache.lookup("什么是langgraph") == ANSWER
+    assert cache.lookup("今天天气怎么样") is None
+
+
+def test_ttl_expiry():
+    """测试过期条目不再命中"""
+    cache = AnswerCache(ttl_seconds=0.01)
+    cache.store("hello", ANSWER)
+    time.sleep(0.02)
+
+    assert cache.lookup("hello") is None
+    assert len(cache) == 0
+
+
+def test_lru_eviction():
+    """测试超出容量时淘汰最久未使用的条目"""
+    cache = AnswerCache(max_entries=2)
+    cache.store("question one", ANSWER)
+    cache.store("question two", ANSWER)
+    cache.lookup("question one")
+    cache.store("another topic entirely", ANSWER)
+
+    assert len(cache) == 2
+    assert cache.lookup("question one") is not None
+    assert cache.lookup("question two") is None
+
+
+def test_namespaces_are_isolated():
+    """测试不同命名空间（运行模式）的回答互不命中"""
+    cache = AnswerCache()
+    cache.store("什么是 LangGraph？", ANSWER, namespace="fast")
+
+    assert cache.lookup("什么是 LangGraph？", namespace="thorough") is None
+    assert cache.lookup("什么是 LangGraph？", namespace="fast") == ANSWER
+
+
+def test_near_miss_questions_do_not_hit():
+    """测试只差一个数字、标识符或否定词的问题即使字符相似度很高也不命中"""
+    pairs = [
+        ("how do I enable X in the config", "how do I disable X in the config"),
+        ("what is new in Python 3.11", "what is new in Python 3.10"),
+        ("why is payment-service returning 500", "why is checkout-service returning 500"),
+        ("list the instances in us-east-1 now", "list the instances in eu-west-1 now"),
+        ("如何开启访问日志", "如何不开启访问日志"),
+    ]
+    for stored, asked in pairs:
+        cache = AnswerCache(similarity_threshold=0.5)
+        cache.store(stored, ANSWER)
+        assert cache.lookup(asked) is None, asked
+        assert cache.lookup(stored) == ANSWER
+
+
+def test_candidates_are_capped():
+    """测试共享常见 n-gram 的条目很多时，召回数量有上限且仍能找到相似问题"""
+    cache = AnswerCache(max_entries=5000, similarity_threshold=0.8)
+    for i in range(1000):
+        cache.store(f"什么是问题 x{i}", ANSWER)
+    cache.store("什么是 LangGraph 编排框架", ANSWER)
+
+    key = "\x00什么是langgraph编排框架"
+    vector = ngram_vector("什么是langgraph编排框架")
+    with cache._lock:
+        candidates = cache._candidates(key, vector, "", time.monotonic())
+    assert len(candidates) <= 64
+    assert cache.lookup("什么是langgraph编排框架") == ANSWER
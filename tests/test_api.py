@@ -1,6 +1,7 @@
 """API 集成测试"""
 
-from unittest.mock import AsyncMock, patch
+import json
+from unittest.mock import patch
 
 import pytest
 from fastapi.testclient import TestClient
@@ -29,6 +30,36 @@ class TestHealthEndpoints:
         assert response.status_code == 200
         assert response.json()["status"] == "healthy"
 
+    def test_ready_follows_lifespan(self):
+        """测试就绪检查：生命周期启动后就绪，未启动时返回 503"""
+        from src.app.main import app
+
+        assert TestClient(app).get("/ready").status_code == 503
+        with TestClient(app) as client:
+            response = client.get("/ready")
+            assert response.status_code == 200
+            assert response.json()["status"] == "healthy"
+
+    def test_sigterm_marks_not_ready_before_draining(self):
+        """测试收到 SIGTERM 时立即转为未就绪并记下排空期限，再交给原处理器"""
+        import signal
+
+        from src.app.main import app, install_drain_signal
+
+        calls = []
+        original = signal.signal(signal.SIGTERM, lambda *args: calls.append(args))
+        try:
+            app.state.ready = True
+            install_drain_signal(app)
+            signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+        finally:
+            signal.signal(signal.SIGTERM, original)
+
+        assert app.state.ready is False
+        assert app.state.drain_deadline is not None
+        assert calls == [(signal.SIGTERM, None)]
+        assert TestClient(app).get("/ready").status_code == 503
+
 
 class TestChatEndpoint:
     """聊天端点测试"""
@@ -48,15 +79,20 @@ class TestChatEndpoint:
         """测试聊天成功响应"""
         from src.app.main import app
 
-        with patch("src.app.api.routes.chat.agent") as mock_agent:
-            mock_agent.ainvoke = AsyncMock(
-                return_value={
+        async def fake_astream(_state, **_kwargs):
+            yield (
+                "values",
+                {
                     "messages": [type("Msg", (), {"content": "测试回复"})()],
                     "knowledge_context": "some context",
                     "iteration": 1,
-                }
+                },
             )
 
+        with patch("src.app.api.routes.chat.get_agent") as get_agent:
+            mock_agent = get_agent.return_value
+            mock_agent.astream = fake_astream
+
             client = TestClient(app)
             response = client.post("/chat", json={"message": "你好"})
 
@@ -65,3 +101,285 @@ class TestChatEndpoint:
             assert "reply" in data
             assert "used_knowledge" in data
             assert "iterations" in data
+
+    def test_chat_returns_cached_answer(self):
+        """测试开启回答缓存后相同问题第二次命中缓存，use_cache=False 时绕过缓存"""
+        from src.app.core.config import settings
+        from src.app.main import app
+
+        calls = []
+
+        async def fake_astream(_state, **_kwargs):
+            calls.append(1)
+            yield (
+                "values",
+                {
+                    "messages": [type("Msg", (), {"content": "缓存的回复"})()],
+                    "knowledge_context": "",
+                    "iteration": 1,
+                },
+            )
+
+        with (
+            patch("src.app.api.routes.chat.get_agent") as get_agent,
+            patch.object(settings, "answer_cache_enabled", True),
+        ):
+            mock_agent = get_agent.return_value
+            mock_agent.astream = fake_astream
+
+            client = TestClient(app)
+            first = client.post("/chat", json={"message": "什么是缓存"})
+            second = client.post("/chat", json={"message": "什么是缓存？"})
+            bypass = client.post("/chat", json={"message": "什么是缓存", "use_cache": False})
+
+        assert first.json()["cached"] is False
+        assert second.json() == {**first.json(), "cached": True, "usage": None}
+        assert bypass.json()["cached"] is False
+        assert len(calls) == 2
+
+
+class TestChatStreamEndpoint:
+    """流式聊天端点测试"""
+
+    def test_stream_interleaves_tokens_and_steps(self):
+        """测试 token 增量与步骤事件交错输出"""
+        from langchain_core.messages import AIMessageChunk
+
+        from src.app.main import app
+
+        async def fake_astream(_state, stream_mode, **_kwargs):
+            assert "messages" in stream_mode
+            yield "updates", {"searcher": {"knowledge_context": ""}}
+            yield "messages", (AIMessageChunk(content="NO"), {"langgraph_node": "searcher"})
+            yield "messages", (AIMessageChunk(content="你好"), {"langgraph_node": "writer"})
+            yield "messages", (AIMessageChunk(content="！"), {"langgraph_node": "writer"})
+            yield "updates", {"writer": {"current_answer": "你好！", "iteration": 1}}
+
+        with patch("src.app.api.routes.chat.get_agent") as get_agent:
+            mock_agent = get_agent.return_value
+            mock_agent.astream = fake_astream
+
+            client = TestClient(app)
+            response = client.post("/chat/stream", json={"message": "你好"})
+
+        events = [
+            json.loads(line[len("data: ") :])
+            for line in response.text.splitlines()
+            if line.startswith("data: ")
+        ]
+        assert [e["step"] for e in events] == ["searcher", "token", "token", "writer", "done"]
+        assert "".join(e["content"] for e in events if e["step"] == "token") == "你好！"
+        assert "ttft_ms" in events[-1]
+        assert events[-1]["usage"]["llm_calls"] == 0
+        ids = [
+            line[len("id: ") :] for line in response.text.splitlines() if line.startswith("id: ")
+        ]
+        assert [event_id.rsplit(":", 1)[1] for event_id in ids] == ["1", "2", "3", "4"]
+
+        from src.app.api.admission import admission_controller
+
+        assert admission_controller.in_flight == 0
+
+    def test_replayed_tokens_do_not_record_ttft(self):
+        """测试重连回放的首 token 不计入 TTFT 指标，只有启动运行的订阅者记录"""
+        from langchain_core.messages import AIMessageChunk
+
+        from src.app.core.metrics import metrics
+        from src.app.main import app
+
+        async def fake_astream(_state, **_kwargs):
+            yield "messages", (AIMessageChunk(content="你好"), {"langgraph_node": "writer"})
+            yield "updates", {"writer": {"current_answer": "你好", "iteration": 1}}
+
+        def ttft_count() -> int:
+            histogram = metrics.snapshot()["histograms"].get("chat_stream_ttft_seconds")
+            return histogram["count"] if histogram else 0
+
+        with patch("src.app.api.routes.chat.get_agent") as get_agent:
+            get_agent.return_value.astream = fake_astream
+            client = TestClient(app)
+            before = ttft_count()
+            first = client.post("/chat/stream", json={"message": "重放测试"})
+            run_id = next(
+                line[len("id: ") :].rsplit(":", 1)[0]
+                for line in first.text.splitlines()
+                if line.startswith("id: ")
+            )
+            resumed = client.post(
+                "/chat/stream",
+                json={"message": "重放测试"},
+                headers={"Last-Event-ID": f"{run_id}:0"},
+            )
+
+        assert '"step": "token"' in resumed.text
+        assert ttft_count() == before + 1
+
+    def test_resume_with_different_request_starts_new_run(self):
+        """测试 Last-Event-ID 指向的运行与请求内容不一致时，按新请求处理而不是挂到原运行"""
+        from src.app.main import app
+
+        async def fake_astream(state, **_kwargs):
+            question = state["messages"][-1].content
+            yield "updates", {"writer": {"current_answer": f"答：{question}", "iteration": 1}}
+
+        with patch("src.app.api.routes.chat.get_agent") as get_agent:
+            get_agent.return_value.astream = fake_astream
+            client = TestClient(app)
+            first = client.post("/chat/stream", json={"message": "问题甲"})
+            event_id = next(
+                line[len("id: ") :] for line in first.text.splitlines() if line.startswith("id: ")
+            )
+            other = client.post(
+                "/chat/stream", json={"message": "问题乙"}, headers={"Last-Event-ID": event_id}
+            )
+
+        assert "答：问题乙" in other.text
+        assert "答：问题甲" not in other.text
+
+
+class TestChatBatchEndpoint:
+    """批量聊天端点测试"""
+
+    @staticmethod
+    async def fake_astream(state, **_kwargs):
+        question = state["messages"][-1].content
+        yield (
+            "values",
+            {
+                "messages": [type("Msg", (), {"content": f"答：{question}"})()],
+                "knowledge_context": "",
+                "iteration": 1,
+            },
+        )
+
+    def test_batch_returns_results_in_order(self):
+        """测试批量结果与请求顺序一致"""
+        from src.app.main import app
+
+        questions = [{"message": f"问题 {i}", "use_cache": False} for i in range(5)]
+        with patch("src.app.api.routes.chat.get_agent") as get_agent:
+            mock_agent = get_agent.return_value
+            mock_agent.astream = self.fake_astream
+
+            client = TestClient(app)
+            response = client.post("/chat/batch", json={"questions": questions, "concurrency": 2})
+
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [r["index"] for r in results] == list(range(5))
+        assert results[3]["response"]["reply"] == "答：问题 3"
+
+    def test_batch_items_take_admission_slots(self):
+        """测试批量问题逐个占用准入名额，超出上限的问题排队等待"""
+        import asyncio
+
+        from src.app.api.admission import AdmissionController
+        from src.app.main import app
+
+        controller = AdmissionController(max_in_flight=1, max_queue=10, queue_timeout=5)
+        peak = 0
+
+        async def fake_astream(state, **kwargs):
+            nonlocal peak
+            peak = max(peak, controller.in_flight)
+            await asyncio.sleep(0.01)
+            async for item in self.fake_astream(state, **kwargs):
+                yield item
+
+        questions = [{"message": f"问题 {i}", "use_cache": False} for i in range(3)]
+        with (
+            patch("src.app.api.routes.chat.get_agent") as get_agent,
+            patch("src.app.api.routes.chat.admission_controller", controller),
+        ):
+            get_agent.return_value.astream = fake_astream
+            client = TestClient(app)
+            response = client.post("/chat/batch", json={"questions": questions, "concurrency": 3})
+
+        results = response.json()["results"]
+        assert all(r["error"] is None for r in results)
+        assert peak == 1
+        assert controller.in_flight == 0
+
+    def test_batch_streams_ndjson(self):
+        """测试 NDJSON 流式返回"""
+        from src.app.main import app
+
+        questions = [{"message": "甲"}, {"message": "乙"}]
+        with patch("src.app.api.routes.chat.get_agent") as get_agent:
+            mock_agent = get_agent.return_value
+            mock_agent.astream = self.fake_astream
+
+            client = TestClient(app)
+            response = client.post("/chat/batch", json={"questions": questions, "stream": True})
+
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert sorted(line["index"] for line in lines) == [0, 1]
+
+
+class TestChatJobsEndpoint:
+    """异步任务端点测试"""
+
+    def test_submit_returns_job_id_immediately(self):
+        """测试提交任务立即返回 202 与任务 ID，回调地址不写入请求载荷"""
+        from unittest.mock import AsyncMock
+
+        from src.app.core.config import settings
+        from src.app.main import app
+
+        job = {"job_id": "abc", "status": "queued", "attempts": 0}
+        with (
+            patch.object(settings, "jobs_enabled", True),
+            patch(
+                "src.app.api.routes.jobs.job_queue.submit", new=AsyncMock(return_value=job)
+            ) as submit,
+        ):
+            client = TestClient(app)
+            response = client.post(
+                "/chat/jobs", json={"message": "你好", "callback_url": "http://hook.test/cb"}
+            )
+
+        assert response.status_code == 202
+        assert response.json()["job_id"] == "abc"
+        assert "callback_url" not in submit.await_args.args[0]
+        assert submit.await_args.kwargs["callback_url"] == "http://hook.test/cb"
+
+    def test_disallowed_callback_url_returns_422(self):
+        """测试回调地址未通过校验时返回 422，且不会创建任务"""
+        from src.app.core.config import settings
+        from src.app.main import app
+
+        with patch.object(settings, "jobs_enabled", True):
+            response = TestClient(app).post(
+                "/chat/jobs",
+                json={"message": "你好", "callback_url": "http://169.254.169.254/latest"},
+            )
+
+        assert response.status_code == 422
+
+    def test_unknown_job_returns_404(self):
+        """测试查询不存在的任务"""
+        from unittest.mock import AsyncMock
+
+        from src.app.core.config import settings
+        from src.app.main import app
+
+        with (
+            patch.object(settings, "jobs_enabled", True),
+            patch("src.app.api.routes.jobs.job_queue.get", new=AsyncMock(return_value=None)),
+        ):
+            response = TestClient(app).get("/chat/jobs/missing")
+
+        assert response.status_code == 404
+
+    def test_get_job_when_disabled_returns_503(self):
+        """测试任务接口未启用时查询直接返回 503，不访问数据库"""
+        from unittest.mock import AsyncMock
+
+        from src.app.main import app
+
+        with patch("src.app.api.routes.jobs.job_queue.get", new=AsyncMock()) as get:
+            response = TestClient(app).get("/chat/jobs/abc")
+
+        assert response.status_code == 503
+        get.assert_not_awaited()
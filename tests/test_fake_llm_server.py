@@ -0,0 +1,72 @@
+"""模拟 LLM 服务测试"""
+
+import httpx
+import openai
+import pytest
+from langchain_core.messages import HumanMessage
+from langchain_openai import ChatOpenAI
+from pydantic import SecretStr
+
+from scripts.fake_llm_server import FakeLLMConfig, create_app, parse_latency
+
+
+def make_llm(app, **kwargs) -> ChatOpenAI:
+    transport = httpx.ASGITransport(app=app)
+    return ChatOpenAI(
+        model="fake-llm",
+        api_key=SecretStr("x"),
+        base_url="http://fake/v1",
+        http_async_client=httpx.AsyncClient(transport=transport, base_url="http://fake"),
+        stream_usage=True,
+        max_retries=0,
+        **kwargs,
+    )
+
+
+def test_parse_latency():
+    """测试延迟分布解析"""
+    assert parse_latency("0.5") == ("fixed", (0.5,))
+    assert parse_latency("lognormal:0.8,0.5") == ("lognormal", (0.8, 0.5))
+    with pytest.raises(ValueError):
+        parse_latency("uniform:1")
+
+
+@pytest.mark.asyncio
+async def test_rules_and_usage():
+    """测试按规则回复（检查提示返回 YES）与用量字段"""
+    app = create_app(FakeLLMConfig(answer_tokens=20))
+    llm = make_llm(app)
+
+    check = await llm.ainvoke([HumanMessage(content="问题: 你好\n\n只回答 YES 或 NO:")])
+    assert check.content == "YES"
+    answer = await llm.ainvoke([HumanMessage(content="介绍一下 LangGraph")])
+    assert answer.usage_metadata["output_tokens"] == 20
+    assert app.state.fake.stats["rule_check"] == 1
+
+
+@pytest.mark.asyncio
+async def test_streaming_with_usage():
+    """测试流式输出逐块返回，并在末尾带上用量"""
+    app = create_app(FakeLLMConfig(answer_tokens=10, tokens_per_second=1000))
+    llm = make_llm(app)
+
+    chunks = [chunk async for chunk in llm.astream([HumanMessage(content="你好")])]
+    text = "".join(chunk.content for chunk in chunks)
+    usage = [chunk.usage_metadata for chunk in chunks if chunk.usage_metadata]
+    assert len([c for c in chunks if c.content]) == 10
+    assert usage and usage[-1]["output_tokens"] == 10
+    assert text.startswith("这是模拟服务")
+
+
+@pytest.mark.asyncio
+async def test_injected_rate_limit():
+    """测试注入的 429 带 retry-after 与限流头，客户端收到 RateLimitError"""
+    app = create_app(FakeLLMConfig(rpm=1, retry_after=3))
+    llm = make_llm(app)
+
+    await llm.ainvoke([HumanMessage(content="你好")])
+    with pytest.raises(openai.RateLimitError) as exc_info:
+        await llm.ainvoke([HumanMessage(content="你好")])
+    headers = exc_info.value.response.headers
+    assert headers["retry-after"] == "3"
+    assert headers["x-ratelimit-remaining-requests"] == "0"
@@ -25,3 +25,66 @@ async def test_full_graph_simple_flow(mock_llm):
     assert len(result["messages"]) > 1
     assert "助手" in result["messages"][-1].content
     assert result["iteration"] == 1
+
+
+@pytest.mark.asyncio
+async def test_fast_mode_single_pass(mock_llm):
+    """测试 fast 模式：只做一次判断与生成，不调用 Reviewer"""
+    from src.app.agents.graph import get_agent
+
+    mock_llm.ainvoke.side_effect = [
+        AIMessage(content="NO"),  # check
+        AIMessage(content="快速回答"),  # generate
+    ]
+
+    result = await get_agent("fast").ainvoke({"messages": [HumanMessage(content="你好")]})
+
+    assert result["messages"][-1].content == "快速回答"
+    assert mock_llm.ainvoke.await_count == 2
+    assert get_agent("fast") is get_agent("fast")
+
+
+@pytest.mark.asyncio
+async def test_standard_mode_rewrites_at_most_once(mock_llm):
+    """测试 standard 模式：Reviewer 一直不满意时 writer 也至多运行两次（初稿 + 一次重写）"""
+    from src.app.agents.graph import get_agent
+
+    mock_llm.ainvoke.side_effect = [
+        AIMessage(content="NO"),
+        AIMessage(content="初稿"),
+        AIMessage(content="NEEDS_IMPROVEMENT\n不够详细"),
+        AIMessage(content="NO"),
+        AIMessage(content="修改稿"),
+        AIMessage(content="NEEDS_IMPROVEMENT\n仍不够详细"),
+        AIMessage(content="NO"),
+        AIMessage(content="第三稿"),
+    ]
+
+    result = await get_agent("standard").ainvoke({"messages": [HumanMessage(content="你好")]})
+
+    assert result["iteration"] == 2
+    assert result["messages"][-1].content == "修改稿"
+    assert mock_llm.ainvoke.await_count == 5  # 第二次 Reviewer 直接交付，不再调用 LLM
+
+
+@pytest.mark.asyncio
+async def test_parallel_mode_selects_best_candidate(mock_llm):
+    """测试 parallel 模式：并行生成候选，一次比较后选出最佳"""
+    from src.app.agents.graph import get_agent
+
+    mock_llm.ainvoke.side_effect = [
+        AIMessage(content="NO"),  # searcher
+        AIMessage(content="候选一"),
+        AIMessage(content="候选二"),
+        AIMessage(content="候选三"),
+        AIMessage(content="第二个更完整。\nBEST: 2"),  # judge
+    ]
+
+    result = await get_agent("parallel").ainvoke({"messages": [HumanMessage(content="你好")]})
+
+    assert result["messages"][-1].content == "候选二"
+    assert result["iteration"] == 1
+    temperatures = [
+        call.kwargs.get("temperature") for call in mock_llm.ainvoke.await_args_list[1:4]
+    ]
+    assert temperatures == [0.3, 0.7, 1.0]
@@ -0,0 +1,124 @@
+"""对冲请求测试"""
+
+import asyncio
+
+import pytest
+
+from src.app.services.hedging import HedgePolicy, race
+
+
+def test_policy_delay_and_budget():
+    """测试样本不足时不对冲、对冲时机取分位数，以及每分钟预算"""
+    policy = HedgePolicy(percentile=90, min_samples=5, min_delay_seconds=0.05, max_per_minute=2)
+    for seconds in (0.1, 0.2, 0.3, 0.4):
+        policy.record("write", seconds)
+    assert policy.delay("write") is None
+
+    policy.record("write", 1.0)
+    assert policy.delay("write") == 1.0
+    assert [policy.acquire() for _ in range(3)] == [True, True, False]
+
+
+@pytest.mark.asyncio
+async def test_race_hedge_wins_and_cancels_primary():
+    """测试主请求超过对冲时机未返回时，对冲请求先返回即胜出并取消主请求"""
+    cancelled = asyncio.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return "slow"
+
+    async def fast():
+        return "fast"
+
+    result, outcome = await race(slow, fast, delay=0.01, acquire=lambda: True)
+    assert (result, outcome) == ("fast", "hedge_won")
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+
+@pytest.mark.asyncio
+async def test_race_without_budget_or_after_hedge_failure_waits_for_primary():
+    """测试预算耗尽时不发对冲请求；对冲请求失败时仍等待主请求"""
+
+    async def primary():
+        await asyncio.sleep(0.05)
+        return "primary"
+
+    async def failing():
+        raise RuntimeError("备用地址不可用")
+
+    async def unexpected():
+        raise AssertionError("不应发起对冲请求")
+
+    assert await race(primary, unexpected, delay=0.01, acquire=lambda: False) == (
+        "primary",
+        "budget_exhausted",
+    )
+    assert await race(primary, failing, delay=0.01, acquire=lambda: True) == (
+        "primary",
+        "primary_won",
+    )
+
+
+@pytest.mark.asyncio
+async def test_race_raises_primary_error_when_both_fail():
+    """测试主请求与对冲请求都失败时抛出主请求的异常"""
+
+    async def primary():
+        await asyncio.sleep(0.05)
+        raise TimeoutError("主地址超时")
+
+    async def hedge():
+        raise RuntimeError("备用地址不可用")
+
+    with pytest.raises(TimeoutError, match="主地址超时"):
+        await race(primary, hedge, delay=0.01, acquire=lambda: True)
+
+
+@pytest.mark.asyncio
+async def test_race_with_cancelled_primary():
+    """测试主请求被取消时不向调用方抛出 CancelledError：有对冲结果用对冲结果，否则抛出具体异常"""
+
+    async def cancelled():
+        await asyncio.sleep(0.02)
+        raise asyncio.CancelledError
+
+    async def hedge():
+        await asyncio.sleep(0.05)
+        return "hedge"
+
+    async def failing():
+        raise RuntimeError("备用地址不可用")
+
+    assert await race(cancelled, hedge, delay=0.01, acquire=lambda: True) == ("hedge", "hedge_won")
+    with pytest.raises(RuntimeError, match="备用地址不可用"):
+        await race(cancelled, failing, delay=0.01, acquire=lambda: True)
+    with pytest.raises(RuntimeError, match="取消"):
+        await race(cancelled, hedge, delay=1, acquire=lambda: True)
+    with pytest.raises(RuntimeError, match="取消"):
+        await race(cancelled, hedge, delay=0.01, acquire=lambda: False)
+
+
+@pytest.mark.asyncio
+async def test_race_hands_completed_loser_to_discard():
+    """测试落败方与胜出方同时完成时，落败方的结果交给 discard 而不是被丢弃"""
+    release = asyncio.Event()
+
+    async def primary():
+        await release.wait()
+        return "primary"
+
+    async def hedge():
+        release.set()
+        await release.wait()
+        return "hedge"
+
+    discarded = []
+    result, _ = await race(
+        primary, hedge, delay=0.01, acquire=lambda: True, discard=discarded.append
+    )
+    assert discarded == [{"primary": "hedge", "hedge": "primary"}[result]]
@@ -0,0 +1,204 @@
+"""异步任务服务测试（aiosqlite 替代真实数据库）"""
+
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+from sqlalchemy import update
+
+from src.app.core.config import settings
+from src.app.core.database import DatabaseService
+from src.app.services.jobs import (
+    CallbackURLError,
+    ChatJob,
+    JobQueue,
+    JobStatus,
+    pin_callback_url,
+    validate_callback_url,
+)
+
+
+@pytest.fixture
+async def db(tmp_path):
+    service = DatabaseService(f"sqlite+aiosqlite:///{tmp_path / 'jobs.db'}")
+    await service.init_db()  # 表由启用任务的进程在 start() 中创建
+    yield service
+    await service.close()
+
+
+@pytest.fixture
+def callback_hosts(monkeypatch):
+    monkeypatch.setattr(settings, "jobs_callback_allowed_hosts", ["callback.test", "*.example.com"])
+    monkeypatch.setattr(settings, "jobs_callback_schemes", ["http", "https"])
+
+
+async def wait_for_status(queue: JobQueue, job_id: str, status: JobStatus) -> dict:
+    for _ in range(200):
+        job = await queue.get(job_id)
+        if job["status"] == status.value:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"任务 {job_id} 未进入 {status.value} 状态")
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("callback_hosts")
+async def test_job_runs_in_background_and_notifies_callback(db):
+    """测试提交后立即返回 queued，后台执行完成后写入结果并回调（不跟随重定向）"""
+    queue = JobQueue(db=db, workers=2, poll_interval=10)
+    handler = AsyncMock(return_value={"reply": "答案"})
+
+    job = await queue.submit({"message": "问题"}, callback_url="http://callback.test/hook")
+    assert job["status"] == JobStatus.QUEUED.value
+
+    with (
+        patch("src.app.services.jobs._resolve_host", new=AsyncMock(return_value=["93.184.216.34"])),
+        patch("src.app.services.jobs.http_client.post", new=AsyncMock(return_value=Mock())) as post,
+    ):
+        await queue.start(handler)
+        finished = await wait_for_status(queue, job["job_id"], JobStatus.SUCCEEDED)
+        await queue.stop(timeout=1)
+
+    handler.assert_awaited_once_with({"message": "问题"})
+    assert finished["result"] == {"reply": "答案"}
+    assert finished["attempts"] == 1
+    assert post.await_args.kwargs["json_data"]["status"] == "succeeded"
+    assert post.await_args.kwargs["follow_redirects"] is False
+    # 连接发往校验过的 IP，不再二次解析
+    assert post.await_args.args[0] == "http://93.184.216.34/hook"
+    assert post.await_args.kwargs["headers"] == {"Host": "callback.test"}
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "ftp://callback.test/hook",
+        "http://evil.test/hook",
+        "http://10.0.0.1/hook",
+        "http://169.254.169.254/latest/meta-data",
+        "http://[::1]/hook",
+        "http://[::ffff:127.0.0.1]/hook",
+    ],
+)
+@pytest.mark.usefixtures("callback_hosts")
+def test_callback_url_outside_allowlist_is_rejected(monkeypatch, url):
+    """测试协议、主机不在白名单或指向内网/链路本地地址的回调在提交时被拒绝（即使地址在白名单中）"""
+    literals = ["10.0.0.1", "169.254.169.254", "::1", "::ffff:127.0.0.1"]
+    monkeypatch.setattr(
+        settings, "jobs_callback_allowed_hosts", [*settings.jobs_callback_allowed_hosts, *literals]
+    )
+    with pytest.raises(CallbackURLError):
+        validate_callback_url(url)
+
+
+@pytest.mark.usefixtures("callback_hosts")
+def test_callback_host_wildcard():
+    """测试白名单支持子域通配"""
+    assert validate_callback_url("https://hooks.example.com/cb") == "hooks.example.com"
+    with pytest.raises(CallbackURLError):
+        validate_callback_url("https://example.com.evil.test/cb")
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("callback_hosts")
+async def test_pinned_callback_keeps_host_and_sni():
+    """测试回调地址改写为校验过的 IP，Host 头与 SNI 保留原主机名与端口"""
+    with patch("src.app.services.jobs._resolve_host", new=AsyncMock(return_value=["2606:2800::1"])):
+        pinned, headers, extensions = await pin_callback_url(
+            "https://hooks.example.com:8443/cb?x=1"
+        )
+
+    assert pinned == "https://[2606:2800::1]:8443/cb?x=1"
+    assert headers == {"Host": "hooks.example.com:8443"}
+    assert extensions == {"sni_hostname": "hooks.example.com"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("callback_hosts")
+async def test_callback_resolving_to_private_address_is_not_sent(db):
+    """测试允许的主机名解析到内网地址时不发送回调，任务结果不受影响"""
+    queue = JobQueue(db=db, workers=1, poll_interval=10)
+    job = await queue.submit({"message": "问题"}, callback_url="http://callback.test/hook")
+
+    with (
+        patch("src.app.services.jobs._resolve_host", new=AsyncMock(return_value=["127.0.0.1"])),
+        patch("src.app.services.jobs.http_client.post", new=AsyncMock()) as post,
+    ):
+        await queue.start(AsyncMock(return_value={"reply": "答案"}))
+        await wait_for_status(queue, job["job_id"], JobStatus.SUCCEEDED)
+        await queue.stop(timeout=1)
+
+    post.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_failed_handler_marks_job_failed(db):
+    """测试执行异常时任务进入 failed 并记录原因"""
+    queue = JobQueue(db=db, workers=1, poll_interval=10)
+    job = await queue.submit({"message": "问题"})
+
+    await queue.start(AsyncMock(side_effect=RuntimeError("LLM 不可用")))
+    failed = await wait_for_status(queue, job["job_id"], JobStatus.FAILED)
+    await queue.stop(timeout=1)
+
+    assert failed["error"] == "LLM 不可用"
+
+
+@pytest.mark.asyncio
+async def test_stop_drains_running_job_without_claiming_new_ones(db):
+    """测试停止时先停止认领：进行中的任务完成，排队中的任务保持 queued 留给其他进程"""
+    queue = JobQueue(db=db, workers=1, poll_interval=10)
+    release = asyncio.Event()
+
+    async def handler(_request):
+        await release.wait()
+        return {"reply": "答案"}
+
+    first = await queue.submit({"message": "一"})
+    await queue.start(handler)
+    await wait_for_status(queue, first["job_id"], JobStatus.RUNNING)
+    second = await queue.submit({"message": "二"})
+
+    stopping = asyncio.create_task(queue.stop(timeout=1))
+    await asyncio.sleep(0.05)
+    release.set()
+    await stopping
+
+    assert (await queue.get(first["job_id"]))["status"] == JobStatus.SUCCEEDED.value
+    assert (await queue.get(second["job_id"]))["status"] == JobStatus.QUEUED.value
+
+
+@pytest.mark.asyncio
+async def test_stale_running_job_is_recovered_after_restart(db):
+    """测试 worker 失联遗留的 running 任务在续约过期后被新的 worker 重新执行"""
+    crashed = JobQueue(db=db, lease_seconds=30)
+    job = await crashed.submit({"message": "问题"})
+    async with db.get_session() as session:
+        await session.execute(
+            update(ChatJob)
+            .where(ChatJob.id == job["job_id"])
+            .values(
+                status=JobStatus.RUNNING.value,
+                attempts=1,
+                updated_at=datetime.utcnow() - timedelta(minutes=5),
+            )
+        )
+
+    restarted = JobQueue(db=db, workers=1, poll_interval=10, lease_seconds=30)
+    await restarted.start(AsyncMock(return_value={"reply": "恢复后的答案"}))
+    finished = await wait_for_status(restarted, job["job_id"], JobStatus.SUCCEEDED)
+    await restarted.stop(timeout=1)
+
+    assert finished["attempts"] == 2
+    assert finished["result"] == {"reply": "恢复后的答案"}
+
+
+@pytest.mark.asyncio
+async def test_job_is_claimed_only_once(db):
+    """测试同一任务被多个 worker 拉取时只执行一次"""
+    queue = JobQueue(db=db)
+    job = await queue.submit({"message": "问题"})
+
+    first, second = await asyncio.gather(queue._claim(job["job_id"]), queue._claim(job["job_id"]))
+    assert [first is None, second is None].count(True) == 1
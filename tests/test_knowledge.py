@@ -0,0 +1,32 @@
+"""知识检索服务测试"""
+
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from src.app.services.knowledge import KnowledgeService, shared_search_context
+
+
+@pytest.mark.asyncio
+async def test_identical_queries_share_one_call_in_shared_context():
+    """测试共享检索作用域内相同查询只调用一次 Tavily"""
+    service = KnowledgeService()
+    service.client = AsyncMock()
+    service.client.search = AsyncMock(
+        return_value={"results": [{"content": "内容", "url": "https://a.com", "score": 0.8}]}
+    )
+
+    context = shared_search_context()
+    tasks = [
+        asyncio.create_task(service.search(query), context=context)
+        for query in ("LangGraph 教程", "langgraph  教程", "其他查询")
+    ]
+    results = await asyncio.gather(*tasks)
+
+    assert service.client.search.await_count == 2
+    assert results[0] == results[1]
+
+    # 作用域外不共享
+    await service.search("LangGraph 教程")
+    assert service.client.search.await_count == 3
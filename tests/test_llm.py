@@ -0,0 +1,212 @@
+"""模型注册表测试"""
+
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.constants import TAG_NOSTREAM
+
+from src.app.core.metrics import metrics
+from src.app.services.accounting import accounting_scope
+from src.app.services.llm import ModelRegistry, ModelRole
+
+
+def test_role_config_merges_defaults_and_overrides():
+    """测试角色配置：默认参数 + LLM_ROLES 覆盖，未覆盖的角色沿用 DeepSeek 模型"""
+    registry = ModelRegistry(
+        overrides={"check": {"model": "fast-model", "base_url": "http://fast.local/v1"}}
+    )
+
+    check = registry.config(ModelRole.CHECK)
+    assert (check.model, check.base_url, check.temperature, check.max_tokens) == (
+        "fast-model",
+        "http://fast.local/v1",
+        0.0,
+        16,
+    )
+    assert registry.config(ModelRole.WRITE).temperature == 0.7
+    assert registry.get(ModelRole.CHECK) is not registry.get(ModelRole.WRITE)
+    assert registry.get(ModelRole.CHECK) is registry.get(ModelRole.CHECK)
+
+
+@pytest.mark.asyncio
+async def test_ainvoke_records_per_role_metrics():
+    """测试按角色记录调用延迟与 token 用量"""
+    registry = ModelRegistry(overrides={})
+    model = MagicMock()
+    model.ainvoke = AsyncMock(
+        return_value=AIMessage(
+            content="YES",
+            usage_metadata={"input_tokens": 30, "output_tokens": 1, "total_tokens": 31},
+        )
+    )
+    before = metrics.get_counter("llm_input_tokens_total", role="check")
+
+    with patch.object(registry, "get", return_value=model):
+        response = await registry.ainvoke(ModelRole.CHECK, [HumanMessage(content="问题")])
+
+    assert response.content == "YES"
+    assert metrics.get_counter("llm_input_tokens_total", role="check") == before + 30
+    assert metrics.percentile("llm_call_seconds", 0.5, role="check") >= 0
+
+
+@pytest.mark.asyncio
+async def test_astream_records_usage_from_final_chunk():
+    """测试流式调用逐块返回，并从末尾用量块记录 token"""
+    from langchain_core.messages import AIMessageChunk
+
+    registry = ModelRegistry(overrides={})
+    model = MagicMock()
+
+    async def astream(*_args, **_kwargs):
+        yield AIMessageChunk(content="SATIS")
+        yield AIMessageChunk(
+            content="FIED",
+            usage_metadata={"input_tokens": 40, "output_tokens": 2, "total_tokens": 42},
+        )
+
+    model.astream = astream
+    before = metrics.get_counter("llm_output_tokens_total", role="review")
+
+    with patch.object(registry, "get", return_value=model):
+        chunks = [c.content async for c in registry.astream(ModelRole.REVIEW, [])]
+
+    assert chunks == ["SATIS", "FIED"]
+    assert metrics.get_counter("llm_output_tokens_total", role="review") == before + 2
+
+
+@pytest.mark.asyncio
+async def test_failed_or_closed_calls_return_reserved_tokens():
+    """测试调用失败时归还预留的 token 额度，流提前关闭时只扣除已收到部分的估算"""
+    from langchain_core.messages import AIMessageChunk
+
+    from src.app.services.rate_limiter import RateScheduler
+
+    scheduler = RateScheduler(rpm=0, tpm=1_000_000)
+    registry = ModelRegistry(overrides={}, scheduler=scheduler)
+    model = MagicMock()
+    model.ainvoke = AsyncMock(side_effect=RuntimeError("连接断开"))
+
+    async def astream(*_args, **_kwargs):
+        yield AIMessageChunk(content="SATISFIED")
+        yield AIMessageChunk(content="多余的内容" * 100)
+
+    model.astream = astream
+
+    with patch.object(registry, "get", return_value=model):
+        with pytest.raises(RuntimeError):
+            await registry.ainvoke(ModelRole.CHECK, [HumanMessage(content="问题")])
+        assert scheduler.tokens.level >= 1_000_000 - 1
+
+        stream = registry.astream(ModelRole.REVIEW, [HumanMessage(content="问题")])
+        async for _chunk in stream:
+            break
+        await stream.aclose()
+
+    assert 1_000_000 - 50 < scheduler.tokens.level < 1_000_000
+
+
+@pytest.mark.asyncio
+async def test_cached_role_uses_zero_temperature_and_skips_repeat_calls():
+    """测试启用缓存的角色温度固定为 0，相同输入第二次直接命中缓存"""
+    from src.app.services.llm_cache import LLMCache
+
+    registry = ModelRegistry(overrides={}, cache=LLMCache(path=""), cache_roles=["refine"])
+    model = MagicMock()
+    model.ainvoke = AsyncMock(return_value=AIMessage(content="LangGraph 检查点"))
+    messages = [HumanMessage(content="优化查询")]
+    hits_before = metrics.get_counter("llm_cache_hits_total", role="refine", tier="memory")
+
+    assert registry.config(ModelRole.REFINE).temperature == 0.0
+    assert registry.config(ModelRole.WRITE).temperature == 0.7
+    with patch.object(registry, "get", return_value=model):
+        first = await registry.ainvoke(ModelRole.REFINE, messages)
+        second = await registry.ainvoke(ModelRole.REFINE, messages)
+        await registry.ainvoke(ModelRole.REFINE, messages, temperature=0.9)  # 非确定性调用不缓存
+        await registry.ainvoke(ModelRole.WRITE, messages)
+
+    assert first.content == second.content == "LangGraph 检查点"
+    assert model.ainvoke.await_count == 3
+    assert (
+        metrics.get_counter("llm_cache_hits_total", role="refine", tier="memory") == hits_before + 1
+    )
+
+
+@pytest.mark.asyncio
+async def test_hedged_call_uses_secondary_base_url(monkeypatch):
+    """测试主地址超过对冲时机未返回时，由备用地址的响应胜出并记录对冲率"""
+    import asyncio
+
+    from src.app.core.config import settings
+
+    monkeypatch.setattr(settings, "llm_hedge_enabled", True)
+    monkeypatch.setattr(settings, "llm_hedge_base_url", "http://backup.local/v1")
+    registry = ModelRegistry(overrides={}, cache_roles=[])
+    for _ in range(registry.hedge_policy.min_samples):
+        registry.hedge_policy.record("write", 0.01)
+
+    async def slow(*_args, **_kwargs):
+        await asyncio.sleep(5)
+
+    primary, backup = MagicMock(), MagicMock()
+    primary.ainvoke = slow
+    backup.ainvoke = AsyncMock(return_value=AIMessage(content="来自备用地址"))
+    models = {None: primary, "http://backup.local/v1": backup}
+
+    with (
+        patch.object(registry, "_model", side_effect=lambda config: models[config.base_url]),
+        accounting_scope() as accounting,
+    ):
+        response = await registry.ainvoke(ModelRole.WRITE, [HumanMessage(content="问题")])
+        await asyncio.sleep(0)  # 被取消的主请求在下一轮事件循环中记入核算
+
+    assert response.content == "来自备用地址"
+    # 落败的主请求同样计入运行核算（拿不到用量，按输入估算）
+    summary = accounting.summary()
+    assert summary["llm_calls"] == 2
+    assert summary["prompt_tokens"] > 0
+    assert metrics.get_gauge("llm_hedge_rate", role="write") > 0
+    # 对冲请求不挂图的回调，避免 token 事件重复
+    config = backup.ainvoke.await_args.kwargs["config"]
+    assert config["callbacks"] == []
+    assert TAG_NOSTREAM in config["tags"]
+
+
+@pytest.mark.asyncio
+async def test_streamed_node_is_not_hedged(monkeypatch):
+    """测试逐 token 推送的节点中的调用不对冲；其他节点记录的是主请求自身的延迟"""
+    import asyncio
+
+    from src.app.core.config import settings
+
+    monkeypatch.setattr(settings, "llm_hedge_enabled", True)
+    registry = ModelRegistry(overrides={}, cache_roles=[])
+    registry.hedge_policy.min_delay_seconds = 0.0
+    for _ in range(registry.hedge_policy.min_samples):
+        registry.hedge_policy.record("write", 0.0)
+
+    async def slow(*_args, **_kwargs):
+        await asyncio.sleep(0.02)
+        return AIMessage(content="回答")
+
+    model = MagicMock()
+    model.ainvoke = slow
+
+    with (
+        patch.object(registry, "_model", return_value=model),
+        patch("src.app.services.llm.current_node", return_value="writer"),
+        patch.object(registry, "get_hedge") as get_hedge,
+    ):
+        await registry.ainvoke(ModelRole.WRITE, [HumanMessage(content="问题")])
+    get_hedge.assert_not_called()
+
+    with (
+        patch.object(registry, "_model", return_value=model),
+        patch("src.app.services.llm.current_node", return_value="searcher"),
+        patch.object(registry.hedge_policy, "acquire", return_value=False),
+        patch.object(registry.hedge_policy, "record") as record,
+    ):
+        await registry.ainvoke(ModelRole.WRITE, [HumanMessage(content="问题")])
+
+    assert record.call_count == 1
+    assert record.call_args.args[1] >= 0.02
@@ -0,0 +1,69 @@
+"""LLM 响应缓存测试"""
+
+import pytest
+
+from src.app.services.llm_cache import LLMCache
+
+
+@pytest.mark.asyncio
+async def test_disk_tier_survives_restart_and_refills_memory(tmp_path):
+    """测试磁盘层跨实例命中，并回填内存层"""
+    path = str(tmp_path / "llm_cache.db")
+    cache = LLMCache(path=path)
+    await cache.set("k", "YES")
+    assert await cache.get("k") == ("YES", "memory")
+    cache.close()
+
+    restarted = LLMCache(path=path)
+    assert await restarted.get("k") == ("YES", "disk")
+    assert await restarted.get("k") == ("YES", "memory")
+    assert await restarted.get("missing") is None
+    restarted.close()
+
+
+@pytest.mark.asyncio
+async def test_limits_and_ttl(tmp_path, monkeypatch):
+    """测试内存层 LRU 淘汰、磁盘层条目上限与 TTL"""
+    import src.app.services.llm_cache as module
+
+    now = [1000.0]
+    monkeypatch.setattr(module.time, "time", lambda: now[0])
+    cache = LLMCache(
+        path=str(tmp_path / "llm_cache.db"),
+        memory_max_entries=1,
+        memory_ttl_seconds=10,
+        disk_max_entries=2,
+        disk_ttl_seconds=100,
+    )
+    for key in ("a", "b", "c"):
+        await cache.set(key, key.upper())
+        now[0] += 1
+
+    assert len(cache) == 1
+    assert await cache.get("a") is None  # 磁盘层只保留最近的 2 条
+    assert await cache.get("b") == ("B", "disk")
+
+    now[0] += 100
+    assert await cache.get("c") is None
+    cache.close()
+
+
+@pytest.mark.asyncio
+async def test_disk_eviction_is_batched(tmp_path):
+    """测试磁盘层超出上限一定比例后才批量淘汰回上限，而不是每次写入都淘汰"""
+    import sqlite3
+
+    path = tmp_path / "llm_cache.db"
+    cache = LLMCache(path=str(path), disk_max_entries=10)
+
+    def rows() -> int:
+        with sqlite3.connect(path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    for i in range(11):
+        await cache.set(f"k{i}", "v")
+    assert rows() == 11
+    await cache.set("k11", "v")
+    assert rows() == 10
+    assert await cache.get("k0") == ("v", "memory")  # 内存层不受磁盘淘汰影响
+    cache.close()
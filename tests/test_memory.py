@@ -0,0 +1,75 @@
+"""会话记忆测试（aiosqlite 替代真实数据库）"""
+
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from src.app.core.database import DatabaseService
+from src.app.core.tokens import estimate_tokens
+from src.app.services.memory import ConversationMemory
+
+
+@pytest.fixture
+async def memory(tmp_path):
+    db = DatabaseService(f"sqlite+aiosqlite:///{tmp_path / 'memory.db'}")
+    yield ConversationMemory(db=db, history_token_budget=60, summary_token_budget=20)
+    await db.close()
+
+
+@pytest.mark.asyncio
+async def test_load_unknown_conversation_is_empty(memory):
+    """测试不存在的会话返回空历史"""
+    assert await memory.load("missing") == []
+
+
+@pytest.mark.asyncio
+async def test_append_and_load_turns(memory):
+    """测试追加轮次后按顺序加载"""
+    await memory.append_turn("c1", "你好", "你好！有什么可以帮你？")
+    await memory.append_turn("c1", "介绍一下 LangGraph", "LangGraph 是一个编排框架")
+
+    history = await memory.load("c1")
+    assert [type(m) for m in history] == [HumanMessage, AIMessage, HumanMessage, AIMessage]
+    assert history[-1].content == "LangGraph 是一个编排框架"
+
+
+@pytest.mark.asyncio
+async def test_old_turns_are_compacted_into_summary(memory):
+    """测试超出预算时旧轮次被压缩，加载的历史保持在预算内"""
+    mock_llm = AsyncMock()
+    mock_llm.ainvoke = AsyncMock(return_value=AIMessage(content="用户询问了天气和交通"))
+    with patch("src.app.services.memory.model_registry.get", return_value=mock_llm):
+        for i in range(6):
+            await memory.append_turn("c2", f"第{i}个问题：今天的天气怎么样", f"第{i}个回答：晴天")
+
+    history = await memory.load("c2")
+    assert isinstance(history[0], SystemMessage)
+    assert "用户询问了天气和交通" in history[0].content
+    assert mock_llm.ainvoke.await_count >= 1
+    assert sum(estimate_tokens(str(m.content)) for m in history) <= 60
+
+
+@pytest.mark.asyncio
+async def test_concurrent_turns_are_not_lost(memory):
+    """测试同一会话的并发轮次（含另一进程的写入）都被保留"""
+    other = ConversationMemory(db=memory.db, history_token_budget=60, summary_token_budget=20)
+    assert await memory.load("c3") == await other.load("c3") == []  # 先建表
+    await asyncio.gather(
+        memory.append_turn("c3", "问题一", "回答一"),
+        memory.append_turn("c3", "问题二", "回答二"),
+        other.append_turn("c3", "问题三", "回答三"),
+    )
+
+    contents = {str(m.content) for m in await memory.load("c3")}
+    assert {"问题一", "问题二", "问题三", "回答一", "回答二", "回答三"} <= contents
+
+
+@pytest.mark.asyncio
+async def test_load_waits_for_scheduled_append(memory):
+    """测试后台持久化尚未完成时，加载会等待上一轮写入"""
+    memory.schedule_append("c4", "你好", "你好！")
+
+    history = await memory.load("c4")
+    assert [m.content for m in history] == ["你好", "你好！"]
@@ -0,0 +1,27 @@
+"""进程内指标测试"""
+
+from src.app.core.metrics import MetricsRegistry
+
+
+def test_counters_and_gauges_with_labels():
+    """测试计数器与仪表盘按标签区分"""
+    registry = MetricsRegistry()
+    registry.inc("requests_total", mode="stream")
+    registry.inc("requests_total", 2, mode="stream")
+    registry.set_gauge("in_flight", 3)
+
+    assert registry.get_counter("requests_total", mode="stream") == 3
+    assert registry.get_counter("requests_total", mode="sync") == 0
+    assert registry.snapshot()["gauges"]["in_flight"] == 3
+
+
+def test_histogram_percentiles():
+    """测试直方图分位数"""
+    registry = MetricsRegistry(window=100)
+    for i in range(1, 101):
+        registry.observe("latency_seconds", i / 100)
+
+    summary = registry.snapshot()["histograms"]["latency_seconds"]
+    assert summary["count"] == 100
+    assert summary["p50"] == 0.5
+    assert summary["p99"] == 0.99
@@ -0,0 +1,64 @@
+"""提示词组装与前缀缓存统计测试"""
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from src.app.core.metrics import metrics
+from src.app.core.prompts import (
+    GENERATE_SYSTEM_PROMPT_BASE,
+    build_writer_messages,
+    cached_prompt_tokens,
+    record_prompt_cache,
+)
+
+
+def test_writer_prefix_is_stable_across_dynamic_context():
+    """测试知识与反思变化时，静态 System Prompt 与历史组成的前缀保持不变"""
+    history = [HumanMessage(content="上一个问题"), AIMessage(content="上一个回答")]
+    question = HumanMessage(content="LangGraph 是什么")
+
+    first = build_writer_messages([*history, question], "知识 A")
+    second = build_writer_messages([*history, question], "知识 B", "补充细节")
+
+    assert first[:3] == second[:3]
+    assert first[0] == SystemMessage(content=GENERATE_SYSTEM_PROMPT_BASE)
+    assert "知识 B" in second[3].content and "补充细节" in second[3].content
+    assert first[-1] is question and second[-1] is question
+    assert len(build_writer_messages([question])) == 2  # 无动态内容时不插入额外消息
+
+
+def test_conversation_summary_is_merged_into_leading_system_prompt():
+    """测试会话摘要并入开头的 System Prompt，不作为对话中间的系统消息"""
+    summary = SystemMessage(content="以下是之前对话的摘要：\n用户在学习 LangGraph")
+    history = [summary, HumanMessage(content="上一个问题"), AIMessage(content="上一个回答")]
+    question = HumanMessage(content="LangGraph 是什么")
+
+    messages = build_writer_messages([*history, question], "知识 A")
+
+    assert messages[0].content.startswith(GENERATE_SYSTEM_PROMPT_BASE)
+    assert "用户在学习 LangGraph" in messages[0].content
+    assert [type(m) for m in messages[1:3]] == [HumanMessage, AIMessage]
+
+
+def test_cache_hit_ratio_per_template():
+    """测试从 usage 元数据读取缓存命中 token 并按模板计算命中率"""
+    standard = AIMessage(
+        content="",
+        usage_metadata={
+            "input_tokens": 100,
+            "output_tokens": 10,
+            "total_tokens": 110,
+            "input_token_details": {"cache_read": 80},
+        },
+    )
+    deepseek = AIMessage(
+        content="",
+        usage_metadata={"input_tokens": 100, "output_tokens": 10, "total_tokens": 110},
+        response_metadata={"token_usage": {"prompt_cache_hit_tokens": 40}},
+    )
+    assert cached_prompt_tokens(standard) == 80
+    assert cached_prompt_tokens(deepseek) == 40
+
+    template = "test_template"
+    record_prompt_cache(template, standard)
+    record_prompt_cache(template, deepseek)
+    assert metrics.get_gauge("prompt_cache_hit_ratio", template=template) == 0.6
@@ -0,0 +1,63 @@
+"""LLM 调用速率调度测试"""
+
+import asyncio
+
+import pytest
+
+from src.app.core.metrics import metrics
+from src.app.services.rate_limiter import (
+    Priority,
+    RateScheduler,
+    llm_priority,
+    priority_for_severity,
+)
+
+
+def test_severity_maps_to_priority():
+    """测试事件严重级别映射到调用优先级"""
+    from src.sre.agents.shared.state import Severity
+
+    assert priority_for_severity(Severity.CRITICAL) is Priority.CRITICAL
+    assert priority_for_severity("medium") is Priority.NORMAL
+    assert priority_for_severity("unknown") is Priority.NORMAL
+
+
+@pytest.mark.asyncio
+async def test_queued_calls_are_released_by_priority():
+    """测试额度耗尽时按优先级放行：后到的 CRITICAL 调用排在先到的 LOW 调用之前"""
+    scheduler = RateScheduler(rpm=6000, tpm=0)  # 每 10ms 补充一次请求额度
+    scheduler.requests.level = 0
+    order: list[str] = []
+
+    async def call(name: str, priority: Priority) -> None:
+        with llm_priority(priority):
+            await scheduler.acquire(10)
+        order.append(name)
+
+    low = asyncio.create_task(call("low", Priority.LOW))
+    await asyncio.sleep(0)
+    critical = asyncio.create_task(call("critical", Priority.CRITICAL))
+    await asyncio.gather(low, critical)
+
+    assert order == ["critical", "low"]
+    assert metrics.percentile("llm_queue_wait_seconds", 50, priority="critical") > 0
+
+
+@pytest.mark.asyncio
+async def test_limits_adapt_to_headers_and_usage():
+    """测试按限流响应头调整额度，并以实际用量修正预估"""
+    scheduler = RateScheduler(rpm=0, tpm=0)
+    await scheduler.acquire(100)  # 未限制时直接放行
+
+    scheduler.observe_headers(
+        {"X-RateLimit-Limit-Tokens": "1000", "X-RateLimit-Remaining-Tokens": "300"}
+    )
+    assert scheduler.tokens.limit == 1000
+    assert scheduler.tokens.level <= 300
+    assert scheduler.tokens.wait_time(500) > 0
+
+    scheduler.settle(estimated=500, actual=100)
+    assert scheduler.tokens.level >= 700
+
+    scheduler.on_rate_limited({"retry-after": "2"})
+    assert scheduler._ready_in(1) > 1
@@ -0,0 +1,50 @@
+"""检索需求本地分类器测试"""
+
+import json
+
+import pytest
+
+from src.app.services.retrieval_classifier import RetrievalClassifier
+
+
+def test_rules_decide_obvious_cases():
+    """测试问候走规则判 NO，时效性问题走规则判 YES，其余交给 LLM"""
+    classifier = RetrievalClassifier(log_path="", min_samples=10)
+
+    greeting = classifier.classify("你好！")
+    assert (greeting.need_knowledge, greeting.source) == (False, "rule")
+    news = classifier.classify("2025年最新的 Python 版本是多少")
+    assert (news.need_knowledge, news.source) == (True, "rule")
+    assert classifier.classify("解释一下量子纠缠") is None
+
+
+@pytest.mark.asyncio
+async def test_model_trained_from_decision_log(tmp_path):
+    """测试从决策日志训练模型，置信时本地决定，新的判断被追加到日志"""
+    log_path = tmp_path / "decisions.jsonl"
+    samples = [("介绍一下 LangGraph 的状态图", True), ("LangGraph 的检查点怎么用", True)] * 10
+    samples += [("给我讲个笑话吧", False), ("帮我把这句话润色一下", False)] * 10
+    log_path.write_text(
+        "".join(json.dumps({"message": m, "need_knowledge": n}) + "\n" for m, n in samples),
+        encoding="utf-8",
+    )
+
+    classifier = RetrievalClassifier(log_path=str(log_path), threshold=0.9, min_samples=20)
+    decision = classifier.classify("LangGraph 的状态图如何定义")
+    assert (decision.need_knowledge, decision.source) == (True, "model")
+    assert classifier.classify("讲个笑话").need_knowledge is False
+
+    classifier.record("量子纠缠是什么", True)
+    classifier.record("今天心情不错", False)
+    await classifier.drain(timeout=1)
+    assert len(log_path.read_text(encoding="utf-8").splitlines()) == len(samples) + 2
+
+
+def test_style_only_reflection():
+    """测试只涉及表达方式的反思意见被识别，指出事实缺失的不算"""
+    from src.app.services.retrieval_classifier import is_style_only
+
+    assert is_style_only("回答过于冗长，语气可以更友好")
+    assert is_style_only("Improve the formatting and tone")
+    assert not is_style_only("格式不错，但缺少最新的版本数据")
+    assert not is_style_only("回答基本正确")
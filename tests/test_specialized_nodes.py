@@ -49,3 +49,278 @@ async def test_reviewer_agent_satisfied(mock_llm):
     result = await reviewer_agent(state)
     assert result["is_satisfied"] is True
     assert result["next_agent"] == "end"
+
+
+@pytest.fixture
+def speculative(monkeypatch):
+    from src.app.core.config import settings
+
+    monkeypatch.setattr(settings, "speculative_retrieval", True)
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("speculative")
+async def test_searcher_agent_speculative_search_used(mock_llm):
+    """测试投机检索：判断为 YES 时复用与判断并行发起的检索结果"""
+    from unittest.mock import patch
+
+    from src.app.core.metrics import metrics
+
+    mock_llm.ainvoke = AsyncMock(return_value=AIMessage(content="YES"))
+    state = {"messages": [HumanMessage(content="LangGraph 是什么")], "knowledge_context": ""}
+    used_before = metrics.get_counter("speculative_search_total", outcome="used")
+
+    with patch("src.app.agents.specialized_nodes.knowledge_service") as service:
+        service.search = AsyncMock(return_value=[{"content": "图编排框架", "source": "docs"}])
+        result = await searcher_agent(state)
+
+    service.search.assert_awaited_once_with("LangGraph 是什么")
+    assert "图编排框架" in result["knowledge_context"]
+    assert metrics.get_counter("speculative_search_total", outcome="used") == used_before + 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("speculative")
+async def test_searcher_agent_speculative_search_discarded(mock_llm):
+    """测试投机检索：判断为 NO 时丢弃检索结果并计入浪费"""
+    from unittest.mock import patch
+
+    from src.app.core.metrics import metrics
+
+    mock_llm.ainvoke = AsyncMock(return_value=AIMessage(content="NO"))
+    state = {"messages": [HumanMessage(content="你好")], "knowledge_context": ""}
+    wasted_before = metrics.get_counter("speculative_search_total", outcome="wasted")
+
+    with patch("src.app.agents.specialized_nodes.knowledge_service") as service:
+        service.search = AsyncMock(return_value=[{"content": "无关结果", "source": "web"}])
+        result = await searcher_agent(state)
+
+    assert result["need_knowledge"] is False
+    assert result["knowledge_context"] == ""
+    assert metrics.get_counter("speculative_search_total", outcome="wasted") == wasted_before + 1
+
+
+@pytest.mark.asyncio
+async def test_searcher_agent_local_classifier_skips_llm(mock_llm, monkeypatch):
+    """测试本地分类器开启时，问候语不再调用 LLM 判断"""
+    from src.app.core.config import settings
+
+    monkeypatch.setattr(settings, "retrieval_classifier_mode", "on")
+    state = {"messages": [HumanMessage(content="你好")], "knowledge_context": ""}
+
+    result = await searcher_agent(state)
+    assert result["need_knowledge"] is False
+    mock_llm.ainvoke.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_searcher_agent_classifier_shadow_mode_uses_llm(mock_llm, monkeypatch):
+    """测试影子模式仍以 LLM 为准，并统计与本地判断的一致率"""
+    from unittest.mock import patch
+
+    from src.app.core.config import settings
+    from src.app.core.metrics import metrics
+
+    monkeypatch.setattr(settings, "retrieval_classifier_mode", "shadow")
+    mock_llm.ainvoke = AsyncMock(return_value=AIMessage(content="YES"))
+    state = {"messages": [HumanMessage(content="你好")], "knowledge_context": ""}
+    disagree_before = metrics.get_counter("retrieval_classifier_shadow_total", agree="false")
+
+    with patch("src.app.agents.specialized_nodes.knowledge_service") as service:
+        service.search = AsyncMock(return_value=[])
+        result = await searcher_agent(state)
+
+    assert result["need_knowledge"] is True
+    mock_llm.ainvoke.assert_awaited_once()
+    assert (
+        metrics.get_counter("retrieval_classifier_shadow_total", agree="false")
+        == disagree_before + 1
+    )
+    assert metrics.get_gauge("retrieval_classifier_agreement") < 1.0
+
+
+def test_parse_selection_falls_back_to_first():
+    """测试 BEST 编号解析，越界或缺失时选第一个候选"""
+    from src.app.agents.specialized_nodes import parse_selection
+
+    assert parse_selection("理由……\nBEST: 3", 3) == 2
+    assert parse_selection("BEST：[2]", 3) == 1
+    assert parse_selection("BEST: 9", 3) == 0
+    assert parse_selection("都不错", 3) == 0
+
+
+@pytest.mark.asyncio
+async def test_searcher_agent_skips_style_only_reflection(mock_llm):
+    """测试反思意见只涉及表达方式时不调用 LLM、不检索"""
+    from unittest.mock import patch
+
+    state = {
+        "messages": [HumanMessage(content="LangGraph 是什么")],
+        "knowledge_context": "已有知识",
+        "reflection": "回答过于冗长，请精简并分点说明",
+    }
+
+    with patch("src.app.agents.specialized_nodes.knowledge_service") as service:
+        service.search = AsyncMock()
+        result = await searcher_agent(state)
+
+    assert result["need_knowledge"] is False
+    assert result["knowledge_context"] == "已有知识"
+    mock_llm.ainvoke.assert_not_awaited()
+    service.search.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_searcher_agent_delta_retrieval_skips_seen_queries_and_sources(mock_llm):
+    """测试反思轮次只执行新的补充查询，并丢弃已见过的来源"""
+    from unittest.mock import patch
+
+    from src.app.agents.context import update_knowledge
+
+    first = [{"content": "LangGraph 是图编排框架", "source": "https://a.com/intro", "score": 0.8}]
+    state = {
+        "messages": [HumanMessage(content="LangGraph 是什么")],
+        "reflection": "缺少检查点机制的说明",
+        "searched_queries": ["langgraph 是什么"],
+        **update_knowledge({}, first, "LangGraph 是什么"),
+    }
+    mock_llm.ainvoke = AsyncMock(
+        return_value=AIMessage(content="1. LangGraph 是什么\n2. LangGraph 检查点\nNONE")
+    )
+
+    with patch("src.app.agents.specialized_nodes.knowledge_service") as service:
+        service.search = AsyncMock(
+            return_value=[
+                {"content": "重复抓取的页面", "source": "https://a.com/intro/", "score": 0.9},
+                {"content": "检查点用于持久化状态", "source": "https://b.com/cp", "score": 0.7},
+            ]
+        )
+        result = await searcher_agent(state)
+
+    service.search.assert_awaited_once_with("LangGraph 检查点")
+    assert result["searched_queries"] == ["langgraph 是什么", "langgraph 检查点"]
+    assert [item["source"] for item in result["knowledge_items"]] == [
+        "https://a.com/intro",
+        "https://b.com/cp",
+    ]
+    assert "重复抓取的页面" not in result["knowledge_context"]
+
+
+@pytest.mark.asyncio
+async def test_writer_agent_patch_revision(mock_llm, monkeypatch):
+    """测试补丁模式下反思轮次应用编辑指令，指令无效时回退为整篇重写"""
+    from src.app.core.config import settings
+
+    monkeypatch.setattr(settings, "writer_revision_mode", "patch")
+    state = {
+        "messages": [HumanMessage(content="LangGraph 是什么")],
+        "knowledge_context": "",
+        "current_answer": "LangGraph 是一个框架。",
+        "reflection": "缺少用途说明",
+        "iteration": 1,
+    }
+    edits = '[{"op": "append", "text": "它用于构建有状态的多步 Agent。"}]'
+    mock_llm.ainvoke = AsyncMock(return_value=AIMessage(content=edits))
+
+    result = await writer_agent(state)
+    assert result["current_answer"] == "LangGraph 是一个框架。\n\n它用于构建有状态的多步 Agent。"
+    assert result["iteration"] == 2
+    assert mock_llm.ainvoke.await_count == 1
+
+    mock_llm.ainvoke = AsyncMock(
+        side_effect=[AIMessage(content="无法给出编辑指令"), AIMessage(content="重写后的回答")]
+    )
+    result = await writer_agent(state)
+    assert result["current_answer"] == "重写后的回答"
+
+
+@pytest.mark.asyncio
+async def test_reviewer_agent_stops_stream_once_satisfied(mock_llm):
+    """测试评估结论为满意时立即停止读取流式输出"""
+    consumed: list[str] = []
+    closed = False
+
+    async def astream(*_args, **_kwargs):
+        nonlocal closed
+        try:
+            for piece in ["SATIS", "FIED", "\n", "以下是", "多余的解释"]:
+                consumed.append(piece)
+                yield AIMessage(content=piece)
+        finally:
+            closed = True
+
+    mock_llm.astream = astream
+    state = {
+        "messages": [HumanMessage(content="1+1=?")],
+        "current_answer": "1+1=2",
+        "knowledge_context": "",
+        "iteration": 1,
+    }
+
+    result = await reviewer_agent(state)
+    assert result["is_satisfied"] is True
+    assert consumed == ["SATIS", "FIED", "\n"]
+    assert closed
+
+
+@pytest.mark.asyncio
+async def test_reviewer_agent_collects_full_reflection(mock_llm):
+    """测试需要改进时读完全部改进意见"""
+
+    async def astream(*_args, **_kwargs):
+        for piece in ["NEEDS_IMPROVEMENT\n", "缺少示例，", "达到 SATISFIED 还需补充数据"]:
+            yield AIMessage(content=piece)
+
+    mock_llm.astream = astream
+    state = {
+        "messages": [HumanMessage(content="LangGraph 是什么")],
+        "current_answer": "一个框架",
+        "knowledge_context": "",
+        "iteration": 1,
+    }
+
+    result = await reviewer_agent(state)
+    assert result["is_satisfied"] is False
+    assert result["reflection"] == "缺少示例，达到 SATISFIED 还需补充数据"
+    assert result["next_agent"] == "searcher"
+
+
+@pytest.mark.asyncio
+async def test_stream_verdict_without_keyword_needs_improvement(mock_llm):
+    """测试评估输出为空时按需要改进处理"""
+    from src.app.agents.specialized_nodes import stream_verdict
+    from src.app.agents.verdict import Verdict
+
+    async def astream(*_args, **_kwargs):
+        for piece in ["", ""]:
+            yield AIMessage(content=piece)
+
+    mock_llm.astream = astream
+
+    assert await stream_verdict([HumanMessage(content="评估")]) == (Verdict.NEEDS_IMPROVEMENT, "")
+
+
+@pytest.mark.asyncio
+async def test_reviewer_agent_ignores_satisfied_in_prose(mock_llm):
+    """测试正文中的 satisfied 不会让评估提前结束"""
+
+    async def astream(*_args, **_kwargs):
+        for piece in [
+            "The user would be satisfied ",
+            "only with examples.\n",
+            "NEEDS_IMPROVEMENT\n",
+            "补充示例",
+        ]:
+            yield AIMessage(content=piece)
+
+    mock_llm.astream = astream
+    state = {
+        "messages": [HumanMessage(content="LangGraph 是什么")],
+        "current_answer": "一个框架",
+        "knowledge_context": "",
+        "iteration": 1,
+    }
+
+    result = await reviewer_agent(state)
+    assert result["is_satisfied"] is False
+    assert result["reflection"].endswith("补充示例")